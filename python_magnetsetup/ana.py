@@ -7,6 +7,9 @@ import os
 import json
 import yaml
 import math
+import hashlib
+
+import numpy as np
 
 import argparse
 from .objects import load_object, load_object_from_db
@@ -19,20 +22,129 @@ from .file_utils import MyOpen, findfile, search_paths
 
 import MagnetTools.MagnetTools as mt
 
-def HMagnet(MyEnv, struct: Insert, data: dict, debug: bool=False):
+# Intermediate representation of analytic models:
+# each kind of element is stored as a dict of numpy arrays
+# with fields given in the order of MagnetTools constructors
+# eg mt.BitterMagnet(r2, r1, h, current_density, z_offset, fillingfactor, rho)
+fields = ["r2", "r1", "h", "j", "z_offset", "fillingfactor", "rho"]
+tube_fields = ["n", "r1", "r2", "h", "index", "offset"]
+section_fields = ["pitch", "turns"]
+kinds = {
+    "Helices": mt.BitterMagnet,
+    "OHelices": mt.BitterMagnet,
+    "BMagnets": mt.BitterMagnet,
+    "UMagnets": mt.UnifMagnet,
+}
+
+def empty_data() -> dict:
     """
-    create view of this insert as a Helices Magnet
+    returns an empty intermediate representation
+    """
+    data = {
+        "Tubes": {key: np.empty(0) for key in tube_fields},
+        "Sections": {key: np.empty(0) for key in section_fields},
+    }
+    for kind in kinds:
+        data[kind] = {key: np.empty(0) for key in fields}
+    return data
 
-    b=mt.BitterfMagnet(r2, r1, h, current_density, z_offset, fillingfactor, rho)
+def elements_data(elements: List[tuple]) -> dict:
+    """
+    convert a list of (r2, r1, h, j, z_offset, fillingfactor, rho) to arrays
+    """
+    values = np.array(elements, dtype=float).reshape(-1, len(fields))
+    return {key: values[:, i] for i, key in enumerate(fields)}
+
+def merge_data(data: dict, other: dict) -> dict:
+    """
+    append other intermediate representation to data
+    """
+    noffset = len(data["Sections"]["pitch"])
+    for kind in other:
+        for key in other[kind]:
+            values = other[kind][key]
+            if kind == "Tubes" and key == "offset":
+                values = values + noffset
+            data[kind][key] = np.concatenate((data[kind][key], values))
+    return data
+
+def save_data(filename: str, data: dict):
+    """
+    save intermediate representation as a npz file
+    """
+    arrays = {f"{kind}.{key}": data[kind][key] for kind in data for key in data[kind]}
+    np.savez(filename, **arrays)
+
+def load_data(filename: str) -> dict:
+    """
+    load intermediate representation from a npz file
+    """
+    data = empty_data()
+    with np.load(filename) as arrays:
+        for name in arrays.files:
+            (kind, key) = name.split(".")
+            data[kind][key] = arrays[name]
+    return data
+
+def create_elements(data: dict, kind: str):
+    """
+    create MagnetTools vector of kind from its intermediate representation
+
+    MagnetTools has no array constructor: elements are still created one by one,
+    only their parameters are computed with numpy (eg. tapes_data)
+    """
+    if kind == "UMagnets":
+        vector = mt.VectorOfUnifs()
+    else:
+        vector = mt.VectorOfBitters()
+
+    ctor = kinds[kind]
+    for args in zip(*[data[kind][key].tolist() for key in fields]):
+        vector.append(ctor(*args))
+    return vector
+
+def create_tubes(data: dict):
+    """
+    create MagnetTools vector of Tubes from its intermediate representation
+    """
+    Tubes = mt.VectorOfTubes()
+    tubes = data["Tubes"]
+    sections = data["Sections"]
+    offsets = np.append(tubes["offset"], len(sections["pitch"])).astype(int)
+    for i in range(len(tubes["n"])):
+        Tube = mt.Tube(int(tubes["n"][i]), float(tubes["r1"][i]), float(tubes["r2"][i]), float(tubes["h"][i]))
+        Tube.set_index(int(tubes["index"][i]))
+        for k in range(offsets[i], offsets[i+1]):
+            Tube.set_pitch(float(sections["pitch"][k]))
+            Tube.set_nturn(int(sections["turns"][k]))
+        Tubes.append(Tube)
+    return Tubes
+
+def create_model(data: dict):
+    """
+    create MagnetTools data struct from intermediate representation
+    """
+    Tubes = create_tubes(data)
+    Helices = create_elements(data, "Helices")
+    OHelices = create_elements(data, "OHelices")
+    BMagnets = create_elements(data, "BMagnets")
+    UMagnets = create_elements(data, "UMagnets")
+    Shims = mt.VectorOfShims()
+    return (Tubes,Helices,OHelices,BMagnets,UMagnets,Shims)
+
+def HMagnet_data(MyEnv, struct: Insert, data: dict, debug: bool=False) -> dict:
+    """
+    create view of this insert as a Helices Magnet (intermediate representation)
     """
     print("HMagnet:", data)
 
     # how to create Tubes??
     #Tube(const int n= len(struct.axi.turns), const MyDouble r1 = struct.r[0], const MyDouble r2 = struct.r[1], const MyDouble l = struct.axi.h??)
 
-    Tubes = mt.VectorOfTubes()
-    Helices = mt.VectorOfBitters()
-    OHelices = mt.VectorOfBitters()
+    hdata = empty_data()
+    tubes = []
+    cads = []
+    materials = []
 
     index = 0
     for helix in data["Helix"]:
@@ -45,39 +157,94 @@ def HMagnet(MyEnv, struct: Insert, data: dict, debug: bool=False):
         r1 = cad.r[0]
         r2 = cad.r[1]
         h = cad.axi.h
+        # Tube only needed to get the number of elements
         Tube = mt.Tube(nturns, r1*1.e-3, r2*1.e-3, h*1.e-3)
-        Tube.set_index(index)
-        print("index:", index, Tube.get_index())
+        print("index:", index)
         print("cad.axi:", cad.axi)
-        for (n, pitch) in zip(cad.axi.turns,cad.axi.pitch):
-            Tube.set_pitch(pitch*1.e-3)
-            Tube.set_nturn(n)
-
-        Tubes.append( Tube )
-        fillingfactor = 1
-        tmp = BMagnet(cad, material, fillingfactor, debug)
-        for item in tmp:
-            Helices.append(item)
+        tubes.append((nturns, r1*1.e-3, r2*1.e-3, h*1.e-3, index, 0))
+        cads.append(cad)
+        materials.append(material)
         index += Tube.get_n_elem()
 
-    print("HMagnet:", struct.name, "Tubes:", len(Tubes), "Helices:", len(Helices))
-    return (Tubes, Helices, OHelices)
+    values = np.array(tubes, dtype=float).reshape(-1, len(tube_fields))
+    hdata["Tubes"] = {key: values[:, i] for i, key in enumerate(tube_fields)}
 
-def BMagnet(struct: Bitter, material: dict, fillingfactor: float=1, debug: bool=False):
+    # sections of all helices at once
+    counts = np.array([len(cad.axi.turns) for cad in cads], dtype=int)
+    hdata["Tubes"]["offset"] = (np.cumsum(counts) - counts).astype(float)
+    hdata["Sections"] = {
+        "pitch": np.array([p for cad in cads for p in cad.axi.pitch], dtype=float) * 1.e-3,
+        "turns": np.array([n for cad in cads for n in cad.axi.turns], dtype=float),
+    }
+    hdata["Helices"] = sections_data(cads, materials, debug)
+
+    print("HMagnet:", struct.name, "Tubes:", len(tubes), "Helices:", len(hdata["Helices"]["r1"]))
+    return hdata
+
+def HMagnet(MyEnv, struct: Insert, data: dict, debug: bool=False):
     """
-    create view of this insert as a Bitter Magnet
+    create view of this insert as a Helices Magnet
+
+    b=mt.BitterfMagnet(r2, r1, h, current_density, z_offset, fillingfactor, rho)
+    """
+    hdata = HMagnet_data(MyEnv, struct, data, debug)
+    return (create_tubes(hdata), create_elements(hdata, "Helices"), create_elements(hdata, "OHelices"))
+
+def sections_data(structs: List[Bitter], materials: List[dict], debug: bool=False) -> dict:
+    """
+    create view of helices or bitters as Bitter Magnets, one per section (intermediate representation)
+
+    sections of all structs are processed at once:
+    z positions are obtained by cumulative sums of section heights within each struct
+
+    structs: geometries of the helices or bitter stacks
+    materials: physical properties of copper alloy of each struct
+    """
+    counts = np.array([len(struct.axi.turns) for struct in structs], dtype=int)
+    n = np.array([n for struct in structs for n in struct.axi.turns], dtype=float)
+    pitch = np.array([p for struct in structs for p in struct.axi.pitch], dtype=float) * 1.e-3
+
+    r1 = np.repeat(np.array([struct.r[0] for struct in structs], dtype=float) * 1.e-3, counts)
+    r2 = np.repeat(np.array([struct.r[1] for struct in structs], dtype=float) * 1.e-3, counts)
+    z0 = np.repeat(np.array([-struct.axi.h for struct in structs], dtype=float) * 1.e-3, counts)
+    rho = np.repeat(np.array([1/ material["ElectricalConductivity"] for material in materials], dtype=float), counts)
+
+    dz = n * pitch
+    # z at the bottom of each section, restarting for each struct
+    z = np.cumsum(dz) - dz
+    starts = np.cumsum(counts) - counts
+    z = z - np.repeat(np.append(z, 0)[starts], counts) + z0
+
+    # f = fillingfactor # 1/struct.get_Nturns() # struct.getFillingFactor()
+    return {
+        "r2": r2,
+        "r1": r1,
+        "h": dz,
+        "j": n / (r1 * np.log(r2/r1) * dz),
+        "z_offset": z + dz/2.,
+        "fillingfactor": 1/n,
+        "rho": rho,
+    }
+
+def BMagnet_data(struct: Bitter, material: dict, fillingfactor: float=1, debug: bool=False) -> dict:
+    """
+    create view of this insert as a Bitter Magnet (intermediate representation)
 
     struct: geometry of the bitter stack
     material: physical properties of copper alloy
     fillingfactor: ratio of copper alloy volume over total volume
+    """
+    data = sections_data([struct], [material], debug)
+    print("BMagnet:", struct.name, len(data["r1"]))
+    return data
 
-    b=mt.BitterfMagnet(r2, r1, h, current_density, z_offset, 1/float(n), rho)
+def BMagnet_loop_data(struct: Bitter, material: dict, fillingfactor: float=1, debug: bool=False) -> dict:
     """
-    
-    BMagnets = mt.VectorOfBitters()
+    reference section by section implementation of BMagnet_data (see benchmark)
+    """
+    BMagnets = []
     
     rho = 1/ material["ElectricalConductivity"]
-    # f = fillingfactor # 1/struct.get_Nturns() # struct.getFillingFactor()
         
     r1 = struct.r[0]*1.e-3
     r2 = struct.r[1]*1.e-3
@@ -91,18 +258,59 @@ def BMagnet(struct: Bitter, material: dict, fillingfactor: float=1, debug: bool=
         else:
             j = 1 / (r1 * math.log(r2/r1) * dz)
         z_offset = z + dz/2.
-        BMagnets.append( mt.BitterMagnet(r2, r1, dz, j, z_offset, f, rho) )
+        BMagnets.append( (r2, r1, dz, j, z_offset, f, rho) )
                 
         z += dz
 
-    print("BMagnet:", struct.name, len(BMagnets))
-    return BMagnets
+    return elements_data(BMagnets)
 
-def UMagnet(struct: Supra, debug: bool=False):
+def benchmark(nsections: int = 300, nstructs: int = 1, repeat: int = 10):
     """
-    create view of this insert as a Uniform Magnet
+    compare BMagnet_loop_data and sections_data
+    on nstructs synthetic bitter stacks of nsections sections
+    """
+    import time
+    from types import SimpleNamespace
+
+    structs = []
+    for i in range(nstructs):
+        turns = np.random.randint(1, 20, nsections).tolist()
+        pitch = np.random.uniform(0.1, 1, nsections).tolist()
+        h = sum(n*p for (n, p) in zip(turns, pitch)) / 2.
+        axi = SimpleNamespace(h=h, turns=turns, pitch=pitch)
+        structs.append(SimpleNamespace(name=f"B{i}", r=[200.+100*i, 300.+100*i], axi=axi))
+    materials = [{"ElectricalConductivity": 50.e+6}] * nstructs
+
+    start = time.perf_counter()
+    for k in range(repeat):
+        ref = concat_elements([BMagnet_loop_data(struct, material) for (struct, material) in zip(structs, materials)])
+    tloop = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for k in range(repeat):
+        data = sections_data(structs, materials)
+    tvec = (time.perf_counter() - start) / repeat
+
+    for key in fields:
+        if not np.allclose(ref[key], data[key]):
+            raise RuntimeError(f"benchmark: {key} differs between loop and vectorized views")
+
+    print(f"benchmark: {nstructs} x {nsections} sections, loop={tloop*1.e+3:.3f} ms, vectorized={tvec*1.e+3:.3f} ms (x{tloop/tvec:.1f})")
+    return (tloop, tvec)
 
-    b=mt.UnifMagnet(r2, r1, h, current_density, z_offset, fillingfactor, rho)
+def BMagnet(struct: Bitter, material: dict, fillingfactor: float=1, debug: bool=False):
+    """
+    create view of this insert as a Bitter Magnet
+
+    b=mt.BitterfMagnet(r2, r1, h, current_density, z_offset, 1/float(n), rho)
+    """
+    bdata = empty_data()
+    bdata["BMagnets"] = BMagnet_data(struct, material, fillingfactor, debug)
+    return create_elements(bdata, "BMagnets")
+
+def UMagnet_data(struct: Supra, debug: bool=False) -> dict:
+    """
+    create view of this insert as a Uniform Magnet (intermediate representation)
     """
 
     rho = 0
@@ -114,8 +322,191 @@ def UMagnet(struct: Supra, debug: bool=False):
         j = nturns / struct.getArea()*1.e-6
     
     print("UMagnets:", struct.name, 1)
-    return mt.UnifMagnet(struct.r1*1.e-3, struct.r0*1.e-3, struct.h*1.e-3, j, struct.z0, f, rho)
+    return elements_data([(struct.r1*1.e-3, struct.r0*1.e-3, struct.h*1.e-3, j, struct.z0, f, rho)])
+
+def UMagnet(struct: Supra, debug: bool=False):
+    """
+    create view of this insert as a Uniform Magnet
+
+    b=mt.UnifMagnet(r2, r1, h, current_density, z_offset, fillingfactor, rho)
+    """
+    udata = empty_data()
+    udata["UMagnets"] = UMagnet_data(struct, debug)
+    return create_elements(udata, "UMagnets")[0]
+
+def tapes_data(struct: SupraStructure.HTSinsert, debug: bool=False, dps: Optional[list] = None) -> dict:
+    """
+    create view of this insert as a stack of tapes (intermediate representation)
+
+    dps: restrict view to these double pancakes (default: all double pancakes of struct)
+
+    per double pancake properties are gathered once,
+    tape radii and z positions are then computed for all tapes at once
+    elements are ordered as in UMagnets_data: for each double pancake,
+    tapes of the lower pancake then tapes of the upper pancake
+    """
+    if dps is None:
+        dps = struct.dblepancakes
+    h = np.array([dp.getH() for dp in dps], dtype=float)
+    zm = np.array([dp.getZ0() for dp in dps], dtype=float)
+    h_p = np.array([dp.pancake.getH() for dp in dps], dtype=float)
+    h_t = np.array([dp.pancake.tape.h for dp in dps], dtype=float)
+    w = np.array([dp.pancake.tape.w for dp in dps], dtype=float)
+    f = np.array([dp.pancake.tape.getFillingFactor() for dp in dps], dtype=float)
+    S = np.array([dp.pancake.tape.getArea() for dp in dps], dtype=float)
+    ntapes = np.array([dp.pancake.n for dp in dps], dtype=int)
+    r = [np.asarray(dp.pancake.getR(), dtype=float)[:n] for (dp, n) in zip(dps, ntapes)]
+
+    # lower and upper pancake of each double pancake
+    counts = np.repeat(ntapes, 2)
+    zi = np.column_stack((zm - h/2., (zm + h/2.) - h_p)).ravel()
+
+    ri = np.concatenate([np.concatenate((rdp, rdp)) for rdp in r]) if r else np.empty(0)
+    ht = np.repeat(np.repeat(h_t, 2), counts)
+    ff = np.repeat(np.repeat(f, 2), counts)
+
+    data = {
+        "r2": ri + np.repeat(np.repeat(w, 2), counts),
+        "r1": ri,
+        "h": ht,
+        "j": np.repeat(np.repeat(1 / S / f, 2), counts),
+        "z_offset": np.repeat(zi, counts) + ht/2.,
+        "fillingfactor": ff,
+        "rho": np.zeros(len(ri)),
+    }
 
+    if debug or len(dps) == len(struct.dblepancakes):
+        print("UMagnets:", struct.name, len(ri))
+    return data
+
+def dblepancake_data(struct: SupraStructure.HTSinsert, dp, detail: str ="dblepancake", debug: bool=False) -> dict:
+    """
+    create view of a double pancake of this insert (intermediate representation)
+
+    detail: see UMagnets_data
+    """
+    if detail == "tape":
+        return tapes_data(struct, debug, [dp])
+
+    rho = 0
+    UMagnets = []
+
+    h = dp.getH()
+    zm = dp.getZ0()
+    zi = zm - h/2.
+    if detail == "dblepancake":
+        f = dp.getFillingFactor()
+        S = dp.getArea()
+        j = 2 * dp.pancake.n / S
+        UMagnets.append( (struct.r1, struct.r0, h, j, zm, f, rho) )
+
+    elif detail == "pancake":
+        h_p = dp.pancake.getH()
+        f = dp.pancake.getFillingFactor()
+        S = dp.pancake.getArea()
+        j = dp.pancake.n / S
+        UMagnets.append( (struct.r1, struct.r0, h_p, j, zi+h_p/2., f, rho) )
+        zi = (zm + h/2.) - h_p
+        UMagnets.append( (struct.r1, struct.r0, h_p, j, zi+h_p/2., f, rho) )
+
+    return elements_data(UMagnets)
+
+def concat_elements(items: List[dict]) -> dict:
+    """
+    concatenate intermediate representations of elements
+    """
+    return {key: np.concatenate([item[key] for item in items]) if items else np.empty(0) for key in fields}
+
+def UMagnets_data(struct: SupraStructure.HTSinsert, detail: str ="dblepancake", debug: bool=False) -> dict:
+    """
+    create view of this insert as a stack of Uniform Magnets (intermediate representation)
+
+    detail: control the view model
+    dblepancake: each double pancake is a U Magnet
+    pancake: each pancake is a U Magnet
+    tape: each tape is a U Magnet (see tapes_data)
+    """
+    if detail == "tape":
+        return tapes_data(struct, debug)
+
+    data = concat_elements([dblepancake_data(struct, dp, detail, debug) for dp in struct.dblepancakes])
+    print("UMagnets:", struct.name, len(data["r1"]))
+    return data
+
+# Field evaluation
+# MagnetTools python bindings used by python_magnetsetup only build models,
+# the field is evaluated by an external evaluator given as "module:function" with
+# function(Tubes, Helices, OHelices, BMagnets, UMagnets, Shims, r, z) -> array of shape (len(r), 2)
+# where r, z are arrays of points and rows are (Br, Bz)
+
+def load_evaluator(name: str):
+    """
+    get field evaluator from its name (module:function)
+    """
+    import importlib
+
+    (module, sep, function) = name.partition(':')
+    if not module or not function:
+        raise ValueError(f"load_evaluator: expect module:function, got {name}")
+    return getattr(importlib.import_module(module), function)
+
+def field(model: tuple, r: np.ndarray, z: np.ndarray, evaluator) -> np.ndarray:
+    """
+    compute field (Br, Bz) of MagnetTools model at points (r, z) with evaluator
+
+    all points are evaluated in a single call
+    returns an array of shape (len(r), 2)
+    """
+    r = np.asarray(r, dtype=float).ravel()
+    z = np.asarray(z, dtype=float).ravel()
+    if not len(r):
+        return np.zeros((0, 2))
+
+    res = np.asarray(evaluator(*model, r, z), dtype=float)
+    if res.shape != (len(r), 2):
+        raise RuntimeError(f"field: evaluator returned an array of shape {res.shape}, expected {(len(r), 2)}")
+    return res
+
+# detail levels from coarse to fine
+levels = ["dblepancake", "pancake", "tape"]
+
+def adaptive_UMagnets_data(struct: SupraStructure.HTSinsert, r: List[float], z: List[float], evaluator, tol: float = 1.e-3, debug: bool=False) -> dict:
+    """
+    create view of this insert as a stack of Uniform Magnets (intermediate representation)
+    with detail level chosen per double pancake
+
+    each double pancake starts as a single U Magnet,
+    its field contribution at points (r, z) (see field) is compared with the one of the next finer level,
+    the double pancake is refined while the difference relative to the max field
+    of the coarse insert exceeds tol
+    """
+    r = np.asarray(r, dtype=float).ravel()
+    z = np.asarray(z, dtype=float).ravel()
+
+    def contribution(dp, level: int) -> np.ndarray:
+        tmp = empty_data()
+        tmp["UMagnets"] = dblepancake_data(struct, dp, levels[level], debug)
+        return field(create_model(tmp), r, z, evaluator)
+
+    dps = struct.dblepancakes
+    selected = [0] * len(dps)
+    B = [contribution(dp, 0) for dp in dps]
+    Bref = max(np.max(np.linalg.norm(sum(B), axis=1)), 1.e-12)
+
+    for i, dp in enumerate(dps):
+        while selected[i] < len(levels)-1:
+            Bfine = contribution(dp, selected[i]+1)
+            err = np.max(np.linalg.norm(Bfine - B[i], axis=1)) / Bref
+            if debug:
+                print(f"dblepancake[{i}]: {levels[selected[i]]} -> {levels[selected[i]+1]} err={err}")
+            if err <= tol:
+                break
+            selected[i] += 1
+            B[i] = Bfine
+
+    data = concat_elements([dblepancake_data(struct, dp, levels[level], debug) for (dp, level) in zip(dps, selected)])
+    print("UMagnets:", struct.name, len(data["r1"]), {level: selected.count(i) for i, level in enumerate(levels)})
+    return data
 
 def UMagnets(struct: SupraStructure.HTSinsert, detail: str ="dblepancake", debug: bool=False):
     """
@@ -126,68 +517,82 @@ def UMagnets(struct: SupraStructure.HTSinsert, detail: str ="dblepancake", debug
     pancake: each pancake is a U Magnet
     tape: each tape is a U Magnet
     """
-    rho = 0
-    UMagnets = mt.VectorOfUnifs()
+    udata = empty_data()
+    udata["UMagnets"] = UMagnets_data(struct, detail, debug)
+    return create_elements(udata, "UMagnets")
 
-    for dp in struct.dblepancakes:
-        h = dp.getH()
-        zm = dp.getZ0()
-        zi = zm - h/2.
-        if detail == "dblepancake":
-            f = dp.getFillingFactor()
-            S = dp.getArea()
-            j = 2 * dp.pancake.n / S
-            UMagnets.append( mt.UnifMagnet(struct.r1, struct.r0, h, j, zm, f, rho) )
-
-        elif detail == "pancake":
-            h_p = dp.pancake.getH()
-            f = dp.pancake.getFillingFactor()
-            S = dp.pancake.getArea()
-            j = dp.pancake.n / S
-            UMagnets.append( mt.UnifMagnet(struct.r1, struct.r0, h_p, j, zi+h_p/2., f, rho))
-            zi = (zm + h/2.) - h_p
-            UMagnets.append( mt.UnifMagnet(struct.r1, struct.r0, h_p, j, zi+h_p/2., f, rho))
-
-        elif detail == "tape":
-            h_p = dp.pancake.getH()
-            f = dp.pancake.tape.getFillingFactor()
-            S = dp.pancake.tape.getArea()
-            j =  1 / S / f
-            ntapes = dp.pancake.n
-            h_t = dp.pancake.tape.h
-            w = dp.pancake.tape.w
-            r = dp.pancake.getR()
-            for l in range(ntapes):
-                ri = r[l]
-                ro = ri + w
-                UMagnets.append( mt.UnifMagnet(ro, ri, h_t, j, zi+h_t/2., f, rho))
-
-            zi = (zm + h/2.) - h_p
-            for l in range(ntapes):
-                ri = r[l]
-                ro = ri + w
-                UMagnets.append( mt.UnifMagnet(ro, ri, h_t, j, zi+h_t/2., f, rho))
-
-    print("UMagnets:", struct.name, len(UMagnets))
-    return UMagnets
-
-
-def magnet_setup(MyEnv, confdata: str, debug: bool=False):
+# Cache of analytic models
+# key: hash of confdata, geometry files and supra detail level
+# value: intermediate representation
+models = {}
+
+def geometry_files(MyEnv, confdata: dict) -> List[str]:
     """
-    Creating MagnetTools data struct for setup for magnet
+    get geometry files used by magnet confdata,
+    including structure files of Supra
+
+    raise FileNotFoundError if a geometry file is missing
     """
-    print("magnet_setup", "debug=", debug)
+    files = [confdata["geom"]]
+    for mtype in ["Helix", "Bitter", "Supra"]:
+        for obj in confdata.get(mtype, []):
+            files.append(obj["geom"])
+
+    paths = [findfile(geom, paths=search_paths(MyEnv, "geom"), debug=False) for geom in files]
+
+    for obj in confdata.get("Supra", []):
+        with MyOpen(obj['geom'], 'r', paths=search_paths(MyEnv, "geom")) as cfgdata:
+            cad = yaml.load(cfgdata, Loader = yaml.FullLoader)
+        if isinstance(cad, Supra) and getattr(cad, "struct", None):
+            paths.append(findfile(cad.struct, paths=search_paths(MyEnv, "geom"), debug=False))
+    return paths
+
+def model_key(MyEnv, confdata: dict, detail: Optional[str] = None, adapt: Optional[dict] = None) -> str:
+    """
+    get key of analytic model for magnet confdata
+    """
+    key = hashlib.sha256()
+    key.update(json.dumps(confdata, sort_keys=True, default=str).encode())
+    for filename in geometry_files(MyEnv, confdata):
+        with open(filename, 'rb') as f:
+            key.update(hashlib.sha256(f.read()).digest())
+    key.update(str(detail).encode())
+    if adapt:
+        key.update(json.dumps({k: np.asarray(v).tolist() for k, v in adapt.items()}, sort_keys=True).encode())
+    return key.hexdigest()
+
+def clear_cache(key: Optional[str] = None, cachedir: str = ""):
+    """
+    invalidate cached analytic models
+
+    key: remove only model with key, otherwise remove all models
+    cachedir: also remove models saved in cachedir
+    """
+    keys = [key] if key else list(models.keys())
+    for k in keys:
+        models.pop(k, None)
+
+    if cachedir and os.path.isdir(cachedir):
+        for filename in os.listdir(cachedir):
+            if filename.endswith(".npz") and (not key or filename == f"{key}.npz"):
+                os.unlink(os.path.join(cachedir, filename))
+
+def magnet_data(MyEnv, confdata: dict, debug: bool=False, detail: Optional[str] = None, adapt: Optional[dict] = None) -> dict:
+    """
+    Creating intermediate representation of analytic model for magnet
+
+    detail: overwrite detail level of Supra (None to use detail from Supra geometry)
+    adapt: settings for "adaptive" detail level,
+    eg {"r": [0, 0], "z": [-0.1, 0.1], "tol": 1.e-3, "evaluator": "module:function"}
+    see adaptive_UMagnets_data and load_evaluator
+    """
+    print("magnet_data", "debug=", debug)
     
     yamlfile = confdata["geom"]
     if debug:
-        print("magnet_setup:", yamlfile)
+        print("magnet_data:", yamlfile)
 
-    Tubes = mt.VectorOfTubes()
-    Helices = mt.VectorOfBitters()
-    OHelices = mt.VectorOfBitters()
-    UMagnets = mt.VectorOfUnifs()
-    BMagnets = mt.VectorOfBitters()
-    Shims = mt.VectorOfShims()
+    data = empty_data()
     
     if "Helix" in confdata:
         print("Load an insert")
@@ -197,18 +602,15 @@ def magnet_setup(MyEnv, confdata: str, debug: bool=False):
         with MyOpen(yamlfile, 'r', paths=search_paths(MyEnv, "geom")) as cfgdata:
             cad = yaml.load(cfgdata, Loader = yaml.FullLoader)
         # if isinstance(cad, Insert):
-        tmp = HMagnet(MyEnv, cad, confdata, debug)
-        for item in tmp[0]:
-            Tubes.append(item)
-        for item in tmp[1]:
-            Helices.append(item)
-        for item in tmp[2]:
-            OHelices.append(item)
+        data = merge_data(data, HMagnet_data(MyEnv, cad, confdata, debug))
 
     for mtype in ["Bitter", "Supra"]:
         if mtype in confdata:
             print("load a %s insert" % mtype)
 
+            bitters = []
+            materials = []
+
             # loop on mtype
             for obj in confdata[mtype]:
                 print("obj:", obj)
@@ -217,25 +619,80 @@ def magnet_setup(MyEnv, confdata: str, debug: bool=False):
                     cad = yaml.load(cfgdata, Loader = yaml.FullLoader)
     
                 if isinstance(cad, Bitter.Bitter):
-                    fillingfactor = 1/cad.axi.get_Nturns()
-                    tmp = BMagnet(cad, obj["material"], fillingfactor, debug)
-                    for item in tmp:
-                        BMagnets.append(item)
+                    # sections of all bitters are built at once below
+                    bitters.append(cad)
+                    materials.append(obj["material"])
                 elif isinstance(cad, Supra):
                     # get SupraStructure.HTSinsert from cad
-                    if cad.detail == None:
-                        tmp = UMagnet(cad, debug)
-                        UMagnets.append(tmp)
+                    sdetail = cad.detail if detail is None else detail
+                    tmp = empty_data()
+                    if sdetail == None:
+                        tmp["UMagnets"] = UMagnet_data(cad, debug)
                     else:
                         sstruct = SupraStructure()
                         fstruct = findfile(cad.struct, paths=search_paths(MyEnv, "geom"))
                         sstruct.loadCfg(fstruct)
-                        tmp = UMagnets(sstruct, cad.detail, debug)
-                        for item in tmp:
-                            UMagnets.append(item)
+                        if sdetail == "adaptive":
+                            if not adapt or not adapt.get("evaluator"):
+                                raise Exception(f"setup: adaptive detail requires points and a field evaluator for {obj['geom']}")
+                            evaluator = load_evaluator(adapt["evaluator"])
+                            tmp["UMagnets"] = adaptive_UMagnets_data(sstruct, adapt["r"], adapt["z"], evaluator, adapt.get("tol", 1.e-3), debug)
+                        else:
+                            tmp["UMagnets"] = UMagnets_data(sstruct, sdetail, debug)
+                    data = merge_data(data, tmp)
                 else:
                     raise Exception(f"setup: unexpected cad type {str(type(cad))}")
 
+            if bitters:
+                tmp = empty_data()
+                tmp["BMagnets"] = sections_data(bitters, materials, debug)
+                print("BMagnets:", [cad.name for cad in bitters], len(tmp["BMagnets"]["r1"]))
+                data = merge_data(data, tmp)
+
+    return data
+
+def magnet_model(MyEnv, confdata: dict, debug: bool=False, detail: Optional[str] = None, cache: bool = True, cachedir: str = "", adapt: Optional[dict] = None) -> dict:
+    """
+    get intermediate representation of analytic model for magnet
+
+    detail: overwrite detail level of Supra (None to use detail from Supra geometry)
+    adapt: settings for "adaptive" detail level (see magnet_data)
+    cache: reuse analytic model if already built for the same confdata, geometry and detail
+    cachedir: directory where intermediate representations are saved (as {key}.npz)
+    """
+    if not cache and not cachedir:
+        return magnet_data(MyEnv, confdata, debug, detail, adapt)
+
+    key = model_key(MyEnv, confdata, detail, adapt)
+    if cache and key in models:
+        print(f"magnet_model: use cached model {key}")
+        return models[key]
+
+    filename = os.path.join(cachedir, f"{key}.npz") if cachedir else ""
+    if filename and os.path.isfile(filename):
+        print(f"magnet_model: load model {key} from {cachedir}")
+        data = load_data(filename)
+    else:
+        data = magnet_data(MyEnv, confdata, debug, detail, adapt)
+        if filename:
+            os.makedirs(cachedir, exist_ok=True)
+            save_data(filename, data)
+
+    if cache:
+        models[key] = data
+    return data
+
+def magnet_setup(MyEnv, confdata: str, debug: bool=False, detail: Optional[str] = None, cache: bool = True, cachedir: str = "", adapt: Optional[dict] = None):
+    """
+    Creating MagnetTools data struct for setup for magnet
+
+    see magnet_model for detail, cache, cachedir and adapt
+    """
+    print("magnet_setup", "debug=", debug)
+    
+    data = magnet_model(MyEnv, confdata, debug, detail, cache, cachedir, adapt)
+    (Tubes,Helices,OHelices,BMagnets,UMagnets,Shims) = create_model(data)
+
     # Bstacks = mt.VectorOfStacks()
     print("Helices:", len(Tubes))
     if len(BMagnets) != 0:
@@ -249,20 +706,17 @@ def magnet_setup(MyEnv, confdata: str, debug: bool=False):
     return (Tubes,Helices,OHelices,BMagnets,UMagnets,Shims)
 
 
-def msite_setup(MyEnv, confdata: str, debug: bool=False, session=None):
+def msite_model(MyEnv, confdata: str, debug: bool=False, session=None, detail: Optional[str] = None, cache: bool = True, cachedir: str = "", adapt: Optional[dict] = None) -> dict:
     """
-    Creating MagnetTools data struct for setup for msite
+    get intermediate representation of analytic model for msite
+
+    see magnet_model for detail, cache, cachedir and adapt
     """
-    print("msite_setup:", "debug=", debug)
-    print("msite_setup:", "confdata=", confdata)
-    print("miste_setup: confdata[magnets]=", confdata["magnets"])
+    print("msite_model:", "debug=", debug)
+    print("msite_model:", "confdata=", confdata)
+    print("msite_model: confdata[magnets]=", confdata["magnets"])
     
-    Tubes = mt.VectorOfTubes()
-    Helices = mt.VectorOfBitters()
-    OHelices = mt.VectorOfBitters()
-    UMagnets = mt.VectorOfUnifs()
-    BMagnets = mt.VectorOfBitters()
-    Shims = mt.VectorOfShims()
+    data = empty_data()
 
     for magnet in confdata["magnets"]:
         print("magnet:", magnet, "type(magnet)=", type(magnet), "debug=", debug)
@@ -277,21 +731,22 @@ def msite_setup(MyEnv, confdata: str, debug: bool=False, session=None):
                     
         if debug:
             print("mconfdata[geom]:", mconfdata["geom"])
-        tmp = magnet_setup(MyEnv, mconfdata, debug)
         
         # pack magnets
-        for item in tmp[0]:
-            Tubes.append(item)
-        for item in tmp[1]:
-            Helices.append(item)
-        for item in tmp[2]:
-            OHelices.append(item)
-        for item in tmp[3]:
-            BMagnets.append(item)
-        for item in tmp[4]:
-            UMagnets.append(item)
-        for item in tmp[5]:
-            Shims.append(item)
+        data = merge_data(data, magnet_model(MyEnv, mconfdata, debug, detail, cache, cachedir, adapt))
+
+    return data
+
+def msite_setup(MyEnv, confdata: str, debug: bool=False, session=None, detail: Optional[str] = None, cache: bool = True, cachedir: str = "", adapt: Optional[dict] = None):
+    """
+    Creating MagnetTools data struct for setup for msite
+
+    see magnet_model for detail, cache, cachedir and adapt
+    """
+    print("msite_setup:", "debug=", debug)
+    
+    data = msite_model(MyEnv, confdata, debug, session, detail, cache, cachedir, adapt)
+    (Tubes,Helices,OHelices,BMagnets,UMagnets,Shims) = create_model(data)
 
     # Bstacks = mt.VectorOfStacks()
     print("\nHelices:", len(Tubes))
@@ -352,10 +807,15 @@ def main():
 
     parser.add_argument("--debug", help="activate debug", action='store_true')
     parser.add_argument("--verbose", help="activate verbose", action='store_true')
+    parser.add_argument("--benchmark", help="benchmark Bitter views on synthetic stacks (nsections nstructs)", nargs=2, type=int, default=None)
     args = parser.parse_args()
 
     if args.debug:
         print("Arguments: " + str(args._))
+
+    if args.benchmark:
+        benchmark(args.benchmark[0], args.benchmark[1])
+        return 0
     
     # make datafile/[magnet|msite] exclusive one or the other
     if args.magnet != None and args.msite:
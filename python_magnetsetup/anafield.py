@@ -0,0 +1,194 @@
+"""
+Analytic field maps for python_magnetsetup
+
+Evaluate the magnetic field of a magnet or msite analytic model
+over a (r, z) grid or along the axis.
+
+The field is computed by an evaluator given as module:function
+(see ana.load_evaluator): MagnetTools bindings used by python_magnetsetup
+only build the models.
+
+Points are split into chunks evaluated by a pool of processes,
+each chunk in a single evaluator call.
+MagnetTools objects cannot be pickled, so each worker rebuilds
+the model once from the intermediate representation (see ana.create_model)
+and then evaluates its chunks.
+
+ex:
+python -m python_magnetsetup.anafield --evaluator mymodule:field --datafile HL-31-data.json --r 0 0.1 51 --z -0.2 0.2 201 --np 8
+"""
+
+from typing import List, Optional, Tuple
+
+import sys
+import os
+import time
+import argparse
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .objects import load_object, load_object_from_db
+from .config import appenv
+from .ana import magnet_model, msite_model, create_model, field, load_evaluator
+
+# analytic model and field evaluator of the current worker process
+model = None
+evaluator = None
+
+def init_worker(data: dict, evaluator_name: str):
+    """
+    rebuild MagnetTools model from intermediate representation
+    and load field evaluator (once per process)
+    """
+    global model, evaluator
+    model = create_model(data)
+    evaluator = load_evaluator(evaluator_name)
+
+def compute_field(r: np.ndarray, z: np.ndarray) -> np.ndarray:
+    """
+    compute field (Br, Bz) at points (r, z) with the model of the current process
+
+    returns an array of shape (len(r), 2)
+    """
+    return field(model, r, z, evaluator)
+
+def chunks(npoints: int, chunksize: int) -> List[Tuple[int, int]]:
+    """
+    split npoints into [start, end) ranges of at most chunksize points
+    """
+    return [(start, min(start + chunksize, npoints)) for start in range(0, npoints, chunksize)]
+
+def fieldmap(data: dict, r: np.ndarray, z: np.ndarray, evaluator_name: str, nprocs: int = 1, chunksize: int = 1024, debug: bool = False) -> dict:
+    """
+    evaluate field of analytic model data at points (r, z)
+
+    r and z may be scalars or arrays (broadcast together)
+    evaluator_name: field evaluator as module:function (see ana.load_evaluator)
+    nprocs: number of worker processes (1: evaluate in current process)
+    chunksize: number of points per task
+
+    returns a dict of arrays (Br, Bz) with the shape of the broadcasted points
+    """
+    (r, z) = np.broadcast_arrays(np.asarray(r, dtype=float), np.asarray(z, dtype=float))
+    shape = r.shape
+    rflat = r.ravel()
+    zflat = z.ravel()
+    tasks = chunks(len(rflat), chunksize)
+    if debug:
+        print(f"fieldmap: {len(rflat)} points, {len(tasks)} chunks, {nprocs} procs")
+
+    start = time.perf_counter()
+    if nprocs <= 1:
+        init_worker(data, evaluator_name)
+        results = [compute_field(rflat[i:j], zflat[i:j]) for (i, j) in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=nprocs, initializer=init_worker, initargs=(data, evaluator_name)) as executor:
+            futures = [executor.submit(compute_field, rflat[i:j], zflat[i:j]) for (i, j) in tasks]
+            results = [future.result() for future in futures]
+    print(f"fieldmap: {len(rflat)} points in {time.perf_counter() - start:.2f} s")
+
+    values = np.concatenate(results) if results else np.zeros((0, 2))
+    return {name: values[:, i].reshape(shape) for i, name in enumerate(["Br", "Bz"])}
+
+def grid(rmin: float, rmax: float, nr: int, zmin: float, zmax: float, nz: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    create a (r, z) grid of nr x nz points
+    """
+    return np.meshgrid(np.linspace(rmin, rmax, nr), np.linspace(zmin, zmax, nz), indexing='ij')
+
+def axis(zmin: float, zmax: float, nz: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    create nz points along the axis
+    """
+    z = np.linspace(zmin, zmax, nz)
+    return (np.zeros(nz), z)
+
+def subsample(r: np.ndarray, z: np.ndarray, npoints: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    select at most npoints points evenly spread among points (r, z)
+    """
+    r = np.asarray(r, dtype=float).ravel()
+    z = np.asarray(z, dtype=float).ravel()
+    if len(r) <= npoints:
+        return (r, z)
+    index = np.unique(np.linspace(0, len(r)-1, max(npoints, 1)).round().astype(int))
+    return (r[index], z[index])
+
+def load_model(MyEnv, confdata: dict, debug: bool = False, session=None, detail: Optional[str] = None, cachedir: str = "", adapt: Optional[dict] = None) -> dict:
+    """
+    get intermediate representation of analytic model for magnet or msite confdata
+    """
+    if "geom" in confdata:
+        return magnet_model(MyEnv, confdata, debug, detail, True, cachedir, adapt)
+    return msite_model(MyEnv, confdata, debug, session, detail, True, cachedir, adapt)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute analytic field maps for magnet or msite")
+    parser.add_argument("--evaluator", help="field evaluator as module:function (see ana.load_evaluator)", type=str, required=True)
+    parser.add_argument("--datafile", help="input data file (ex. HL-34-data.json)", default=None)
+    parser.add_argument("--wd", help="set a working directory", type=str, default="")
+    parser.add_argument("--magnet", help="Magnet name from magnetdb (ex. HL-34)", default=None)
+    parser.add_argument("--msite", help="MSite name from magnetdb (ex. HL-34)", default=None)
+    parser.add_argument("--detail", help="overwrite Supra detail level", type=str, choices=['dblepancake', 'pancake', 'tape', 'adaptive'], default=None)
+    parser.add_argument("--tol", help="relative field error for adaptive detail level (evaluated at control points)", type=float, default=1.e-3)
+    parser.add_argument("--adapt_points", help="control points for adaptive detail level in m (r1 z1 r2 z2 ...), default: subsample of field map points", nargs='+', type=float, default=None)
+    parser.add_argument("--adapt_npoints", help="max number of field map points used as control points if --adapt_points is not given", type=int, default=16)
+    parser.add_argument("--cachedir", help="directory to save/load analytic models", type=str, default="")
+    parser.add_argument("--r", help="radial range in m (rmin rmax nr)", nargs=3, type=float, default=None)
+    parser.add_argument("--z", help="axial range in m (zmin zmax nz)", nargs=3, type=float, default=[-0.2, 0.2, 401])
+    parser.add_argument("--np", help="number of processes", type=int, default=os.cpu_count())
+    parser.add_argument("--chunksize", help="number of points per task", type=int, default=1024)
+    parser.add_argument("--output", help="output npz file", type=str, default="fieldmap.npz")
+    parser.add_argument("--debug", help="activate debug", action='store_true')
+    args = parser.parse_args()
+
+    # make datafile/[magnet|msite] exclusive one or the other
+    if args.magnet != None and args.msite:
+        raise Exception("cannot specify both magnet and msite")
+    if args.datafile != None:
+        if args.magnet != None or args.msite != None:
+            raise Exception("cannot specify both datafile and magnet or msite")
+
+    # load appenv
+    MyEnv = appenv()
+
+    if args.wd:
+        os.chdir(args.wd)
+
+    # Get Object
+    if args.datafile != None:
+        confdata = load_object(MyEnv, args.datafile, args.debug)
+    if args.magnet != None:
+        confdata = load_object_from_db(MyEnv, "magnet", args.magnet, args.debug)
+    if args.msite != None:
+        confdata = load_object_from_db(MyEnv, "msite", args.msite, args.debug)
+
+    (zmin, zmax, nz) = args.z
+    if args.r is None:
+        (r, z) = axis(zmin, zmax, int(nz))
+    else:
+        (rmin, rmax, nr) = args.r
+        (r, z) = grid(rmin, rmax, int(nr), zmin, zmax, int(nz))
+
+    adapt = None
+    if args.detail == "adaptive":
+        if args.adapt_points:
+            if len(args.adapt_points) % 2:
+                raise Exception("adapt_points: expect pairs of r z values")
+            points = np.array(args.adapt_points).reshape(-1, 2)
+            (ar, az) = (points[:, 0], points[:, 1])
+        else:
+            (ar, az) = subsample(r, z, args.adapt_npoints)
+        print(f"adaptive detail: {len(ar)} control points")
+        adapt = {"r": ar, "z": az, "tol": args.tol, "evaluator": args.evaluator}
+    data = load_model(MyEnv, confdata, args.debug, detail=args.detail, cachedir=args.cachedir, adapt=adapt)
+
+    res = fieldmap(data, r, z, args.evaluator, args.np, args.chunksize, args.debug)
+    print(f"Export field map to {args.output}")
+    np.savez(args.output, r=r, z=z, **res)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+Result archives
+
+Results of a simulation (np_{NP} directory in feelppdb) are saved as a zip
+archive (see setup_cmds Save): the central directory of the zip is an index
+of members, so a single member (measures csv, log, image, field) can be read
+without decompressing the whole archive.
+
+Archives can be read locally or on a remote machine through the executors
+used by cli.fabric (see remote): only the index and the requested members
+are transferred.
+
+Legacy tgz archives are also supported (read sequentially).
+
+ex:
+python -m python_magnetsetup.archive list HL-test-cfpdes-thelec-Axi-sim_res.zip
+python -m python_magnetsetup.archive extract HL-test-cfpdes-thelec-Axi-sim_res.zip --pattern "*measures/values.csv" --output results
+python -m python_magnetsetup.archive cat HL-test/HL-test-cfpdes-thelec-Axi-sim_res.zip np_2/cfpdes.heat.measures/values.csv --machine calcul22
+"""
+
+from typing import List
+
+import sys
+import os
+import shutil
+import fnmatch
+import argparse
+import tarfile
+import zipfile
+
+def archive_name(cfgfile: str) -> str:
+    """
+    get name of result archive for cfgfile
+    """
+    return cfgfile.replace('.cfg', '_res.zip')
+
+def save_cmd(result_dir: str, NP: int, archive: str) -> str:
+    """
+    get command to save result_dir/../np_{NP} in archive (relative to current directory)
+    """
+    return f"tmpdir=$(pwd) && pushd {result_dir}/.. && python3 -m zipfile -c $tmpdir/{archive} np_{NP} && popd"
+
+class ResultArchive():
+    """
+    read members of a result archive
+
+    fileobj: seekable file object (eg. sftp file), if not given archive is opened locally
+    """
+
+    def __init__(self, archive: str, fileobj=None):
+        self.name = archive
+        self.fileobj = fileobj
+        source = fileobj if fileobj is not None else archive
+        if archive.endswith('.zip'):
+            self.zip = zipfile.ZipFile(source, 'r')
+            self.tar = None
+        else:
+            self.zip = None
+            self.tar = tarfile.open(name=None if fileobj is not None else archive, fileobj=fileobj, mode='r:*')
+
+    def names(self) -> List[str]:
+        """
+        get names of members (files only)
+        """
+        if self.zip is not None:
+            return [info.filename for info in self.zip.infolist() if not info.is_dir()]
+        return [member.name for member in self.tar.getmembers() if member.isfile()]
+
+    def find(self, pattern: str) -> List[str]:
+        """
+        get names of members matching pattern (fnmatch)
+        """
+        return [name for name in self.names() if fnmatch.fnmatch(name, pattern)]
+
+    def open(self, member: str):
+        """
+        open member as a binary file object
+        """
+        if self.zip is not None:
+            return self.zip.open(member, 'r')
+        return self.tar.extractfile(member)
+
+    def read(self, member: str) -> bytes:
+        with self.open(member) as f:
+            return f.read()
+
+    def extract(self, member: str, output: str = ".") -> str:
+        """
+        extract member in output directory (keeping its path)
+        """
+        dst = os.path.join(output, member)
+        os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+        with self.open(member) as src, open(dst, 'wb') as out:
+            shutil.copyfileobj(src, out)
+        return dst
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+        if self.tar is not None:
+            self.tar.close()
+        if self.fileobj is not None:
+            self.fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_archive(archive: str, executor=None) -> ResultArchive:
+    """
+    open a result archive, on executor if given (see remote)
+    """
+    if executor is None:
+        return ResultArchive(archive)
+    return ResultArchive(archive, executor.open(archive))
+
+def main():
+    parser = argparse.ArgumentParser(description="Read members of result archives")
+    parser.add_argument("--machine", help="read archive on machine (path relative to home)", type=str, default="")
+    parser.add_argument("--debug", help="activate debug", action='store_true')
+    subparsers = parser.add_subparsers(title="commands", dest="command", help='sub-command help')
+
+    parser_list = subparsers.add_parser('list', help='list members')
+    parser_list.add_argument("archive", type=str)
+    parser_list.add_argument("--pattern", help="filter members (eg. '*.csv')", type=str, default="*")
+
+    parser_extract = subparsers.add_parser('extract', help='extract members')
+    parser_extract.add_argument("archive", type=str)
+    parser_extract.add_argument("members", help="members to extract", type=str, nargs='*')
+    parser_extract.add_argument("--pattern", help="extract members matching pattern (eg. '*measures/values.csv')", type=str, default="")
+    parser_extract.add_argument("--output", help="output directory", type=str, default=".")
+
+    parser_cat = subparsers.add_parser('cat', help='print a member')
+    parser_cat.add_argument("archive", type=str)
+    parser_cat.add_argument("member", type=str)
+    args = parser.parse_args()
+
+    if not args.command:
+        parser.print_help()
+        return 0
+
+    executor = None
+    if args.machine:
+        from .remote import FabricExecutor
+        executor = FabricExecutor(args.machine)
+
+    try:
+        with open_archive(args.archive, executor) as archive:
+            if args.command == 'list':
+                for name in archive.find(args.pattern):
+                    print(name)
+            elif args.command == 'extract':
+                members = list(args.members)
+                if args.pattern:
+                    members += archive.find(args.pattern)
+                for member in members:
+                    dst = archive.extract(member, args.output)
+                    print(f"extract: {member} -> {dst}")
+            elif args.command == 'cat':
+                sys.stdout.buffer.write(archive.read(args.member))
+    finally:
+        if executor is not None:
+            executor.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Simulation artifacts
+
+Files needed for a simulation (geometries, cad, meshes, ...) are first
+collected by name, then resolved concurrently in the search paths
+(see file_utils.search_paths). Resolution is done with a bounded pool
+of threads so that remote-mounted repositories are not overloaded.
+
+The resolved artifacts form a manifest used to create the simulation archive.
+"""
+
+from typing import List
+
+import os
+import json
+import hashlib
+
+from dataclasses import dataclass, asdict
+from concurrent.futures import ThreadPoolExecutor
+
+from .file_utils import findfile, search_paths
+
+@dataclass
+class Artifact():
+    """
+    artifact definition
+
+    kind: type of search path (geom, cad, mesh) or "local" for files in the current directory
+    name: name of the file to look for
+    group: artifacts of the same group are kept only if all of them are found (eg xao and brep),
+    artifacts without group are required
+    """
+    kind: str
+    name: str
+    group: str = ""
+    path: str = ""
+    size: int = 0
+    hash: str = ""
+
+def cad_artifacts(name: str) -> List[Artifact]:
+    """
+    get cad artifacts (xao and brep) for name
+    """
+    return [Artifact("cad", name + ".xao", group=name), Artifact("cad", name + ".brep", group=name)]
+
+def checksum(filename: str, blocksize: int = 1 << 20) -> str:
+    """
+    compute sha256 of filename
+    """
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def resolve_artifact(MyEnv, artifact: Artifact, hash: bool = True) -> Artifact:
+    """
+    look for artifact in its search paths
+    """
+    if artifact.kind == "local":
+        if not os.path.isfile(artifact.name):
+            raise FileNotFoundError(f"cannot find {artifact.name} in {os.getcwd()}")
+        artifact.path = artifact.name
+    else:
+        artifact.path = findfile(artifact.name, paths=search_paths(MyEnv, artifact.kind), debug=False)
+    artifact.size = os.path.getsize(artifact.path)
+    if hash:
+        artifact.hash = checksum(artifact.path)
+    return artifact
+
+def resolve(MyEnv, artifacts: List[Artifact], nworkers: int = 8, hash: bool = True, debug: bool = False) -> List[Artifact]:
+    """
+    resolve artifacts concurrently
+
+    duplicated artifacts are resolved once,
+    groups with missing artifacts are dropped
+
+    returns resolved artifacts in their original order
+    """
+    unique = {}
+    for artifact in artifacts:
+        unique.setdefault((artifact.kind, artifact.name), artifact)
+    artifacts = list(unique.values())
+    if not artifacts:
+        return []
+
+    def task(artifact: Artifact):
+        try:
+            return resolve_artifact(MyEnv, artifact, hash)
+        except FileNotFoundError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(nworkers, len(artifacts)))) as executor:
+        results = list(executor.map(task, artifacts))
+
+    missing = set()
+    for (artifact, res) in zip(artifacts, results):
+        if isinstance(res, FileNotFoundError):
+            if not artifact.group:
+                raise res
+            missing.add(artifact.group)
+            if debug:
+                print(f"resolve: skip {artifact.name} ({artifact.group} incomplete)")
+
+    resolved = [artifact for artifact in artifacts if artifact.path and not artifact.group in missing]
+    if debug:
+        for artifact in resolved:
+            print(f"resolve: {artifact.name} -> {artifact.path}")
+    return resolved
+
+def save_manifest(filename: str, artifacts: List[Artifact]):
+    """
+    save manifest of artifacts as json
+    """
+    with open(filename, 'w') as f:
+        f.write(json.dumps([asdict(artifact) for artifact in artifacts], indent=4))
+
+def load_manifest(filename: str) -> List[Artifact]:
+    """
+    load manifest of artifacts from json
+    """
+    with open(filename, 'r') as f:
+        return [Artifact(**item) for item in json.loads(f.read())]
@@ -0,0 +1,230 @@
+"""
+Batch jobs for machines with a job manager (slurm, oar)
+
+The commands created by setup_cmds are turned into one job script per stage
+(see templates/jobmanager/{slurm,oar}.mustache) chained by dependencies:
+Unpack -> CAD -> Mesh -> Convert -> Partition -> Update_Mesh -> Update_Partition -> Run -> Postprocessing, Stats, Save
+
+Cores are packed on nodes from the machine definition (see machines.json).
+For a sweep (eg. on currents), Run is replaced by an array job of the Workflow
+and Postprocessing, Stats and Save are array jobs as well: each task gets its value
+as $VALUE and works in its own result directory (see setup_cmds with args.sweep).
+
+FakeScheduler runs the jobs locally, honoring dependencies, to test the chain
+without a job manager.
+"""
+
+from typing import List, Optional, Tuple
+
+import os
+import math
+import stat
+import subprocess
+
+from dataclasses import dataclass
+
+from .machines import machine, JobManagerType
+
+# stages in order of execution
+chain = ["Unpack", "CAD", "Mesh", "Convert", "Partition", "Update_Mesh", "Update_Partition", "Run", "Workflow", "Postprocessing", "Stats", "Save"]
+
+# stages depending on another stage than the previous one
+depends = {"Postprocessing": "Run", "Stats": "Run", "Save": "Run"}
+
+# stages run on NP cores
+parallel_stages = ["Run", "Workflow"]
+
+# default walltimes
+walltimes = {"Run": "8:00:00", "Workflow": "8:00:00"}
+default_walltime = "1:00:00"
+
+@dataclass
+class Job():
+    """
+    job definition
+
+    after: stage this job depends on (afterok)
+    array: number of jobs in array (0 for a single job)
+    """
+    stage: str
+    script: str
+    after: Optional[str] = None
+    ntasks: int = 1
+    array: int = 0
+
+def resources(server: machine, ntasks: int) -> tuple:
+    """
+    get number of nodes and tasks per node for ntasks on server
+    """
+    cores = server.cores
+    if server.multithreading:
+        cores = int(cores/2)
+    nodes = math.ceil(ntasks / cores)
+    return (nodes, math.ceil(ntasks / nodes))
+
+def sweep_workflow(cmds: dict, cfgfile: str, directory: str) -> Tuple[str, str]:
+    """
+    make Workflow cmd run current $VALUE of an array job (see create_jobs)
+    with its own copy of cfgfile writing to its own feelpp directory
+
+    returns feelpp directory and suffix of result files of each task
+    """
+    directory = f"{directory}/I${{VALUE}}"
+    suffix = "-I${VALUE}"
+    taskcfg = cfgfile.replace('.cfg', f'{suffix}.cfg')
+    update_directory = f"perl -pe \"s|^directory=.*|directory={directory}|\" {cfgfile} > {taskcfg}"
+    cmds["Workflow"] = f"{update_directory} && {cmds['Workflow'].replace(cfgfile, taskcfg)} --current ${{VALUE}}"
+    return (directory, suffix)
+
+def create_jobs(MyEnv, server: machine, name: str, cmds: dict, NP: int, workdir: str = ".", sweep: List[str] = [], queue: Optional[str] = None, email: Optional[str] = None, walltime: dict = {}, debug: bool = False) -> List[Job]:
+    """
+    create job scripts for cmds
+
+    sweep: values of current for an array job of the Workflow (as $VALUE),
+    cmds must be created for a sweep (see setup_cmds and sweep_workflow)
+    walltime: walltime per stage (default: see walltimes)
+    """
+    import chevron
+
+    otype = server.manager.otype
+    if otype == JobManagerType.none:
+        raise RuntimeError(f"create_jobs: {server.name} has no job manager")
+    template = os.path.join(MyEnv.template_path(), "jobmanager", f"{otype.value}.mustache")
+
+    stages = [stage for stage in chain if stage in cmds]
+    if sweep:
+        if not "Workflow" in cmds:
+            raise RuntimeError("create_jobs: sweep requires a Workflow command")
+        if not "${VALUE}" in cmds["Workflow"]:
+            raise RuntimeError("create_jobs: sweep requires cmds created for a sweep (see setup_cmds)")
+        stages = [stage for stage in stages if stage != "Run"]
+    else:
+        stages = [stage for stage in stages if stage != "Workflow"]
+    # Workflow replaces Run in dependencies
+    run = "Workflow" if sweep else "Run"
+
+    jobs = []
+    previous = None
+    for stage in stages:
+        after = previous
+        if stage in depends and depends[stage].replace("Run", run) in stages:
+            after = depends[stage].replace("Run", run)
+
+        ntasks = NP if stage in parallel_stages else 1
+        (nodes, tasks_per_node) = resources(server, ntasks)
+        cmd = cmds[stage]
+        # stages run per value of the sweep
+        array = len(sweep) > 0 and (stage == "Workflow" or stage in depends)
+
+        data = {
+            "name": name,
+            "stage": stage,
+            "nodes": nodes,
+            "ntasks": ntasks,
+            "tasks_per_node": tasks_per_node,
+            "walltime": walltime.get(stage, walltimes.get(stage, default_walltime)),
+            "queue": queue,
+            "email": email,
+            "array": {"values": " ".join([str(v) for v in sweep]), "last": len(sweep)-1, "count": len(sweep)} if array else None,
+            "workdir": workdir,
+            "pre": cmds.get("Pre", ""),
+            "cmd": cmd,
+        }
+        script = f"{name}-{stage}.{otype.value}"
+        with open(template, "r") as f:
+            content = chevron.render(f, data)
+        with open(script, "w") as out:
+            out.write(content)
+        os.chmod(script, os.stat(script).st_mode | stat.S_IXUSR)
+        if debug:
+            print(f"create_jobs: {script} (after={after}, ntasks={ntasks} on {nodes} nodes)")
+
+        jobs.append(Job(stage, script, after, ntasks, len(sweep) if array else 0))
+        if not stage in depends:
+            previous = stage
+
+    return jobs
+
+class SlurmScheduler():
+    def submit(self, script: str, after: Optional[str] = None, array: int = 0) -> str:
+        cmd = ["sbatch", "--parsable"]
+        if after:
+            cmd.append(f"--dependency=afterok:{after}")
+        res = subprocess.run(cmd + [script], check=True, capture_output=True, text=True)
+        return res.stdout.strip().split(';')[0]
+
+    def command(self, script: str, after: Optional[str] = None) -> str:
+        dependency = f" --dependency=afterok:${after}" if after else ""
+        return f"sbatch --parsable{dependency} {script}"
+
+class OarScheduler():
+    def submit(self, script: str, after: Optional[str] = None, array: int = 0) -> str:
+        cmd = ["oarsub"]
+        if after:
+            cmd += ["-a", after]
+        res = subprocess.run(cmd + ["-S", f"./{script}"], check=True, capture_output=True, text=True)
+        for line in res.stdout.splitlines():
+            if line.startswith("OAR_JOB_ID="):
+                return line.replace("OAR_JOB_ID=", "").strip()
+        raise RuntimeError(f"oarsub: no job id for {script}: {res.stdout}")
+
+    def command(self, script: str, after: Optional[str] = None) -> str:
+        dependency = f" -a ${after}" if after else ""
+        return f"oarsub{dependency} -S ./{script} | sed -n 's/OAR_JOB_ID=//p'"
+
+class FakeScheduler():
+    """
+    run jobs locally at submission, as a scheduler would do
+
+    a job whose dependency failed is never run (status -1),
+    array jobs are run for each index with SLURM_ARRAY_TASK_ID and OAR_ARRAY_INDEX set
+    """
+
+    def __init__(self):
+        self.jobs = {}
+
+    def submit(self, script: str, after: Optional[str] = None, array: int = 0) -> str:
+        jobid = str(len(self.jobs) + 1)
+        status = -1
+        if not after or self.jobs[after]["status"] == 0:
+            status = 0
+            for i in range(max(array, 1)):
+                env = dict(os.environ, SLURM_ARRAY_TASK_ID=str(i), OAR_ARRAY_INDEX=str(i+1), SLURM_JOB_ID=jobid, OAR_JOB_ID=jobid)
+                status = max(status, subprocess.run(["bash", script], env=env).returncode)
+        self.jobs[jobid] = {"script": script, "after": after, "status": status}
+        print(f"FakeScheduler: job {jobid} {script} (after={after}) status={status}")
+        return jobid
+
+def scheduler(otype: JobManagerType, fake: bool = False):
+    """
+    get scheduler for job manager type
+    """
+    if fake:
+        return FakeScheduler()
+    if otype == JobManagerType.slurm:
+        return SlurmScheduler()
+    if otype == JobManagerType.oar:
+        return OarScheduler()
+    raise RuntimeError(f"scheduler: unsupported job manager {otype}")
+
+def submit(jobs: List[Job], sched) -> dict:
+    """
+    submit jobs in order, returns job ids per stage
+    """
+    ids = {}
+    for job in jobs:
+        ids[job.stage] = sched.submit(job.script, ids.get(job.after), job.array)
+    return ids
+
+def write_submit(jobs: List[Job], otype: JobManagerType, filename: str):
+    """
+    write a bash script submitting jobs with their dependencies
+    """
+    sched = scheduler(otype)
+    with open(filename, "w") as out:
+        out.write("#!/bin/bash\nset -e\n\n")
+        for job in jobs:
+            after = f"jid_{job.after}" if job.after else None
+            out.write(f"jid_{job.stage}=$({sched.command(job.script, after)})\n")
+            out.write(f"echo \"{job.stage}: $jid_{job.stage}\"\n")
+    os.chmod(filename, os.stat(filename).st_mode | stat.S_IXUSR)
@@ -2,64 +2,122 @@
 import argparse
 from argparse import RawTextHelpFormatter
 
+from typing import List, Optional
+
 import sys
 import os
 import re
 
-from .setup import setup, setup_cmds
+from .setup import setup, setup_cmds, get_np, mesh_size, partitions
+from . import history
+from . import remote
+from . import batch
+from . import pipeline
+from . import meshcache
+from .machines import JobManagerType
 from .objects import load_object, load_object_from_db
 from .config import appenv, loadconfig, loadmachine, load_machines, supported_methods, supported_models
 
-def fabric(machine: str, workingdir: str, geodir: str, args, cfgfile: str, jsonfile: str, meshfile: str, tarfilename:str, cmds: dict):
-    """
-    run cmds on machine
+def fabric(machines: List[str], workingdir: str, geodir: str, args, cfgfile: str, jsonfile: str, meshfile: str, tarfilename:str, cmds: dict, cases: Optional[dict] = None, partmesh: str = ""):
     """
-    from fabric import Connection
+    run cmds on machines concurrently (see remote.run_cases)
 
+    cmds: dict of cmds per machine
+    cases: if given, dict of case per machine, timings of each cmd are stored in runtime history (see history.record)
+    partmesh: mesh used by the partitioner (see setup_cmds io), its size is read on machines
+    when unknown in cases
+    """
     cwd = os.getcwd()
+    status = 0
     
     # test fabric
     # TODO inhibit auto mode for Transient and 3D cases
     if args.auto:
-        print(f"\n\n=== Testing automatic run on {machine} ===")
-        connection_ = Connection(f'{machine}')
-        if connection_.run('hostname').exited != 0:
-            raise Exception(f"cannot connect to {machine}")
-        result = connection_.run('hostname', hide=True)
-        result = connection_.run('lsb_release -cs', hide=True)
-        result = connection_.run('pwd', hide=True)
-        homedir = result.stdout.strip()
-        print(f"{machine}: homedir={homedir}")
-        result = connection_.run(f'[ -d {homedir}/{workingdir} ] && echo 0 || echo 1')
-    
-        if result.stdout.strip() == '1':
-            connection_.run(f'mkdir -p {workingdir}')
-            connection_.put(f'{tarfilename}', remote=f'{homedir}/{workingdir}')
-            connection_.run(f'cd {homedir}/{workingdir} && tar -zxvf {tarfilename}')
-            for cmd in cmds:
-                if not cmd in ['Pre', 'Python', 'Workflow']:
-                    connection_.run(f"cd {homedir}/{workingdir} && {cmds['Pre']} && {cmds[cmd]}")
-
-            # TODO store simu in db????
-            # connection_.run(f"cd {homedir}/{workingdir} && {cmds['Save']}")
-        else:
-            raise Exception(f'python_magnetsetup/cli: {workingdir} already exists on {machine}')
+        executors = {}
+        for machine in machines:
+            print(f"\n\n=== Testing automatic run on {machine} ===")
+            if args.localexec:
+                executors[machine] = remote.LocalExecutor(os.path.join(args.localexec, machine))
+            else:
+                executors[machine] = remote.FabricExecutor(machine)
+            if executors[machine].run('hostname')[0] != 0:
+                raise Exception(f"cannot connect to {machine}")
+            print(f"{machine}: homedir={executors[machine].homedir()}")
+
+        # only send missing artifacts (see setup)
+        manifestfile = ""
+        if args.artifacts:
+            manifestfile = cfgfile.replace('.cfg', '-manifest.json')
+
+        jobs = []
+        for machine in machines:
+            localdir = os.path.join(cwd, workingdir)
+            if len(machines) > 1:
+                localdir = os.path.join(cwd, f"{workingdir}-{machine}")
+            jobs.append({
+                "executor": executors[machine],
+                "workingdir": workingdir,
+                "tarfilename": tarfilename,
+                "cmds": cmds[machine],
+                "localdir": localdir,
+                "manifestfile": manifestfile,
+                "skip_artifacts": ['cad'] if args.geom == 'Axi' else [],
+                "meshfile": partmesh if cases is not None and cases[machine]["nelems"] <= 0 else ""
+            })
+        results = remote.run_cases(jobs, args.debug)
+
+        for (machine, (mstatus, stages, nelems)) in zip(machines, results):
+            print(f"{machine}: status={mstatus}")
+            if cases is not None and nelems > 0:
+                print(f"{machine}: mesh size {nelems} read from {partmesh}")
+                cases[machine]["nelems"] = nelems
+            if cases is not None and stages:
+                run = history.record(cases[machine], stages, args.history)
+                print(f"fabric: timings stored in history (run={run})")
+            status = max(status, mstatus)
 
         print("pwd", os.getcwd())
         for f in [cfgfile, jsonfile, tarfilename]:
             print(f'Remove {f} ({type(f)}')
             os.unlink(os.path.join(cwd, f))
 
-        # get result_arch, pngs, csv (included in result_arch)
-        # result_arch = cfgfile.replace('.cfg', f'_res.tgz' 
-        # connection_.get(remote=f'{homedir}/{workingdir}/{result_arch}')
-        # connection_.get(remote=f'{homedir}/{workingdir}/\*.png')
-        # connection_.get(remote=f'{homedir}/{workingdir}/{csvs}')
-
-        result = connection_.run(f'rm -rf {homedir}/{workingdir}')
+        # results (result_arch, pngs, csv) are pulled back in localdir
+        # TODO store simu in db????
+        for machine in machines:
+            executors[machine].run(f'rm -rf {workingdir}')
+            executors[machine].close()
         
-    return 0
+    return status
     
+def run_pipeline(machine: str, workingdir: str, args, tarfilename: str, cmds: dict, io: dict) -> int:
+    """
+    run cmds on machine as a pipeline (see pipeline.run)
+
+    the archive is sent only if workingdir does not exist on machine,
+    so that an interrupted pipeline resumes from its saved state
+    """
+    if args.localexec:
+        executor = remote.LocalExecutor(os.path.join(args.localexec, machine))
+    else:
+        executor = remote.FabricExecutor(machine)
+
+    try:
+        (status, stdout) = executor.run(f'[ -d {workingdir} ] && echo 0 || echo 1')
+        if stdout.strip() == '1':
+            if remote.stream_archive(executor, tarfilename, workingdir) != 0:
+                raise Exception(f'pipeline: failed to send {tarfilename} to {machine}')
+
+        # archive is unpacked on the fly
+        tasks = pipeline.create_tasks({key: cmd for (key, cmd) in cmds.items() if key != "Unpack"}, io, args.workflow, args.debug)
+        statefile = f"{workingdir}-{machine}-pipeline.json"
+        results = pipeline.run(executor, tasks, cmds["Pre"], workingdir, statefile, args.pipeline_jobs, args.force_stages, args.debug)
+    finally:
+        executor.close()
+
+    for (name, res) in results.items():
+        print(f"{machine}: {name}: {res}")
+    return 0 if all(res in [0, 'skipped'] for res in results.values()) else 1
+
 def main():
 
     # TODO get available model from magnetsetup.json
@@ -111,9 +169,28 @@ def main():
     parser.add_argument("--scale", help="scale of geometry", type=float, default=1e-3)
     parser.add_argument("--machine", help="choose cooling type", type=str,
                     choices=machines, default=MyEnv.compute_server)
-    parser.add_argument("--np", help="choose number of cores (default is 0, would get max cores from machine)", type=int, default=0)
+    parser.add_argument("--np", help="choose number of cores (default is 0, would get number of cores from mesh size if available or max cores from machine)", type=int, default=0)
+    parser.add_argument("--elements_per_core", help="target number of elements per core when selecting number of cores from mesh size (default is 0, use default target for geom)", type=int, default=0)
 
     parser.add_argument("--auto", help="activate auto mode", action='store_true')
+    parser.add_argument("--history", help="runtime history database (auto mode)", type=str, default=history.default_db)
+    parser.add_argument("--machines", help="run concurrently on machines (auto mode, default is machine)", type=str, nargs='+',
+                    choices=machines, default=None)
+    parser.add_argument("--localexec", help="run locally in this directory instead of remote machines (auto mode)", type=str, default="")
+    parser.add_argument("--artifacts", help="only send artifacts missing on remote machines (auto mode)", action='store_true')
+    parser.add_argument("--partitions", help="create partitions for these numbers of cores in a single pass, NP is chosen among them for each machine", type=int, nargs='+', default=[])
+    parser.add_argument("--mesh_cache", help="cache directory of meshes and partitions on machine", type=str, default=meshcache.default_cachedir)
+    parser.add_argument("--no_mesh_cache", help="do not reuse meshes and partitions from cache", action='store_true')
+    parser.add_argument("--stats", help="compute field statistics per marker after Run (requires postprocessing installed on machine)", action='store_true')
+    parser.add_argument("--pipeline", help="run cmds on machine as a pipeline, skipping up to date stages and resuming after failure", action='store_true')
+    parser.add_argument("--pipeline_jobs", help="max number of concurrent stages (pipeline mode)", type=int, default=4)
+    parser.add_argument("--force_stages", help="stages to run even if up to date (pipeline mode)", type=str, nargs='+', default=[])
+    parser.add_argument("--workflow", help="run Workflow instead of Run (pipeline mode)", action='store_true')
+    parser.add_argument("--sweep", help="currents for an array job of the workflow (machines with a job manager)", type=str, nargs='+', default=[])
+    parser.add_argument("--queue", help="queue for jobs (machines with a job manager)", type=str, default=None)
+    parser.add_argument("--email", help="email notified at the end of jobs (machines with a job manager)", type=str, default=None)
+    parser.add_argument("--submit", help="submit jobs (machines with a job manager)", action='store_true')
+    parser.add_argument("--fake_scheduler", help="run jobs locally instead of submitting them (machines with a job manager)", action='store_true')
     parser.add_argument("--debug", help="activate debug", action='store_true')
     parser.add_argument("--verbose", help="activate verbose", action='store_true')
     args = parser.parse_args()
@@ -152,23 +229,15 @@ def main():
         jsonfile = args.msite
 
     (yamlfile, cfgfile, jsonfile, xaofile, meshfile, tarfilename) = setup(MyEnv, args, confdata, jsonfile)
-    cmds = setup_cmds(MyEnv, args, yamlfile, cfgfile, jsonfile, xaofile, meshfile)
+    io = {}
+    cmds = setup_cmds(MyEnv, args, yamlfile, cfgfile, jsonfile, xaofile, meshfile, io)
     
     # Print command to run
     machine = loadmachine(args.machine)
     # TODO
     # select a machine
-    # select NP
-    NP = machine.cores
-    if machine.multithreading:
-        NP = int(NP/2)
-    if args.debug:
-        print(f"NP={NP} {type(NP)}")
-    if args.np > 0:
-        if args.np > NP:
-            print(f'requested number of cores {args.np} exceed {machine.name} capability (max: {NP})')
-        else:
-            NP = args.np
+    # select NP (see setup_cmds)
+    (NP, NP_choice) = get_np(MyEnv, args, machine, meshfile)
 
     workingdir = cfgfile.replace(".cfg", "")
     geodir = MyEnv.yaml_repo.replace('/','',1)
@@ -188,6 +257,31 @@ def main():
         print(key, ':', cmds[key])
     print("==================================================")
 
+    if args.partitions:
+        print(f"\n\n=== Partitions {partitions(args, NP)} (use --machine to retarget the case) ===")
+        for (name, server) in load_machines().items():
+            print(f"{name}: np={get_np(MyEnv, args, server, meshfile)[0]}")
+        print("==================================================")
+
+    status = 0
+    if machine.manager.otype != JobManagerType.none:
+        jobs = batch.create_jobs(MyEnv, machine, workingdir, cmds, NP, sweep=args.sweep, queue=args.queue, email=args.email, debug=args.debug)
+        submitfile = f"{workingdir}-submit.sh"
+        batch.write_submit(jobs, machine.manager.otype, submitfile)
+
+        print(f"\n\n=== Guidelines for submitting a simu on {args.machine} ({machine.manager.otype.value}) ===")
+        print(f"Transfert job scripts to {args.machine}: scp {tarfilename} {' '.join([job.script for job in jobs])} {submitfile} {args.machine}:./{workingdir}")
+        print(f"Once connected on {args.machine} run: cd {workingdir} && ./{submitfile}")
+        print("==================================================")
+
+        if args.submit or args.fake_scheduler:
+            sched = batch.scheduler(machine.manager.otype, args.fake_scheduler)
+            ids = batch.submit(jobs, sched)
+            for (stage, jobid) in ids.items():
+                print(f"{stage}: job {jobid}")
+            if args.fake_scheduler:
+                status = max([job["status"] for job in sched.jobs.values()], default=0)
+
     # post-processing
     # TODO add automatic post-processing
 
@@ -199,16 +293,38 @@ def main():
     print("In a new terminal on your host, start Paraview: paraview")
     print("==================================================")
 
-    status = 0
     if args.auto:
-        status = fabric(args.machine, workingdir, geodir, args, cfgfile, jsonfile, meshfile, tarfilename, cmds)
+        # mesh is usually built by the Mesh stage on machines, its size is then read there (see fabric)
+        nelems = mesh_size(MyEnv, meshfile, args.debug)[1]
+        partmesh = io.get("Partition", {}).get("inputs", [""])[0]
+        if nelems <= 0:
+            print(f"auto: mesh size unknown for {meshfile}, will be read from {partmesh} on machines")
+        machine_names = args.machines if args.machines else [args.machine]
+        mcmds = {}
+        cases = {}
+        for name in machine_names:
+            # cmds depend on machine (NP, mgkeydir, smp)
+            args.machine = name
+            mcmds[name] = setup_cmds(MyEnv, args, yamlfile, cfgfile, jsonfile, xaofile, meshfile)
+            cases[name] = {
+                "name": workingdir,
+                "method": args.method,
+                "time": args.time,
+                "geom": args.geom,
+                "model": args.model,
+                "machine": name,
+                "np": get_np(MyEnv, args, loadmachine(name), meshfile)[0],
+                "nelems": nelems
+            }
+        status = fabric(machine_names, workingdir, geodir, args, cfgfile, jsonfile, meshfile, tarfilename, mcmds, cases, partmesh)
 
         # TODO 
         # print out some stats
         # start post-processing
-        # what about jobmanager??
         # start a workflow??
 
+    elif args.pipeline:
+        status = run_pipeline(args.machine, workingdir, args, tarfilename, cmds, io)
 
     # TODO save results back to db?
 
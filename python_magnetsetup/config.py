@@ -176,12 +176,17 @@ def check_templates(templates: dict):
     for key in templates:
         if isinstance(templates[key], str):
             print(key, templates[key])
-            with open(templates[key], "r") as f: pass
+            if not os.path.isfile(templates[key]):
+                raise FileNotFoundError(f"check_templates: {key} {templates[key]} not found")
 
-        elif isinstance(templates[key], str):
+        elif isinstance(templates[key], list):
+            # material_def lists names of generic materials, not templates
+            if key == "material_def":
+                continue
             for s in templates[key]:
                 print(key, s)
-                with open(s, "r") as f: pass
+                if not os.path.isfile(s):
+                    raise FileNotFoundError(f"check_templates: {key} {s} not found")
     print("==========================\n\n")
     
     return True
@@ -0,0 +1,216 @@
+"""
+Runtime history of simulations
+
+Timings of each stage of the commands created by setup_cmds
+(CAD, Mesh, Partition, Run, ...) are stored in a local SQLite database
+along with the case definition (method, geom, model), the machine,
+the number of cores and the mesh size.
+
+The history is used to predict the runtime of a new case and
+to recommend a machine and a number of cores.
+
+ex:
+python -m python_magnetsetup.history list
+python -m python_magnetsetup.history predict --geom Axi --model thelec --machine calcul22 --np 8 --nelems 200000
+python -m python_magnetsetup.history recommend --geom Axi --model thelec --nelems 200000
+"""
+
+from typing import List, Optional
+
+import sys
+import os
+import argparse
+import sqlite3
+import datetime
+
+import numpy as np
+
+from .machines import load_machines
+
+default_db = os.path.join(os.path.expanduser("~"), ".python_magnetsetup", "history.db")
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT,
+    name TEXT,
+    method TEXT,
+    time TEXT,
+    geom TEXT,
+    model TEXT,
+    machine TEXT,
+    np INTEGER,
+    nelems INTEGER
+);
+CREATE TABLE IF NOT EXISTS stages (
+    run INTEGER REFERENCES runs(id),
+    stage TEXT,
+    duration REAL,
+    status INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_case ON runs(geom, model, machine);
+"""
+
+def connect(dbfile: str = default_db):
+    """
+    open history database (created if needed)
+    """
+    dirname = os.path.dirname(dbfile)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    db = sqlite3.connect(dbfile)
+    db.executescript(schema)
+    return db
+
+def record(case: dict, stages: dict, dbfile: str = default_db) -> int:
+    """
+    store timings of a run
+
+    case: dict with name, method, time, geom, model, machine, np and nelems (-1 if unknown)
+    stages: dict of stage: (duration in s, exit status)
+
+    returns id of the run
+    """
+    with connect(dbfile) as db:
+        cursor = db.execute(
+            "INSERT INTO runs (date, name, method, time, geom, model, machine, np, nelems) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (datetime.datetime.now().isoformat(), case.get("name", ""), case.get("method", ""), case.get("time", ""),
+             case.get("geom", ""), case.get("model", ""), case.get("machine", ""), case.get("np", 1), case.get("nelems", -1)))
+        run = cursor.lastrowid
+        db.executemany("INSERT INTO stages (run, stage, duration, status) VALUES (?, ?, ?, ?)",
+                       [(run, stage, duration, status) for (stage, (duration, status)) in stages.items()])
+    return run
+
+def runs(geom: str, model: str, machine: Optional[str] = None, dbfile: str = default_db) -> List[tuple]:
+    """
+    get successful stage timings for geom and model (and machine)
+
+    runs with unknown mesh size (nelems <= 0, eg. mesh generated remotely) are excluded
+    returns a list of (stage, machine, np, nelems, duration)
+    """
+    query = "SELECT stage, machine, np, nelems, duration FROM runs JOIN stages ON runs.id = stages.run " \
+            "WHERE status = 0 AND nelems > 0 AND geom = ? AND model = ?"
+    params = [geom, model]
+    if machine:
+        query += " AND machine = ?"
+        params.append(machine)
+    with connect(dbfile) as db:
+        return db.execute(query, params).fetchall()
+
+def fit(rows: List[tuple]) -> np.ndarray:
+    """
+    fit duration = a * nelems/np + b * np + c
+
+    a: cost per element, b: communication/partitioning overhead per core, c: fixed cost
+    with less than 3 distinct runs, only the cost per element is fitted
+    """
+    NP = np.array([row[2] for row in rows], dtype=float)
+    nelems = np.array([row[3] for row in rows], dtype=float)
+    duration = np.array([row[4] for row in rows], dtype=float)
+
+    if len(set(zip(NP.tolist(), nelems.tolist()))) >= 3:
+        A = np.column_stack((nelems/NP, NP, np.ones(len(rows))))
+        coefs = np.linalg.lstsq(A, duration, rcond=None)[0]
+        return np.maximum(coefs, 0)
+    return np.array([np.median(duration * NP / nelems), 0, 0])
+
+def models(geom: str, model: str, machine: str, dbfile: str = default_db) -> dict:
+    """
+    fit a runtime model for each stage (see fit)
+
+    history of machine is used if available, otherwise history on all machines
+    """
+    rows = runs(geom, model, machine, dbfile)
+    if not rows:
+        rows = runs(geom, model, None, dbfile)
+    return {stage: fit([row for row in rows if row[0] == stage]) for stage in sorted(set(row[0] for row in rows))}
+
+def predict(geom: str, model: str, machine: str, NP: int, nelems: int, dbfile: str = default_db, debug: bool = False) -> dict:
+    """
+    predict duration of each stage (in s)
+    """
+    res = {}
+    for (stage, coefs) in models(geom, model, machine, dbfile).items():
+        res[stage] = float(coefs[0] * max(nelems, 1) / NP + coefs[1] * NP + coefs[2])
+        if debug:
+            print(f"predict: {stage} coefs={coefs} -> {res[stage]:.1f} s")
+    return res
+
+def recommend(geom: str, model: str, nelems: int, machines: Optional[List[str]] = None, dbfile: str = default_db, debug: bool = False) -> tuple:
+    """
+    recommend machine and number of cores to minimize predicted runtime
+
+    returns (machine, NP, predicted duration in s),
+    or (None, 0, 0) if there is no history for geom and model
+    """
+    servers = load_machines()
+    if machines is None:
+        machines = list(servers.keys())
+
+    best = (None, 0, 0)
+    for name in machines:
+        server = servers[name]
+        cores = server.cores
+        if server.multithreading:
+            cores = int(cores/2)
+
+        coefs = models(geom, model, name, dbfile)
+        if not coefs:
+            continue
+        a = sum(c[0] for c in coefs.values())
+        b = sum(c[1] for c in coefs.values())
+        c = sum(c[2] for c in coefs.values())
+        for NP in range(1, cores+1):
+            total = float(a * max(nelems, 1) / NP + b * NP + c)
+            if debug:
+                print(f"recommend: {name} NP={NP} -> {total:.1f} s")
+            if best[0] is None or total < best[2]:
+                best = (name, NP, total)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Query runtime history of simulations")
+    parser.add_argument("--db", help="history database", type=str, default=default_db)
+    parser.add_argument("--debug", help="activate debug", action='store_true')
+    subparsers = parser.add_subparsers(title="commands", dest="command", help='sub-command help')
+
+    subparsers.add_parser('list', help='list runs')
+
+    parser_predict = subparsers.add_parser('predict', help='predict runtime')
+    parser_predict.add_argument("--geom", type=str, choices=['Axi', '3D'], default='Axi')
+    parser_predict.add_argument("--model", type=str, default='thelec')
+    parser_predict.add_argument("--machine", type=str, required=True)
+    parser_predict.add_argument("--np", type=int, required=True)
+    parser_predict.add_argument("--nelems", help="number of elements", type=int, required=True)
+
+    parser_recommend = subparsers.add_parser('recommend', help='recommend machine and number of cores')
+    parser_recommend.add_argument("--geom", type=str, choices=['Axi', '3D'], default='Axi')
+    parser_recommend.add_argument("--model", type=str, default='thelec')
+    parser_recommend.add_argument("--machines", help="candidate machines (default: all)", nargs='+', type=str, default=None)
+    parser_recommend.add_argument("--nelems", help="number of elements", type=int, required=True)
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        with connect(args.db) as db:
+            for row in db.execute("SELECT runs.id, date, name, geom, model, machine, np, nelems, stage, duration, status FROM runs JOIN stages ON runs.id = stages.run ORDER BY runs.id"):
+                print(*row)
+    elif args.command == 'predict':
+        stages = predict(args.geom, args.model, args.machine, args.np, args.nelems, args.db, args.debug)
+        if not stages:
+            print(f"no history for {args.geom} {args.model}")
+            return 1
+        for (stage, duration) in stages.items():
+            print(f"{stage}: {duration:.1f} s")
+        print(f"total: {sum(stages.values()):.1f} s")
+    elif args.command == 'recommend':
+        (machine, NP, total) = recommend(args.geom, args.model, args.nelems, args.machines, args.db, args.debug)
+        if machine is None:
+            print(f"no history for {args.geom} {args.model}")
+            return 1
+        print(f"machine={machine} np={NP} (predicted: {total:.1f} s)")
+    else:
+        parser.print_help()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
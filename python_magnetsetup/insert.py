@@ -9,93 +9,50 @@ from python_magnetgeo import python_magnetgeo
 
 from .jsonmodel import create_params_insert, create_bcs_insert, create_materials_insert
 from .utils import Merge, NMerge
-from .file_utils import MyOpen, findfile, search_paths
+from .file_utils import MyOpen, search_paths
+from .artifacts import Artifact, cad_artifacts, resolve
 
 import os
 
-def Insert_simfile(MyEnv, confdata: dict, cad: Insert, addAir: bool = False):
-    print("Insert_simfile: %s" % cad.name)
-
-    files = []
-
-    # TODO: get xao and brep if they exist, otherwise go on
-    # TODO: add suffix _Air if needed ??
-    try:
-        xaofile = cad.name + ".xao"
-        if addAir:
-            xaofile = cad.name + "_withAir.xao"
-        f = findfile(xaofile, paths=search_paths(MyEnv, "cad"))
-        files.append(f)
-
-        brepfile = cad.name + ".brep"
-        if addAir:
-            brepfile = cad.name + "_withAir.brep"
-        f = findfile(brepfile, paths=search_paths(MyEnv, "cad"))
-        files.append(f)
-    except:
-        pass
-
-    for helix in cad.Helices:
-        with MyOpen(helix+".yaml", "r", paths=search_paths(MyEnv, "geom")) as f:
+def Insert_artifacts(MyEnv, confdata: dict, cad: Insert, addAir: bool = False, debug: bool = False) -> List[Artifact]:
+    """
+    get artifacts needed for insert simulation
+
+    helices geometries are resolved first since their content
+    gives the names of the other artifacts
+    """
+    name = cad.name
+    if addAir:
+        name = cad.name + "_withAir"
+    artifacts = cad_artifacts(name)
+
+    helices = resolve(MyEnv, [Artifact("geom", helix + ".yaml") for helix in cad.Helices], hash=False, debug=debug)
+    for helix in helices:
+        with open(helix.path, "r") as f:
             hhelix = yaml.load(f, Loader = yaml.FullLoader)
-            files.append(f.name)
+        artifacts.append(Artifact("geom", helix.name))
+        artifacts += cad_artifacts(hhelix.name)
 
-            # TODO: get xao and brep if they exist otherwise _salome.data
-            try:
-                xaofile = hhelix.name + ".xao"
-                f = findfile(xaofile, paths=search_paths(MyEnv, 'cad'))
-                files.append(f)
-                
-                brepfile = hhelix.name + ".brep"
-                f = findfile(brepfile, paths=search_paths(MyEnv, "cad"))
-                files.append(f)
-
-            except:
-                pass
-            
-            if hhelix.m3d.with_shapes:
-                with MyOpen(hhelix.name + str("_cut_with_shapes_salome.dat"), "r", paths=search_paths(MyEnv, "geom")) as fcut:
-                    files.append(fcut.name)
-                with MyOpen(hhelix.shape.profile, "r", paths=search_paths(MyEnv, "geom")) as fshape:
-                    files.append(fshape.name)
-            else:
-                with MyOpen(hhelix.name + str("_cut_salome.dat"), "r", paths=search_paths(MyEnv, "geom")) as fcut:
-                    files.append(fcut.name)
+        if hhelix.m3d.with_shapes:
+            artifacts.append(Artifact("geom", hhelix.name + "_cut_with_shapes_salome.dat"))
+            artifacts.append(Artifact("geom", hhelix.shape.profile))
+        else:
+            artifacts.append(Artifact("geom", hhelix.name + "_cut_salome.dat"))
 
     for ring in cad.Rings:
-        try:
-            xaofile = ring.name + ".xao"
-            f = findfile(xaofile, paths=search_paths(MyEnv, "cad"))
-            files.append(f)
-                
-            brepfile = ring.name + ".brep"
-            f = findfile(brepfile, paths=search_paths(MyEnv, "cad"))
-            files.append(f)
-
-        except:
-            pass
-        
-        with MyOpen(ring+".yaml", "r", paths=search_paths(MyEnv, "geom")) as f:
-            files.append(f.name)
+        artifacts += cad_artifacts(ring)
+        artifacts.append(Artifact("geom", ring + ".yaml"))
 
     if cad.CurrentLeads:
         for lead in cad.CurrentLeads:
-            try:
-                xaofile = lead.name + ".xao"
-                f = findfile(xaofile, paths=search_paths(MyEnv, "cad"))
-                files.append(f)
-
-                brepfile = lead.name + ".brep"
-                f = findfile(brepfile, paths=search_paths(MyEnv, "cad"))
-                files.append(f)
-
-            except:
-                pass
-            
-            with MyOpen(lead+".yaml", "r", paths=search_paths(MyEnv, "geom")) as f:
-                files.append(f.name)
-
-    return files
+            artifacts += cad_artifacts(lead)
+            artifacts.append(Artifact("geom", lead + ".yaml"))
+
+    return artifacts
+
+def Insert_simfile(MyEnv, confdata: dict, cad: Insert, addAir: bool = False, debug: bool = False) -> List[Artifact]:
+    print("Insert_simfile: %s" % cad.name)
+    return resolve(MyEnv, Insert_artifacts(MyEnv, confdata, cad, addAir, debug), debug=debug)
 
 def Insert_setup(MyEnv, confdata: dict, cad: Insert, method_data: List, templates: dict, debug: bool=False):
     print("Insert_setup: %s" % cad.name)
@@ -1,7 +1,8 @@
-from typing import List, Union, Optional
+from typing import Iterator, List, Optional, Tuple, Union
 
 import sys
 import os
+import re
 import json
 import yaml
 
@@ -9,6 +10,7 @@ import math
 
 from .utils import Merge
 from .units import load_units, convert_data
+from .precompile import load_tokens
 
 def create_params_supra(gdata: tuple, method_data: List[str], debug: bool=False) -> dict:
     """
@@ -416,49 +418,29 @@ def create_bcs_insert(boundary_meca: List,
             
     return {}
 
-def create_json(jsonfile: str, mdict: dict, mmat: dict, mpost: dict, templates: dict, method_data: List[str], debug: bool = False):
+def add_stats(post: dict, mpost: dict, templates: dict, method_data: List[str], debug: bool = False):
     """
-    Create a json model file
+    Add statistics (flux, meanT_H, current_H, power_H) to PostProcess section
     """
-    
-    if debug: 
-        print("create_json jsonfile=", jsonfile)
-        print("create_json mdict=", mdict)
-    data = entry(templates["model"], mdict, debug)   
-    if debug: print("create_json/data model:", data)
-    
-    # material section
-    if "Materials" in data:
-        for key in mmat:
-            data["Materials"][key] = mmat[key]
-    else:
-        data["Materials"] = mmat
-    if debug: print("create_json/Materials data:", data)
-
-    # postprocess
-    # print("=== FORCE DEBUG to True ===")
-    # debug = True
     if "flux" in mpost:
-        if "heat" in data["PostProcess"]:
+        if "heat" in post:
             flux_data = mpost["flux"]
             if debug: 
                 print("flux", type(flux_data))
-            add = data["PostProcess"]["heat"]["Measures"]["Statistics"]
             odata = entry(templates["flux"], flux_data, debug)
             if debug: print(odata)
             for md in odata["Flux"]:
-                data["PostProcess"]["heat"]["Measures"]["Statistics"][md] = odata["Flux"][md]
+                post["heat"]["Measures"]["Statistics"][md] = odata["Flux"][md]
     
     if "meanT_H" in mpost:
-        if "heat" in data["PostProcess"]:
+        if "heat" in post:
             meanT_data = mpost["meanT_H"]
             if debug: 
                 print("meanT_H", type(meanT_data))
-            add = data["PostProcess"]["heat"]["Measures"]["Statistics"]
             odata = entry(templates["stats"][0], {'meanT_H': meanT_data}, debug)
             if debug: print("odata:", odata)
             for md in odata["Stats_T"]:
-                data["PostProcess"]["heat"]["Measures"]["Statistics"][md] = odata["Stats_T"][md]
+                post["heat"]["Measures"]["Statistics"][md] = odata["Stats_T"][md]
 
     index_post_ = 0
     section = "electric"
@@ -469,18 +451,16 @@ def create_json(jsonfile: str, mdict: dict, mmat: dict, mpost: dict, templates:
         elif method_data[3] in ['mag', 'mag_hcurl', 'mqs', 'mqs_hcurl'] :
             section = "magnetic" 
 
-    
     if "current_H" in mpost:
         if debug:
             print("current_H")
             print("section:", section)
             print("templates[stats]:", templates["stats"])
         currentH_data = mpost["current_H"]
-        add = data["PostProcess"][section]["Measures"]["Statistics"]
         odata = entry(templates["stats"][index_post_+1], {'Current_H': currentH_data}, debug)
         if debug: print(odata)
         for md in odata["Stats_Current"]:
-            data["PostProcess"][section]["Measures"]["Statistics"][md] = odata["Stats_Current"][md]
+            post[section]["Measures"]["Statistics"][md] = odata["Stats_Current"][md]
     
     if "power_H" in mpost:
         if debug:
@@ -488,43 +468,215 @@ def create_json(jsonfile: str, mdict: dict, mmat: dict, mpost: dict, templates:
             print("section:", section)
             print("templates[stats]:", templates["stats"])
         powerH_data = mpost["power_H"]
-        add = data["PostProcess"][section]["Measures"]["Statistics"]
         odata = entry(templates["stats"][index_post_], {'Power_H': powerH_data}, debug)
         if debug: print(odata)
         for md in odata["Stats_Power"]:
-            data["PostProcess"][section]["Measures"]["Statistics"][md] = odata["Stats_Power"][md]
+            post[section]["Measures"]["Statistics"][md] = odata["Stats_Power"][md]
+
+def materials(model: dict, mmat: dict) -> Iterator[Tuple[str, dict]]:
+    """
+    iterate over materials of model section, overridden by mmat, then over other materials of mmat
+    """
+    for key in model:
+        yield (key, mmat[key] if key in mmat else model[key])
+    for key in mmat:
+        if not key in model:
+            yield (key, mmat[key])
+
+def model_sections(mdict: dict, mmat: dict, mpost: dict, templates: dict, method_data: List[str], debug: bool = False) -> Iterator[Tuple[str, object]]:
+    """
+    Yield sections of json model (Parameters, Materials, BoundaryConditions, PostProcess, ...)
+
+    Materials are yielded as an iterator over (name, material), see write_json
+    """
+    data = entry(templates["model"], mdict, debug)   
+    if debug: print("create_json/data model:", data)
+
+    for key in list(data):
+        # release sections once written
+        value = data.pop(key)
+        if key == "Materials":
+            value = materials(value, mmat)
+        elif key == "PostProcess":
+            add_stats(value, mpost, templates, method_data, debug)
+        yield (key, value)
+        if key == "Materials":
+            mmat = None
+
+    if mmat is not None:
+        yield ("Materials", materials({}, mmat))
+
+def write_json(out, sections: Iterator[Tuple[str, object]], indent: int = 4):
+    """
+    Write sections as a json object (same layout as json.dumps(indent=indent))
+
+    values are encoded incrementally (see json.JSONEncoder.iterencode),
+    iterators over (key, value) are written as json objects
+    """
+    encoder = json.JSONEncoder(indent=indent)
+
+    def write_value(value, level: int):
+        if isinstance(value, Iterator):
+            write_object(value, level)
+        else:
+            pad = "\n" + " " * (indent * level)
+            for chunk in encoder.iterencode(value):
+                out.write(chunk.replace("\n", pad))
+
+    def write_object(items: Iterator[Tuple[str, object]], level: int):
+        pad = "\n" + " " * (indent * (level+1))
+        out.write("{")
+        empty = True
+        for (key, value) in items:
+            out.write(("," if not empty else "") + pad + json.dumps(key) + ": ")
+            write_value(value, level+1)
+            empty = False
+        out.write("}" if empty else "\n" + " " * (indent * level) + "}")
+
+    write_object(sections, 0)
+
+def create_json(jsonfile: str, mdict: dict, mmat: dict, mpost: dict, templates: dict, method_data: List[str], debug: bool = False):
+    """
+    Create a json model file
+    """
     
-    mdata = json.dumps(data, indent = 4)
+    if debug: 
+        print("create_json jsonfile=", jsonfile)
+        print("create_json mdict=", mdict)
+
+    if os.path.exists(jsonfile):
+        raise FileExistsError(f"create_json: {jsonfile} already exists")
 
-    with open(jsonfile, "x") as out:
-        out.write(mdata)
+    # write to a temporary file so that a failure while rendering
+    # sections does not leave a truncated jsonfile
+    tmpfile = jsonfile + ".tmp"
+    try:
+        with open(tmpfile, "w") as out:
+            write_json(out, model_sections(mdict, mmat, mpost, templates, method_data, debug))
+        os.replace(tmpfile, jsonfile)
+    except BaseException:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        raise
     return
 
+def _lookup(key: str, scopes: list):
+    """
+    get value of mustache key (eg. name, Helix.material, .) in scopes
+    """
+    if key == '.':
+        return scopes[-1]
+    names = key.split('.')
+    for scope in reversed(scopes):
+        if isinstance(scope, dict) and names[0] in scope:
+            value = scope[names[0]]
+            break
+    else:
+        return None
+    for name in names[1:]:
+        if isinstance(value, dict):
+            value = value.get(name)
+        else:
+            value = getattr(value, name, None)
+    return value
+
+def _value(value) -> str:
+    """
+    get json representation of value,
+    lists and dicts are rendered as json (instead of python repr)
+    """
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(value)
+    return str(value)
+
+_trailing_comma = re.compile(r',(\s*[}\]])')
+
+def _drop_comma(out: List[str]):
+    """
+    remove trailing comma (and following blanks) from rendered output
+    """
+    while out and not out[-1].strip():
+        out.pop()
+    if out:
+        text = out[-1].rstrip()
+        if text.endswith(','):
+            out[-1] = text[:-1]
+
+def _render_tokens(tokens: list, scopes: list, out: List[str], template: str):
+    """
+    render tokens (see chevron.tokenizer) as json
+
+    items of list sections are separated by commas (whether or not the template
+    ends items with a comma) and commas before a closing } or ] are removed
+    """
+    i = 0
+    while i < len(tokens):
+        (tag, key) = tokens[i]
+        i += 1
+        if tag == 'literal':
+            key = _trailing_comma.sub(r'\1', key)
+            if key.lstrip()[:1] in ['}', ']']:
+                _drop_comma(out)
+            out.append(key)
+        elif tag in ['variable', 'no escape']:
+            out.append(_value(_lookup(key, scopes)))
+        elif tag in ['section', 'inverted section']:
+            # get tokens of section
+            (depth, j) = (1, i)
+            while depth:
+                if tokens[j][0] in ['section', 'inverted section']:
+                    depth += 1
+                elif tokens[j][0] == 'end':
+                    depth -= 1
+                j += 1
+            section = tokens[i:j-1]
+            i = j
+
+            value = _lookup(key, scopes)
+            if tag == 'inverted section':
+                if not value:
+                    _render_tokens(section, scopes, out, template)
+            elif isinstance(value, (list, tuple)):
+                for n, item in enumerate(value):
+                    if n:
+                        _drop_comma(out)
+                        out.append(',')
+                    _render_tokens(section, scopes + [item], out, template)
+            elif value:
+                _render_tokens(section, scopes + [value], out, template)
+        elif tag in ['comment', 'set delimiter']:
+            pass
+        else:
+            raise ValueError(f"render: {template} unsupported mustache tag {tag} ({key})")
+
+def render(template: str, rdata: dict, debug: bool = False) -> str:
+    """
+    render template (see precompile.load_tokens) as json
+    """
+    out = []
+    _render_tokens(load_tokens(template), [rdata], out, template)
+    jsonfile = "".join(out)
+    if debug:
+        print(f"render/jsonfile: {jsonfile}")
+    return jsonfile
+
+def loads(text: str, template: str = "") -> dict:
+    """
+    load rendered json, report location of errors
+    """
+    try:
+        return json.loads(text)
+    except json.decoder.JSONDecodeError as e:
+        line = text.splitlines()[e.lineno-1] if text else ""
+        raise ValueError(f"{template}: line {e.lineno} column {e.colno}: {e.msg}\n{line}\n{' ' * (e.colno-1)}^") from None
+
 def entry(template: str, rdata: List, debug: bool = False) -> str:
-    import chevron
-    import re
-    
     if debug:
         print("entry/loading %s" % str(template), type(template))
         print("entry/rdata:", rdata)
-    with open(template, "r") as f:
-        jsonfile = chevron.render(f, rdata)
-    jsonfile = jsonfile.replace("\'", "\"")
-    # print("jsonfile:", jsonfile)
-
-    corrected = re.sub(r'},\s+},\n', '}\n},\n', jsonfile)
-    corrected = re.sub(r'},\s+}\n', '}\n}\n', corrected)
-    # corrected = re.sub(r'},\s+}\n', '}\n}\n', corrected)
-    corrected = corrected.replace("&quot;", "\"")
-    if debug:
-        print(f"entry/jsonfile: {jsonfile}")
-        print(f"corrected: {corrected}")
-    try:
-        mdata = json.loads(corrected)
-    except json.decoder.JSONDecodeError:
-        # ??how to have more info on the pb??
-        # save corrected to tmp file and run jsonlint-php tmp?? 
-        raise Exception(f"entry: json.decoder.JSONDecodeError in {corrected}")
+    mdata = loads(render(template, rdata, debug), template)
 
     if debug:
         print("entry/data (json):\n", mdata)
@@ -6,7 +6,7 @@ import json
 
 import enum
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 class JobManagerType(str, enum.Enum):
     none = "none"
@@ -34,7 +34,7 @@ class machine():
     dns: str
     otype: MachineType = MachineType.compute
     smp: bool = True
-    manager: jobmanager = jobmanager(JobManagerType.none)
+    manager: jobmanager = field(default_factory=jobmanager)
     cores: int = 2
     multithreading: bool = True
     mgkeydir: str = r"/opt/MeshGems"
@@ -0,0 +1,76 @@
+"""
+Cache of meshes and partitions
+
+Meshes and partitions only depend on the geometry, not on the model or
+the cooling. They are cached on the machine running the simulation in:
+
+{cachedir}/{mesh key}/{gmshfile}
+{cachedir}/{mesh key}/np_{NP}/{name}_p{NP}.*
+
+mesh key: hash of geometry artifacts (see setup manifest), air flag and mesh options
+partition key: mesh key, NP and scale
+
+The cmds created by setup_cmds are wrapped (see cached_cmds) so that
+CAD, Mesh, Convert and Partition are skipped when the partition (or the mesh)
+is in cache, and their outputs are stored in cache otherwise.
+"""
+
+from typing import List
+
+import hashlib
+
+from .artifacts import Artifact
+
+default_cachedir = "$HOME/.cache/python_magnetsetup/meshes"
+
+# kinds of artifacts defining the geometry
+geometry_kinds = ["geom", "cad", "mesh"]
+
+def mesh_key(artifacts: List[Artifact], air: bool, options: str) -> str:
+    """
+    get key of mesh from geometry artifacts, air flag and mesh options (mesh cmd, geom)
+    """
+    sha = hashlib.sha256()
+    for artifact in sorted([artifact for artifact in artifacts if artifact.kind in geometry_kinds], key=lambda a: (a.kind, a.name)):
+        sha.update(f"{artifact.kind}:{artifact.name}:{artifact.hash}\n".encode())
+    sha.update(f"air={air}\n".encode())
+    sha.update(f"options={options}\n".encode())
+    return sha.hexdigest()[:16]
+
+def partition_dir(cachedir: str, key: str, NP: int, scale: str) -> str:
+    """
+    get cache directory of partition for NP and scale
+    """
+    suffix = "" if not scale else "_" + hashlib.sha1(scale.encode()).hexdigest()[:8]
+    return f"{cachedir}/{key}/np_{NP}{suffix}"
+
+def cached_cmds(cmds: dict, cachedir: str, key: str, NP: int, scale: str, gmshfile: str, partfiles: dict, workingdir: str) -> dict:
+    """
+    wrap CAD, Mesh, Convert and Partition cmds to use the cache
+
+    NP: number of cores of the simulation
+    gmshfile: mesh file as used by the partitioner
+    partfiles: glob of partition files for each NP created by the partitioner (eg. {workingdir}/{name}_p{NP}.*)
+    """
+    meshdir = f"{cachedir}/{key}"
+    partdir = partition_dir(cachedir, key, NP, scale)
+    cached_mesh = f"{meshdir}/{gmshfile.split('/')[-1]}"
+    # .done is written once all partition files are stored
+    partition_hit = f"[ -f {partdir}/.done ]"
+    mesh_hit = f"[ -f {cached_mesh} ]"
+
+    res = dict(cmds)
+    for stage in ["CAD", "Convert"]:
+        if stage in cmds:
+            res[stage] = f"{partition_hit} || {mesh_hit} || {{ {cmds[stage]}; }}"
+    if "Mesh" in cmds:
+        res["Mesh"] = f"{partition_hit} || {{ {mesh_hit} && cp {cached_mesh} {gmshfile}; }} || {{ {cmds['Mesh']}; }}"
+    if "Partition" in cmds:
+        store = [f"mkdir -p {meshdir}", f"{{ {mesh_hit} || cp {gmshfile} {cached_mesh}; }}"]
+        for (n, files) in partfiles.items():
+            ndir = partition_dir(cachedir, key, n, scale)
+            store.append(f"mkdir -p {ndir} && cp {files} {ndir}/ && touch {ndir}/.done")
+        store = " && ".join(store)
+        res["Partition"] = f"if {partition_hit}; then echo 'Partition: cache hit ({partdir})' && mkdir -p {workingdir} && cp {partdir}/* {workingdir}/; " \
+                           f"else {cmds['Partition']} && {store}; fi"
+    return res
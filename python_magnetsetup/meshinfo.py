@@ -0,0 +1,158 @@
+"""
+Mesh information
+
+Get number of nodes and elements from mesh file headers
+without loading the mesh:
+- gmsh .msh (version 2 and 4, ascii or binary)
+- salome .med (requires h5py)
+
+These are used to propose a number of cores for a given target
+of elements per core (see select_np).
+"""
+
+from typing import List, Tuple
+
+import struct
+
+# target number of elements per core
+targets = {
+    "Axi": 20000,
+    "3D": 50000,
+}
+
+# physics in model names (eg thmagel: th, mag, el)
+physics = ["elec", "th", "mag", "mqs", "el"]
+
+def nphysics(model: str) -> int:
+    """
+    get number of physics in model name
+    """
+    name = model.split('_')[0]
+    n = 0
+    while name:
+        for p in physics:
+            if name.startswith(p):
+                n += 1
+                name = name[len(p):]
+                break
+        else:
+            break
+    return max(1, n)
+
+def msh_header(filename, debug: bool = False) -> Tuple[int, int]:
+    """
+    get number of nodes and elements from gmsh file
+
+    filename: path or binary file object (eg. remote executor open)
+    for binary version 4 files, only the number of nodes is read
+    and the number of elements is returned as -1
+    """
+    if isinstance(filename, str):
+        with open(filename, 'rb') as f:
+            return msh_header(f, debug)
+
+    f = filename
+    nnodes = -1
+    nelems = -1
+    binary = False
+    datasize = 8
+    version = 2.2
+
+    while True:
+        line = f.readline()
+        if not line:
+            break
+        line = line.strip()
+        if line == b'$MeshFormat':
+            (sversion, filetype, sdatasize) = f.readline().split()[:3]
+            version = float(sversion)
+            binary = (filetype == b'1')
+            datasize = int(sdatasize)
+        elif line == b'$Nodes':
+            if version >= 4 and binary:
+                # numEntityBlocks numNodes minNodeTag maxNodeTag as size_t
+                fmt = 'Q' if datasize == 8 else 'I'
+                nnodes = struct.unpack(f'<4{fmt}', f.read(4*datasize))[1]
+                # cannot skip binary node blocks without reading them
+                break
+            header = f.readline().split()
+            nnodes = int(header[1]) if version >= 4 else int(header[0])
+        elif line == b'$Elements':
+            header = f.readline().split()
+            nelems = int(header[1]) if version >= 4 else int(header[0])
+            break
+
+    if debug:
+        print(f"msh_header: {getattr(f, 'name', f)} version={version} binary={binary} nodes={nnodes} elements={nelems}")
+    return (nnodes, nelems)
+
+def med_header(filename: str, debug: bool = False) -> Tuple[int, int]:
+    """
+    get number of nodes and elements from med file
+
+    only elements of the highest dimension are counted
+    """
+    import h5py
+
+    volumes = ["TE4", "T10", "HE8", "H20", "PE6", "P15", "PY5", "P13"]
+    surfaces = ["TR3", "TR6", "QU4", "QU8"]
+
+    nnodes = 0
+    nvolumes = 0
+    nsurfaces = 0
+    with h5py.File(filename, 'r') as f:
+        for mesh in f['ENS_MAA'].values():
+            # only the first time step
+            step = next(iter(mesh.values()))
+            nnodes += int(step['NOE']['COO'].attrs['NBR'])
+            if 'MAI' in step:
+                for (etype, group) in step['MAI'].items():
+                    n = int(group['NOD'].attrs['NBR'])
+                    if etype in volumes:
+                        nvolumes += n
+                    elif etype in surfaces:
+                        nsurfaces += n
+
+    nelems = nvolumes if nvolumes else nsurfaces
+    if debug:
+        print(f"med_header: {filename} nodes={nnodes} elements={nelems}")
+    return (nnodes, nelems)
+
+def mesh_header(filename: str, debug: bool = False) -> Tuple[int, int]:
+    """
+    get number of nodes and elements from mesh file
+    """
+    if filename.endswith('.msh'):
+        return msh_header(filename, debug)
+    if filename.endswith('.med'):
+        return med_header(filename, debug)
+    raise RuntimeError(f"mesh_header: unsupported mesh format {filename}")
+
+def select_np(nnodes: int, nelems: int, cores: int, geom: str = "Axi", model: str = "thelec", target: int = 0, debug: bool = False) -> int:
+    """
+    propose number of cores to get about target elements per core
+
+    target is scaled by the number of physics in the model
+    (eg thmagel: th, mag, el) since each adds unknowns per element
+    """
+    if target <= 0:
+        target = targets[geom]
+    weight = nphysics(model)
+    if nelems < 0:
+        # binary gmsh v4: estimate elements from nodes
+        nelems = 2 * nnodes if geom == "Axi" else 6 * nnodes
+
+    NP = max(1, min(cores, round(nelems * weight / target)))
+    if debug:
+        print(f"select_np: {nelems} elements, weight={weight}, target={target} per core -> NP={NP} (max: {cores})")
+    return NP
+
+def select_partition(NP: int, parts: List[int], debug: bool = False) -> int:
+    """
+    select among available partitions the largest one using at most NP cores
+    """
+    candidates = [n for n in parts if n <= NP]
+    res = max(candidates) if candidates else min(parts)
+    if debug:
+        print(f"select_partition: NP={NP} partitions={sorted(parts)} -> {res}")
+    return res
@@ -0,0 +1,175 @@
+"""
+Pipeline of simulation commands
+
+The commands created by setup_cmds are modelled as tasks with dependencies
+and declared inputs/outputs (see setup_cmds io):
+- independent tasks run concurrently (eg. Postprocessing, Stats and Save),
+- tasks whose outputs are up to date are skipped (eg. CAD or mesh already there),
+- the state of tasks is saved in a json file so that a failed pipeline
+  resumes from the failing task.
+
+Tasks are run through the executors of remote (LocalExecutor, FabricExecutor).
+"""
+
+from typing import List
+
+import os
+import json
+import threading
+
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# stages in order of execution
+chain = ["Unpack", "CAD", "Mesh", "Convert", "Partition", "Update_Mesh", "Update_Partition", "Run", "Workflow", "Postprocessing", "Stats", "Save"]
+
+# stages depending on another stage than the previous one
+depends = {"Postprocessing": "Run", "Stats": "Run", "Save": "Run"}
+
+@dataclass
+class Task():
+    """
+    task definition
+
+    deps: tasks to be completed before this one
+    inputs, outputs: files (or directories) read and written by cmd
+    """
+    name: str
+    cmd: str
+    deps: List[str] = field(default_factory=list)
+    inputs: List[str] = field(default_factory=list)
+    outputs: List[str] = field(default_factory=list)
+
+def create_tasks(cmds: dict, io: dict = {}, workflow: bool = False, debug: bool = False) -> dict:
+    """
+    create tasks from cmds
+
+    workflow: run Workflow instead of Run
+    returns dict of name: Task in order of execution
+    """
+    run = "Workflow" if workflow else "Run"
+    stages = [stage for stage in chain if stage in cmds and stage != ("Run" if workflow else "Workflow")]
+
+    tasks = {}
+    previous = None
+    for stage in stages:
+        deps = [previous] if previous else []
+        if stage in depends and depends[stage].replace("Run", run) in stages:
+            deps = [depends[stage].replace("Run", run)]
+        tasks[stage] = Task(stage, cmds[stage], deps, io.get(stage, {}).get("inputs", []), io.get(stage, {}).get("outputs", []))
+        if not stage in depends:
+            previous = stage
+        if debug:
+            print(f"create_tasks: {stage} deps={deps} inputs={tasks[stage].inputs} outputs={tasks[stage].outputs}")
+    return tasks
+
+def signature(executor, paths: List[str], workingdir: str = ".") -> dict:
+    """
+    get modification time and content hash of paths on executor
+
+    hash of directories is computed from the list of their files
+    (path, modification time and size),
+    missing paths are not in the returned dict
+    """
+    if not paths:
+        return {}
+    names = " ".join([f'"{path}"' for path in paths])
+    cmd = f"cd {workingdir} && for p in {names}; do " \
+          "if [ -f \"$p\" ]; then echo \"$p|$(stat -c %Y \"$p\")|$(md5sum < \"$p\" | cut -d' ' -f1)\"; " \
+          "elif [ -d \"$p\" ]; then echo \"$p|$(stat -c %Y \"$p\")|$(find \"$p\" -type f -printf '%P %T@ %s\\n' | sort | md5sum | cut -d' ' -f1)\"; " \
+          "elif [ -e \"$p\" ]; then echo \"$p|$(stat -c %Y \"$p\")|\"; fi; done"
+    (status, stdout) = executor.run(cmd)
+    res = {}
+    for line in stdout.splitlines():
+        (name, mtime, md5) = line.rsplit('|', 2)
+        res[name] = [int(mtime), md5]
+    return res
+
+def uptodate(executor, task: Task, state: dict, workingdir: str = ".") -> bool:
+    """
+    check if task needs to be run
+
+    a task is up to date if its outputs exist and either
+    it succeeded with the same cmd and inputs content (see state),
+    or it was never run and its outputs are newer than its inputs
+
+    inputs are compared by content so that cmds editing a file in place
+    (eg. Update_Mesh) do not trigger the following tasks when they are idempotent
+    """
+    files = signature(executor, task.inputs + task.outputs, workingdir)
+    if any(not output in files for output in task.outputs):
+        return False
+
+    previous = state.get(task.name)
+    if previous is not None:
+        return previous["status"] == 0 and previous["cmd"] == task.cmd and previous["inputs"] == {path: files[path][1] if path in files else None for path in task.inputs}
+
+    if not task.outputs:
+        return False
+    oldest = min(files[output][0] for output in task.outputs)
+    return all(files[path][0] <= oldest for path in task.inputs if path in files)
+
+def load_state(statefile: str) -> dict:
+    if statefile and os.path.isfile(statefile):
+        with open(statefile, 'r') as f:
+            return json.loads(f.read())
+    return {}
+
+def save_state(statefile: str, state: dict):
+    if statefile:
+        with open(statefile, 'w') as f:
+            f.write(json.dumps(state, indent=4))
+
+def run(executor, tasks: dict, pre: str = "", workingdir: str = ".", statefile: str = "", nworkers: int = 4, force: List[str] = [], debug: bool = False) -> dict:
+    """
+    run tasks on executor in workingdir
+
+    pre: cmd run before each task (eg. cmds["Pre"])
+    statefile: json file to save state of tasks (to resume a failed pipeline)
+    force: tasks to run even if up to date
+
+    a task is always run when one of its dependencies was run (not skipped)
+
+    returns dict of task: status (0: done, 'skipped': up to date, 'blocked': a dependency failed)
+    """
+    state = load_state(statefile)
+    lock = threading.Lock()
+    results = {}
+
+    def task_run(task: Task):
+        cmd = " && ".join([c for c in [f"cd {workingdir}", pre, task.cmd] if c])
+        if debug:
+            print(f"{executor.name}: {cmd}")
+        (status, stdout) = executor.run(cmd, hide=not debug)
+        with lock:
+            files = signature(executor, task.inputs, workingdir)
+            state[task.name] = {"cmd": task.cmd, "status": status, "inputs": {path: files[path][1] if path in files else None for path in task.inputs}}
+            save_state(statefile, state)
+        return status
+
+    pending = dict(tasks)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, nworkers)) as pool:
+        while pending or running:
+            for (name, task) in list(pending.items()):
+                deps = [results.get(dep) for dep in task.deps if dep in tasks]
+                if any(dep is None for dep in deps):
+                    continue
+                del pending[name]
+                if any(not dep in [0, 'skipped'] for dep in deps):
+                    results[name] = 'blocked'
+                elif not name in force and not 0 in deps and uptodate(executor, task, state, workingdir):
+                    results[name] = 'skipped'
+                    print(f"{executor.name}: {name} up to date")
+                else:
+                    running[pool.submit(task_run, task)] = name
+            if not running:
+                continue
+
+            (done, _) = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+                print(f"{executor.name}: {name} done (status={results[name]})")
+
+    return results
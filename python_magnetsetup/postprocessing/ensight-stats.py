@@ -0,0 +1,294 @@
+"""
+Console script for scalar field statistics without paraview.
+
+Read EnSight Gold binary exports (eg. cfpdes.exports/Export.case)
+and compute min/max/mean of fields per part (ie. marker).
+Variable files are memory-mapped so only the requested fields are read.
+
+python3 ensight-stats.py resultdir1 resultdir2 --fields heat.temperature --np 4 --output stats.csv
+"""
+
+from typing import List, Optional
+
+import os
+import sys
+import glob
+import json
+import argparse
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+# nodes per element for EnSight element types
+nodes_per_element = {
+    "point": 1,
+    "bar2": 2, "bar3": 3,
+    "tria3": 3, "tria6": 6,
+    "quad4": 4, "quad8": 8,
+    "tetra4": 4, "tetra10": 10,
+    "pyramid5": 5, "pyramid13": 13,
+    "penta6": 6, "penta15": 15,
+    "hexa8": 8, "hexa20": 20,
+}
+
+# number of components per variable type
+components = {
+    "scalar": 1,
+    "vector": 3,
+    "tensor symm": 6,
+    "tensor asym": 9,
+}
+
+def read_string(f) -> str:
+    return f.read(80).split(b'\0')[0].decode('ascii', errors='ignore').strip()
+
+def read_int(f, n: int = 1) -> np.ndarray:
+    return np.frombuffer(f.read(4*n), dtype='<i4')
+
+def skip(f, n: int, size: int = 4):
+    f.seek(n*size, os.SEEK_CUR)
+
+def parse_case(casefile: str) -> dict:
+    """
+    parse EnSight case file
+
+    returns dict with geometry, variables (name: (type, location, filename, timeset))
+    and timesets (id: {times, filenames numbers})
+    """
+    case = {"geometry": None, "variables": {}, "timesets": {}}
+    section = None
+    timeset = None
+    key = None
+    with open(casefile, 'r') as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            if line in ["FORMAT", "GEOMETRY", "VARIABLE", "TIME", "FILE"]:
+                section = line
+                continue
+
+            if ':' in line:
+                (key, value) = [item.strip() for item in line.split(':', 1)]
+                tokens = value.split()
+            else:
+                tokens = line.split()
+
+            if section == "GEOMETRY" and key == "model":
+                # model: [ts] [fs] filename [change_coords_only]
+                ts = tokens[0] if len(tokens) > 1 and tokens[0].isdigit() else None
+                names = [token for token in tokens if not token.isdigit()]
+                case["geometry"] = (names[0], ts)
+            elif section == "VARIABLE":
+                # type per location: [ts] [fs] description filename
+                (vtype, location) = key.rsplit(' per ', 1)
+                ts = tokens[0] if len(tokens) > 2 and tokens[0].isdigit() else None
+                names = tokens[-2:]
+                case["variables"][names[0]] = (vtype, location, names[1], ts)
+            elif section == "TIME":
+                if key == "time set":
+                    timeset = tokens[0]
+                    case["timesets"][timeset] = {"times": [], "numbers": [], "start": 0, "increment": 1, "steps": 0}
+                elif key == "number of steps":
+                    case["timesets"][timeset]["steps"] = int(tokens[0])
+                elif key == "filename start number":
+                    case["timesets"][timeset]["start"] = int(tokens[0])
+                elif key == "filename increment":
+                    case["timesets"][timeset]["increment"] = int(tokens[0])
+                elif key == "filename numbers":
+                    case["timesets"][timeset]["numbers"] += [int(token) for token in tokens]
+                elif key == "time values":
+                    case["timesets"][timeset]["times"] += [float(token) for token in tokens]
+
+    for ts in case["timesets"].values():
+        if not ts["numbers"]:
+            ts["numbers"] = [ts["start"] + i * ts["increment"] for i in range(ts["steps"])]
+    return case
+
+def filename(dirname: str, pattern: str, case: dict, ts: Optional[str], step: int) -> str:
+    """
+    get filename for time step (wildcards * replaced by the file number)
+    """
+    if ts is None or not '*' in pattern:
+        return os.path.join(dirname, pattern)
+    number = case["timesets"][ts]["numbers"][step]
+    nwild = pattern.count('*')
+    return os.path.join(dirname, pattern.replace('*' * nwild, str(number).zfill(nwild)))
+
+def read_geometry(geofile: str) -> List[dict]:
+    """
+    read parts of EnSight Gold binary geometry
+
+    only part numbers, names, number of nodes and elements per type are kept,
+    coordinates and connectivities are skipped
+    """
+    parts = []
+    with open(geofile, 'rb') as f:
+        fmt = read_string(f)
+        if not fmt.lower().startswith("c binary"):
+            raise RuntimeError(f"read_geometry: {geofile} unsupported format '{fmt}' (expect C Binary)")
+        read_string(f)
+        read_string(f)
+        node_ids = read_string(f).split()[-1] in ["given", "ignore"]
+        element_ids = read_string(f).split()[-1] in ["given", "ignore"]
+
+        line = read_string(f)
+        if line.startswith("extents"):
+            skip(f, 6)
+            line = read_string(f)
+
+        while line.startswith("part"):
+            part = {"id": int(read_int(f)[0]), "name": read_string(f), "nnodes": 0, "elements": {}}
+            line = read_string(f)
+            while line:
+                if line.startswith("part"):
+                    break
+                if line.startswith("coordinates"):
+                    nn = int(read_int(f)[0])
+                    part["nnodes"] = nn
+                    skip(f, nn * (4 if node_ids else 3))
+                elif line.startswith("block"):
+                    raise RuntimeError(f"read_geometry: {geofile} structured parts are not supported")
+                else:
+                    etype = line.split()[0]
+                    ne = int(read_int(f)[0])
+                    part["elements"][etype] = ne
+                    if element_ids:
+                        skip(f, ne)
+                    if etype == "nsided":
+                        skip(f, int(read_int(f, ne).sum()))
+                    elif etype == "nfaced":
+                        nfaces = int(read_int(f, ne).sum())
+                        skip(f, int(read_int(f, nfaces).sum()))
+                    else:
+                        skip(f, ne * nodes_per_element[etype[2:] if etype.startswith('g_') else etype])
+                line = read_string(f)
+            parts.append(part)
+    return parts
+
+def read_variable(varfile: str, parts: List[dict], vtype: str, location: str) -> dict:
+    """
+    memory-map values of an EnSight Gold binary variable per part
+
+    returns dict of part id: array of shape (ncomponents, nvalues)
+    """
+    ncomp = components[vtype]
+    sizes = {part["id"]: part for part in parts}
+    values = {}
+    with open(varfile, 'rb') as f:
+        read_string(f)
+        line = read_string(f)
+        while line.startswith("part"):
+            pid = int(read_int(f)[0])
+            line = read_string(f)
+            blocks = []
+            while line and not line.startswith("part"):
+                if location == "node":
+                    n = sizes[pid]["nnodes"]
+                else:
+                    n = sizes[pid]["elements"].get(line.split()[0], 0)
+                offset = f.tell()
+                blocks.append(np.memmap(varfile, dtype='<f4', mode='r', offset=offset, shape=(ncomp, n)))
+                skip(f, ncomp * n)
+                line = read_string(f)
+            if blocks:
+                values[pid] = np.concatenate(blocks, axis=1) if len(blocks) > 1 else blocks[0]
+    return values
+
+def stats(resultdir: str, fields: List[str] = [], step: int = -1, debug: bool = False) -> List[dict]:
+    """
+    compute min/max/mean of fields per part for a result directory
+
+    resultdir: directory with Export.case (or */Export.case, eg. cfpdes.exports)
+    fields: fields to process (default: all)
+    step: time step index (default: last)
+    """
+    casefile = os.path.join(resultdir, "Export.case")
+    if not os.path.isfile(casefile):
+        cases = glob.glob(os.path.join(resultdir, "*.exports", "Export.case"))
+        if not cases:
+            raise FileNotFoundError(f"stats: no Export.case in {resultdir}")
+        casefile = cases[0]
+    dirname = os.path.dirname(casefile)
+    case = parse_case(casefile)
+
+    (geopattern, geots) = case["geometry"]
+    if geots and geots in case["timesets"]:
+        geostep = step if step >= 0 else len(case["timesets"][geots]["numbers"]) - 1
+    else:
+        geostep = 0
+    parts = read_geometry(filename(dirname, geopattern, case, geots, geostep))
+    names = {part["id"]: part["name"] for part in parts}
+
+    res = []
+    for (name, (vtype, location, pattern, ts)) in case["variables"].items():
+        # fields may be given without method prefix (eg. heat.temperature for cfpdes.heat.temperature)
+        if fields and not name in fields and not name.split('.', 1)[-1] in fields:
+            continue
+        if not vtype in components or not location in ["node", "element"]:
+            if debug:
+                print(f"stats: skip {name} ({vtype} per {location})")
+            continue
+        vstep = 0
+        time = 0.
+        if ts is not None:
+            nsteps = len(case["timesets"][ts]["numbers"])
+            vstep = step if step >= 0 else nsteps - 1
+            times = case["timesets"][ts]["times"]
+            time = times[vstep] if vstep < len(times) else 0.
+        varfile = filename(dirname, pattern, case, ts, vstep)
+        values = read_variable(varfile, parts, vtype, location)
+        for (pid, data) in values.items():
+            if data.shape[1] == 0:
+                continue
+            # magnitude for vectors and tensors
+            v = data[0] if data.shape[0] == 1 else np.sqrt((data.astype(np.float64)**2).sum(axis=0))
+            res.append({
+                "resultdir": resultdir,
+                "field": name,
+                "time": time,
+                "part": names.get(pid, str(pid)),
+                "min": float(v.min()),
+                "max": float(v.max()),
+                "mean": float(v.mean(dtype=np.float64)),
+                "count": int(v.shape[0]),
+            })
+        if debug:
+            print(f"stats: {resultdir} {name} ({vtype} per {location}, {varfile}): {len(values)} parts")
+    return res
+
+def main():
+    parser = argparse.ArgumentParser(description="Scalar field statistics per marker from EnSight Gold exports")
+    parser.add_argument("resultdirs", help="result directories (with Export.case or *.exports/Export.case)", type=str, nargs='+')
+    parser.add_argument("--fields", help="fields to process (default: all)", type=str, nargs='+', default=[])
+    parser.add_argument("--step", help="time step index (default: last)", type=int, default=-1)
+    parser.add_argument("--np", help="number of processes (default: one per result directory, up to number of cpus)", type=int, default=0)
+    parser.add_argument("--output", help="save stats to csv or json file (default: print)", type=str, default="")
+    parser.add_argument("--debug", help="activate debug", action='store_true')
+    args = parser.parse_args()
+
+    nprocs = args.np if args.np > 0 else min(len(args.resultdirs), os.cpu_count() or 1)
+    if nprocs > 1:
+        with ProcessPoolExecutor(max_workers=nprocs) as executor:
+            results = list(executor.map(stats, args.resultdirs, [args.fields]*len(args.resultdirs), [args.step]*len(args.resultdirs), [args.debug]*len(args.resultdirs)))
+    else:
+        results = [stats(resultdir, args.fields, args.step, args.debug) for resultdir in args.resultdirs]
+    rows = [row for res in results for row in res]
+
+    keys = ["resultdir", "field", "time", "part", "min", "max", "mean", "count"]
+    if args.output.endswith('.json'):
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(rows, indent=4))
+    elif args.output:
+        with open(args.output, 'w') as f:
+            f.write(",".join(keys) + "\n")
+            for row in rows:
+                f.write(",".join([str(row[key]) for key in keys]) + "\n")
+    else:
+        for row in rows:
+            print(f"{row['resultdir']} {row['field']} t={row['time']} {row['part']}: min={row['min']:g} max={row['max']:g} mean={row['mean']:g} ({row['count']} values)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
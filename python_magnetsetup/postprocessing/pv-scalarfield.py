@@ -3,6 +3,11 @@
 Console script for paraview.
 
 pvpython pv-temperature.py --cfgfile cfgfile --jsonfile jsonfile --expr heat.example --exprlegend 'T [K]'
+
+Several exprs are rendered in a single session, reading the case once
+and loading only the point arrays of the requested exprs:
+
+pvbatch pv-scalarfield.py --cfgfile cfgfile --jsonfile jsonfile --expr heat.temperature elastic.displacement --exprlegend 'T [K]' 'U [m]' --timesteps all --manifest post.json
 """
 
 import os
@@ -14,8 +19,6 @@ from argparse import RawTextHelpFormatter
 import re
 import json
 
-import argparse
-
 epilog = "The choice of exprs is actually linked with the choosen method following this table\n"
 
 # Manage Options
@@ -27,13 +30,18 @@ parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter,
 
 parser.add_argument("--cfgfile", help="input cfg file", default=None)
 parser.add_argument("--jsonfile", help="input json file", default=None)
-parser.add_argument("--expr", help="set expr to display", type=str, default="heat.temperature")
-parser.add_argument("--exprlegend", help="set expr legend to display", type=str, default="T [K]")
+parser.add_argument("--expr", help="set exprs to display", type=str, nargs='+', default=["heat.temperature"])
+parser.add_argument("--exprlegend", help="set expr legends to display (one per expr)", type=str, nargs='+', default=["T [K]"])
+parser.add_argument("--timesteps", help="set time steps to display: last, all or list of indices (default is last)", type=str, nargs='+', default=["last"])
+parser.add_argument("--manifest", help="save list of images as json (default is empty)", type=str, default="")
 parser.add_argument("--resultdir", help="set result directory (default is empty, would get resultdir from cfgfile)", type=str, default="")
 parser.add_argument("--wd", help="set a working directory (default is $PWD)", type=str, default="")
 args = parser.parse_args()
 
 print(f'args.cfgfile={args.cfgfile}')
+if len(args.exprlegend) != len(args.expr):
+    print(f'expect one legend per expr (got {len(args.exprlegend)} legends for {len(args.expr)} exprs)')
+    sys.exit(1)
 
 # Get current dir
 cwd = os.getcwd()
@@ -84,16 +92,32 @@ for field in postdata['fields']:
     pfields[field] = [ f'{method_params[0]}.{field}', f'{method_params[0]}{field.replace(".","")}']
 print(f'pfiels: {pfields}')
 
-exportcase.PointArrays = [ pfields[key][0] for key in sorted(pfields.keys()) ]
-expr0 = sorted(pfields.keys())[0]
-print(f'1st expr: {expr0} --> {pfields[expr0][1]}')
+for expr in args.expr:
+    if not expr in pfields:
+        print(f'{expr} is not a valid field')
+        print(f'valid values are:', sorted(pfields.keys()))
+        sys.exit(1)
 
-if not args.expr in pfields:
-    print(f'{args.expr} is not a valid field')
-    print(f'valid values are:',[expr for key in pfields])
-    sys.exit(1)
+# only load requested exprs
+exportcase.PointArrays = [ pfields[expr][0] for expr in args.expr ]
+expr0 = args.expr[0]
+print(f'1st expr: {expr0} --> {pfields[expr0][1]}')
 
-print(f'Display {pfields[args.expr][0]}')
+# time steps to display
+# TimestepValues is a scalar for a single time step, empty for static cases
+times = exportcase.TimestepValues
+if not times:
+    times = [0]
+elif isinstance(times, (int, float)):
+    times = [times]
+times = list(times)
+if args.timesteps == ['last']:
+    times = [(len(times)-1, times[-1])]
+elif args.timesteps == ['all']:
+    times = list(enumerate(times))
+else:
+    times = [(int(i), times[int(i)]) for i in args.timesteps]
+print(f'Display {[pfields[expr][0] for expr in args.expr]} for times {[t for (i, t) in times]}')
 
 # get active view
 renderView1 = GetActiveViewOrCreate('RenderView')
@@ -130,7 +154,7 @@ exportcaseDisplay.DataAxesGrid = 'GridAxesRepresentation'
 exportcaseDisplay.PolarAxes = 'PolarAxesRepresentation'
 exportcaseDisplay.ScalarOpacityFunction = cfpdesexprJthPWF
 exportcaseDisplay.ScalarOpacityUnitDistance = 0.017126900091946815
-exportcaseDisplay.OpacityArrayName = ['POINTS', pfields[expr][0]] #'cfpdes.expr.Jth']
+exportcaseDisplay.OpacityArrayName = ['POINTS', pfields[expr0][0]] #'cfpdes.expr.Jth']
 exportcaseDisplay.ExtractedBlockIndex = 1
 
 # init the 'PiecewiseFunction' selected for 'ScaleTransferFunction'
@@ -153,33 +177,6 @@ exportcaseDisplay.SetScalarBarVisibility(renderView1, True)
 # update the view to ensure updated data information
 renderView1.Update()
 
-# set scalar coloring
-ColorBy(exportcaseDisplay, ('POINTS', pfields[args.expr][0]))
-
-# Hide the scalar bar for this color map if no visible data is colored by it.
-HideScalarBarIfNotNeeded(cfpdesexprJthLUT, renderView1)
-
-# rescale color and/or opacity maps used to include current data range
-exportcaseDisplay.RescaleTransferFunctionToDataRange(True, False)
-
-# show color bar/color legend
-exportcaseDisplay.SetScalarBarVisibility(renderView1, True)
-
-# get color transfer function/color map for 'cfpdesheattemperature'
-print(f'cfpdesheattemperatureLUT = GetColorTransferFunction({pfields[args.expr][1]})')
-cfpdesheattemperatureLUT = GetColorTransferFunction(pfields[args.expr][1])
-
-# get opacity transfer function/opacity map for 'cfpdesheattemperature'
-cfpdesheattemperaturePWF = GetOpacityTransferFunction(pfields[args.expr][1])
-
-# get color legend/bar for cfpdesheattemperatureLUT in view renderView1
-cfpdesheattemperatureLUTColorBar = GetScalarBar(cfpdesheattemperatureLUT, renderView1)
-
-# Properties modified on cfpdesheattemperatureLUTColorBar
-cfpdesheattemperatureLUTColorBar.WindowLocation = 'UpperRightCorner'
-cfpdesheattemperatureLUTColorBar.Title = args.exprlegend # TODO custom 
-cfpdesheattemperatureLUTColorBar.TitleFontSize = 24
-
 #================================================================
 # addendum: following script captures some of the application
 # state to faithfully reproduce the visualization during playback
@@ -208,6 +205,52 @@ renderView1.CameraParallelScale = 0.17709175693856544
 # RenderAllViews()
 # alternatively, if you want to write images, you can use SaveScreenshot(...).# save screenshot
 
-# export file to proper directory??
-imagefile = f'{args.expr}.png'
-SaveScreenshot(imagefile, renderView1, ImageResolution=[888, 835])
+# render all exprs and time steps in this session
+images = []
+for (expr, exprlegend) in zip(args.expr, args.exprlegend):
+    for (i, t) in times:
+        renderView1.ViewTime = t
+        exportcase.UpdatePipeline(t)
+
+        # set scalar coloring
+        ColorBy(exportcaseDisplay, ('POINTS', pfields[expr][0]))
+
+        # Hide the scalar bars of previously rendered exprs
+        HideAllScalarBars(renderView1)
+
+        # rescale color and/or opacity maps used to include current data range
+        exportcaseDisplay.RescaleTransferFunctionToDataRange(True, False)
+
+        # show color bar/color legend
+        exportcaseDisplay.SetScalarBarVisibility(renderView1, True)
+
+        # get color transfer function/color map for 'cfpdesheattemperature'
+        print(f'cfpdesheattemperatureLUT = GetColorTransferFunction({pfields[expr][1]})')
+        cfpdesheattemperatureLUT = GetColorTransferFunction(pfields[expr][1])
+
+        # get opacity transfer function/opacity map for 'cfpdesheattemperature'
+        cfpdesheattemperaturePWF = GetOpacityTransferFunction(pfields[expr][1])
+
+        # get color legend/bar for cfpdesheattemperatureLUT in view renderView1
+        cfpdesheattemperatureLUTColorBar = GetScalarBar(cfpdesheattemperatureLUT, renderView1)
+
+        # Properties modified on cfpdesheattemperatureLUTColorBar
+        cfpdesheattemperatureLUTColorBar.WindowLocation = 'UpperRightCorner'
+        cfpdesheattemperatureLUTColorBar.Title = exprlegend # TODO custom 
+        cfpdesheattemperatureLUTColorBar.TitleFontSize = 24
+
+        # export file to proper directory??
+        imagefile = f'{expr}.png' if len(times) == 1 else f'{expr}-{i}.png'
+        SaveScreenshot(imagefile, renderView1, ImageResolution=[888, 835])
+        images.append({
+            "expr": expr,
+            "legend": exprlegend,
+            "time": t,
+            "range": list(exportcase.PointData[pfields[expr][0]].GetRange()),
+            "image": imagefile
+        })
+        print(f'{expr} (t={t}): {imagefile}')
+
+if args.manifest:
+    with open(args.manifest, 'w') as f:
+        f.write(json.dumps(images, indent=4))
@@ -0,0 +1,174 @@
+"""
+Precompiled templates
+
+Mustache templates are tokenized once (see chevron.tokenizer) and the token
+lists are stored in a pickle file, checked against the template modification
+time at runtime (see load_tokens).
+
+The compile step renders every template of the templates tree with
+representative data synthesized from its tags, checks that json templates
+yield valid json (see jsonmodel.render) and reports render time per template.
+
+ex:
+python -m python_magnetsetup.precompile
+python -m python_magnetsetup.precompile --templates mytemplates --repeat 100 --output templates.pickle
+"""
+
+from typing import List
+
+import sys
+import os
+import json
+import time
+import pickle
+import argparse
+
+default_cache = os.path.join(os.path.expanduser("~"), ".cache", "python_magnetsetup", "templates.pickle")
+
+# templates not producing json (cfg files, job scripts)
+non_json = ["cfg.mustache", "jobmanager"]
+
+# token lists by template path: (mtime, tokens)
+_tokens = {}
+_loaded = None
+
+def tokenize(template: str) -> list:
+    """
+    tokenize template file
+    """
+    from chevron.tokenizer import tokenize as chevron_tokenize
+
+    with open(template, 'r') as f:
+        return list(chevron_tokenize(f.read()))
+
+def load_cache(cachefile: str = default_cache) -> dict:
+    """
+    load precompiled templates
+    """
+    if os.path.isfile(cachefile):
+        try:
+            with open(cachefile, 'rb') as f:
+                return pickle.load(f)
+        except (pickle.UnpicklingError, EOFError) as e:
+            print(f"load_cache: ignore {cachefile} ({e})")
+    return {}
+
+def load_tokens(template: str, cachefile: str = default_cache) -> list:
+    """
+    get token list of template,
+    from precompiled templates if up to date, otherwise tokenize template
+    """
+    global _loaded
+    if _loaded != cachefile:
+        _tokens.update(load_cache(cachefile))
+        _loaded = cachefile
+
+    path = os.path.abspath(template)
+    mtime = os.path.getmtime(path)
+    if not path in _tokens or _tokens[path][0] != mtime:
+        _tokens[path] = (mtime, tokenize(path))
+    return _tokens[path][1]
+
+def synthesize(tokens: list, nitems: int = 2) -> dict:
+    """
+    create representative data for tokens
+
+    variables are set to "1" (valid json either quoted or not),
+    sections are lists of nitems items to check separators,
+    inverted sections are left empty
+    """
+    data = {}
+    stack = [(None, data)]
+    for (tag, key) in tokens:
+        scope = stack[-1][1]
+        if tag in ['variable', 'no escape'] and key != '.':
+            names = key.split('.')
+            for name in names[:-1]:
+                scope = scope.setdefault(name, {})
+            scope.setdefault(names[-1], "1")
+        elif tag == 'section':
+            stack.append((key, {}))
+        elif tag == 'end' and len(stack) > 1:
+            (name, item) = stack.pop()
+            if name == key:
+                stack[-1][1][name] = [dict(item) for i in range(nitems)] if item else [{}] * nitems
+    return data
+
+def templates_list(templates: str) -> List[str]:
+    """
+    get all mustache templates in templates tree
+    """
+    res = []
+    for (root, dirs, files) in os.walk(templates):
+        for f in files:
+            if f.endswith('.mustache'):
+                res.append(os.path.join(root, f))
+    return sorted(res)
+
+def compile_templates(templates: str, cachefile: str = default_cache, repeat: int = 10, debug: bool = False) -> List[dict]:
+    """
+    tokenize, render and check all templates in templates tree, store token lists in cachefile
+
+    returns a report per template (tokenize and render times in ms, error if any)
+    """
+    import chevron
+    from .jsonmodel import render
+
+    cache = {}
+    report = []
+    for template in templates_list(templates):
+        path = os.path.abspath(template)
+        res = {"template": os.path.relpath(path, templates), "error": ""}
+
+        start = time.perf_counter()
+        tokens = tokenize(path)
+        res["tokenize"] = (time.perf_counter() - start) * 1.e+3
+        cache[path] = (os.path.getmtime(path), tokens)
+        _tokens[path] = cache[path]
+
+        data = synthesize(tokens)
+        is_json = not any(name in res["template"] for name in non_json)
+        start = time.perf_counter()
+        for i in range(repeat):
+            if is_json:
+                output = render(path, data)
+            else:
+                output = chevron.render(tokens, data)
+        res["render"] = (time.perf_counter() - start) * 1.e+3 / repeat
+
+        if is_json:
+            try:
+                json.loads(output)
+            except json.decoder.JSONDecodeError as e:
+                res["error"] = f"line {e.lineno} col {e.colno}: {e.msg}"
+                if debug:
+                    print(f"compile_templates: {template} data={data}\n{output}")
+        report.append(res)
+
+    dirname = os.path.dirname(cachefile)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    with open(cachefile, 'wb') as f:
+        pickle.dump(cache, f)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompile and check mustache templates")
+    parser.add_argument("--templates", help="templates directory (default: templates of python_magnetsetup)", type=str,
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates"))
+    parser.add_argument("--output", help="precompiled templates", type=str, default=default_cache)
+    parser.add_argument("--repeat", help="number of renders per template for timing", type=int, default=10)
+    parser.add_argument("--debug", help="activate debug", action='store_true')
+    args = parser.parse_args()
+
+    report = compile_templates(args.templates, args.output, args.repeat, args.debug)
+    for res in report:
+        status = f"ERROR {res['error']}" if res["error"] else "ok"
+        print(f"{res['template']}: tokenize={res['tokenize']:.3f} ms render={res['render']:.3f} ms {status}")
+
+    errors = [res for res in report if res["error"]]
+    print(f"{len(report)} templates, {len(errors)} errors, total render={sum(res['render'] for res in report):.1f} ms (saved in {args.output})")
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+"""
+Remote execution of simulation commands
+
+An executor runs commands in the home directory of a machine:
+- FabricExecutor: remote machine through ssh (fabric)
+- LocalExecutor: local directory standing for a remote home (eg for tests)
+
+For each case, the simulation archive is streamed to the executor and
+unpacked on the fly (or only missing artifacts are sent, see put_artifacts),
+commands created by setup_cmds are run, independent stages concurrently,
+and results (csv, png, result archive) are pulled back as they appear.
+Several cases (eg on several machines) can be run concurrently (see run_cases).
+"""
+
+from typing import List, Tuple
+
+import os
+import io
+import time
+import shutil
+import tarfile
+import threading
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .artifacts import load_manifest
+from .meshinfo import msh_header
+
+# stages that depends only on the previous group of stages
+# stages of the same group are run concurrently
+stage_groups = [
+    ["Unpack"],
+    ["CAD"],
+    ["Mesh"],
+    ["Convert"],
+    ["Partition"],
+    # both edit cfgfile in place
+    ["Update_Mesh"],
+    ["Update_Partition"],
+    ["Run"],
+    ["Postprocessing", "Stats", "Save"],
+]
+
+# results to pull back
+result_patterns = ["*.csv", "*.png", "*-post.json", "*_res.zip"]
+
+blocksize = 1 << 20
+
+class LocalExecutor():
+    """
+    run commands in a local directory standing for a remote home
+    """
+
+    def __init__(self, rootdir: str):
+        self.name = "localhost"
+        self.rootdir = os.path.abspath(rootdir)
+        os.makedirs(self.rootdir, exist_ok=True)
+
+    def homedir(self) -> str:
+        return self.rootdir
+
+    def run(self, cmd: str, hide: bool = True) -> tuple:
+        """
+        run cmd, returns exit status and stdout
+        """
+        result = subprocess.run(cmd, shell=True, cwd=self.rootdir, executable='/bin/bash', capture_output=True, text=True)
+        if not hide:
+            print(result.stdout, end='')
+        return (result.returncode, result.stdout)
+
+    def put_stream(self, stream, cmd: str) -> int:
+        """
+        run cmd with stream as stdin
+        """
+        proc = subprocess.Popen(cmd, shell=True, cwd=self.rootdir, executable='/bin/bash', stdin=subprocess.PIPE)
+        shutil.copyfileobj(stream, proc.stdin, blocksize)
+        proc.stdin.close()
+        return proc.wait()
+
+    def get(self, remote: str, local: str):
+        shutil.copyfile(os.path.join(self.rootdir, remote), local)
+
+    def open(self, remote: str):
+        """
+        open remote file as a seekable binary file object
+        """
+        return open(os.path.join(self.rootdir, remote), 'rb')
+
+    def close(self):
+        pass
+
+class FabricExecutor():
+    """
+    run commands on a remote machine through ssh
+    """
+
+    def __init__(self, machine: str):
+        from fabric import Connection
+
+        self.name = machine
+        self.connection = Connection(machine)
+        self._homedir = None
+
+    def homedir(self) -> str:
+        if self._homedir is None:
+            self._homedir = self.connection.run('pwd', hide=True).stdout.strip()
+        return self._homedir
+
+    def run(self, cmd: str, hide: bool = True) -> tuple:
+        """
+        run cmd, returns exit status and stdout
+        """
+        result = self.connection.run(cmd, warn=True, hide=hide)
+        return (result.exited, result.stdout)
+
+    def put_stream(self, stream, cmd: str) -> int:
+        """
+        run cmd with stream as stdin (eg. tar zxf -)
+        """
+        self.connection.open()
+        channel = self.connection.client.get_transport().open_session()
+        channel.exec_command(cmd)
+        for block in iter(lambda: stream.read(blocksize), b''):
+            channel.sendall(block)
+        channel.shutdown_write()
+        status = channel.recv_exit_status()
+        channel.close()
+        return status
+
+    def get(self, remote: str, local: str):
+        self.connection.get(remote=remote, local=local)
+
+    def open(self, remote: str):
+        """
+        open remote file as a seekable binary file object (sftp),
+        only the parts actually read are transferred
+        """
+        return self.connection.sftp().open(remote, 'rb')
+
+    def close(self):
+        self.connection.close()
+
+def stream_archive(executor, tarfilename: str, workingdir: str) -> int:
+    """
+    stream tarfilename to executor and unpack it in workingdir
+    """
+    with open(tarfilename, 'rb') as stream:
+        return executor.put_stream(stream, f"mkdir -p {workingdir} && cd {workingdir} && tar zxf -")
+
+def put_artifacts(executor, manifestfile: str, workingdir: str, store: str = ".cache/python_magnetsetup/artifacts", skip: List[str] = [], tarfilename: str = "", debug: bool = False) -> int:
+    """
+    send only artifacts missing in store (content-addressed by their hash),
+    then link them into workingdir
+
+    skip: kinds of artifacts not to send (eg. cad for Axi)
+    tarfilename: simulation archive, artifacts removed after setup (eg. local material files)
+    are read from it
+    """
+    artifacts = [artifact for artifact in load_manifest(manifestfile) if not artifact.kind in skip]
+    hashes = sorted(set(artifact.hash for artifact in artifacts))
+
+    (status, stdout) = executor.run(f"mkdir -p {store} && cd {store} && for h in {' '.join(hashes)}; do [ -f $h ] || echo $h; done")
+    if status != 0:
+        return status
+    missing = set(stdout.split())
+    print(f"put_artifacts: {len(missing)}/{len(hashes)} artifacts to send to {executor.name}")
+
+    if missing:
+        buffer = io.BytesIO()
+        src = tarfile.open(tarfilename, "r:gz") if tarfilename else None
+        try:
+            with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+                for artifact in artifacts:
+                    if artifact.hash in missing:
+                        if os.path.isfile(artifact.path) or src is None:
+                            tar.add(artifact.path, arcname=artifact.hash)
+                        else:
+                            member = src.getmember(artifact.path.lstrip('/'))
+                            info = tarfile.TarInfo(artifact.hash)
+                            info.size = member.size
+                            info.mtime = member.mtime
+                            tar.addfile(info, src.extractfile(member))
+                        missing.discard(artifact.hash)
+        finally:
+            if src is not None:
+                src.close()
+        buffer.seek(0)
+        status = executor.put_stream(buffer, f"cd {store} && tar zxf -")
+        if status != 0:
+            return status
+
+    # same layout as in the simulation archive
+    links = []
+    for artifact in artifacts:
+        dst = artifact.path.lstrip('/')
+        links.append(f"mkdir -p $(dirname {workingdir}/{dst}) && cp {store}/{artifact.hash} {workingdir}/{dst}")
+    (status, stdout) = executor.run(" && ".join([f"mkdir -p {workingdir}"] + links))
+    if debug:
+        print(f"put_artifacts: {len(links)} artifacts in {workingdir} (status={status})")
+    return status
+
+class Puller(threading.Thread):
+    """
+    pull results back from executor as they appear
+    """
+
+    def __init__(self, executor, workingdir: str, localdir: str, interval: float = 10, patterns: List[str] = result_patterns):
+        super().__init__(daemon=True)
+        self.executor = executor
+        self.workingdir = workingdir
+        self.localdir = localdir
+        self.interval = interval
+        self.patterns = patterns
+        self.sizes = {}
+        self.stopped = threading.Event()
+
+    def pull(self):
+        """
+        get new or modified results
+        """
+        names = " -o ".join([f"-name '{pattern}'" for pattern in self.patterns])
+        (status, stdout) = self.executor.run(f"cd {self.workingdir} && find . -maxdepth 1 -type f \\( {names} \\) -printf '%s %P\\n'")
+        if status != 0:
+            return
+        for line in stdout.splitlines():
+            (size, name) = line.split(' ', 1)
+            if self.sizes.get(name) != size:
+                os.makedirs(self.localdir, exist_ok=True)
+                self.executor.get(f"{self.executor.homedir()}/{self.workingdir}/{name}", os.path.join(self.localdir, name))
+                self.sizes[name] = size
+                print(f"{self.executor.name}: got {name}")
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.pull()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        # results created since last pull
+        self.pull()
+
+def run_stages(executor, workingdir: str, cmds: dict, skip: List[str] = ['Pre', 'Python', 'Workflow', 'Unpack'], debug: bool = False) -> dict:
+    """
+    run cmds in workingdir, stages of the same group concurrently
+
+    returns dict of stage: (duration, status), stops at first failing group
+    """
+    def task(stage: str) -> tuple:
+        start = time.perf_counter()
+        cmd = f"cd {workingdir} && {cmds['Pre']} && {cmds[stage]}"
+        if debug:
+            print(f"{executor.name}: {cmd}")
+        (status, stdout) = executor.run(cmd, hide=not debug)
+        return (time.perf_counter() - start, status)
+
+    groups = [[stage for stage in group if stage in cmds and not stage in skip] for group in stage_groups]
+    # stages unknown to stage_groups are run last
+    known = [stage for group in stage_groups for stage in group]
+    groups.append([stage for stage in cmds if not stage in known and not stage in skip])
+
+    stages = {}
+    for group in groups:
+        if not group:
+            continue
+        with ThreadPoolExecutor(max_workers=len(group)) as pool:
+            results = list(pool.map(task, group))
+        for (stage, res) in zip(group, results):
+            stages[stage] = res
+            print(f"{executor.name}: {stage} done in {res[0]:.1f} s (status={res[1]})")
+        if any(res[1] != 0 for res in results):
+            break
+    return stages
+
+def mesh_size(executor, meshfile: str, debug: bool = False) -> Tuple[int, int]:
+    """
+    get number of nodes and elements of gmsh meshfile on executor
+    (only the header is read, see meshinfo.msh_header)
+
+    returns (-1, -1) if mesh is not available
+    """
+    try:
+        with executor.open(meshfile) as f:
+            return msh_header(f, debug)
+    except (OSError, ValueError) as e:
+        print(f"{executor.name}: cannot get size of {meshfile} ({e})")
+        return (-1, -1)
+
+def run_case(executor, workingdir: str, tarfilename: str, cmds: dict, localdir: str = "", manifestfile: str = "", skip_artifacts: List[str] = [], meshfile: str = "", interval: float = 10, debug: bool = False) -> tuple:
+    """
+    run a case on executor
+
+    manifestfile: if given, only missing artifacts are sent (see put_artifacts),
+    otherwise the archive is streamed
+    meshfile: gmsh mesh used by the partitioner, relative to workingdir,
+    its size is read on executor once stages are done (see mesh_size)
+
+    returns (status, stages, nelems), nelems is -1 if unknown
+    """
+    (status, stdout) = executor.run(f'[ -d {workingdir} ] && echo 0 || echo 1')
+    if stdout.strip() == '0':
+        raise Exception(f'remote: {workingdir} already exists on {executor.name}')
+
+    if manifestfile:
+        status = put_artifacts(executor, manifestfile, workingdir, skip=skip_artifacts, tarfilename=tarfilename, debug=debug)
+    else:
+        status = stream_archive(executor, tarfilename, workingdir)
+    if status != 0:
+        raise Exception(f'remote: failed to send {tarfilename} to {executor.name}')
+
+    puller = Puller(executor, workingdir, localdir or workingdir, interval)
+    puller.start()
+    try:
+        stages = run_stages(executor, workingdir, cmds, debug=debug)
+    finally:
+        puller.stop()
+
+    nelems = -1
+    if meshfile and any(stage in stages for stage in ["Mesh", "Partition"]):
+        nelems = mesh_size(executor, f"{workingdir}/{meshfile}", debug)[1]
+
+    status = max([res[1] for res in stages.values()], default=0)
+    return (status, stages, nelems)
+
+def run_cases(jobs: List[dict], debug: bool = False) -> List[tuple]:
+    """
+    run cases concurrently
+
+    jobs: list of dict with run_case arguments (executor, workingdir, tarfilename, cmds, ...)
+    returns list of (status, stages, nelems) in the order of jobs
+    """
+    with ThreadPoolExecutor(max_workers=max(1, len(jobs))) as pool:
+        futures = [pool.submit(run_case, debug=debug, **job) for job in jobs]
+        return [future.result() for future in futures]
@@ -0,0 +1,294 @@
+"""
+Columnar store for simulation measures
+
+Measures (eg. cfpdes.heat.measures/values.csv) are collected from result
+directories (feelppdb/{method}-{model}-{geom}-{time}-{linear}/{magnet}/np_{NP})
+or result archives (*_res.zip, see archive) into a Parquet dataset partitioned by
+magnet, model and current, along with an index of runs (runs.parquet).
+
+Measures are stored in long format (run, step, measure, value) so that
+runs with different measures share the same schema.
+
+ex:
+python -m python_magnetsetup.results ingest ~/feelppdb HL-test-cfpdes-thelec-Axi-sim_res.zip --store results
+python -m python_magnetsetup.results query --store results --magnet HL-test --measure "Power_\\w+"
+"""
+
+from typing import List, Optional
+
+import sys
+import os
+import re
+import hashlib
+import argparse
+import tarfile
+import zipfile
+import datetime
+
+import pandas as pd
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .archive import open_archive
+
+# measures files in result directories
+measures_pattern = re.compile(r'(^|/)[\w.]*measures/values\.csv$')
+
+# run definition from feelppdb path
+path_pattern = re.compile(r'(?P<method>[\w]+)-(?P<model>[\w]+)-(?P<geom>Axi|3D)-(?P<time>static|transient)-(?P<linear>linear|nonlinear)/(?P<magnet>[^/]+)/np_(?P<np>\d+)')
+
+# run definition from result archive name (see setup_cmds Save)
+archive_pattern = re.compile(r'(?P<magnet>[^/]+)-(?P<method>cfpdes|CG|HDG|CRB)-(?P<model>[\w]+?)(?P<linear>-nonlinear)?-(?P<geom>Axi|3D)-sim_res\.(zip|tgz)/np_(?P<np>\d+)/')
+
+# current from workflow results (eg. -I31000.0A)
+current_pattern = re.compile(r'-I(?P<current>[-+.\deE]+)A')
+
+partition_cols = ["magnet", "model", "current"]
+
+def partitioning():
+    """
+    get hive partitioning of measures, partition values are read as strings
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return ds.partitioning(pa.schema([(col, pa.string()) for col in partition_cols]), flavor="hive")
+
+def format_current(value) -> str:
+    """
+    get current as stored in partitions (eg. 31000 for 31000.0 or "31000")
+    """
+    try:
+        current = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+    return str(int(current)) if current.is_integer() else str(current)
+
+def run_id(source: str, member: str = "") -> str:
+    """
+    get id of a run from its source (directory or archive) and member
+    """
+    return hashlib.sha1(f"{os.path.abspath(source)}:{member}".encode()).hexdigest()[:16]
+
+def run_info(path: str, df: pd.DataFrame) -> dict:
+    """
+    get run definition from path of measures and measures
+
+    current is taken from path if available,
+    otherwise from the first Intensity measure of the last step
+    """
+    info = {"method": "", "model": "", "geom": "", "time": "", "linear": "", "magnet": "", "np": 0, "current": ""}
+    match = path_pattern.search(path)
+    if not match:
+        match = archive_pattern.search(path)
+    if match:
+        info.update({key: value for (key, value) in match.groupdict().items() if value is not None})
+        info["linear"] = info["linear"].lstrip('-')
+        info["np"] = int(info["np"])
+
+    match = current_pattern.search(path)
+    if match:
+        info["current"] = format_current(match.group("current"))
+    else:
+        intensities = [key for key in df.columns if key.startswith("Intensity_")]
+        if intensities and len(df):
+            info["current"] = format_current(round(abs(float(df[intensities[0]].iloc[-1]))))
+    return info
+
+def find_measures(path: str) -> List[tuple]:
+    """
+    find measures files in a result directory or archive
+
+    returns a list of (source, member)
+    member is a path relative to source for directories
+    """
+    res = []
+    if os.path.isdir(path):
+        for (root, dirs, files) in os.walk(path):
+            if "values.csv" in files:
+                member = os.path.relpath(os.path.join(root, "values.csv"), path)
+                if measures_pattern.search(member):
+                    res.append((path, member))
+    elif zipfile.is_zipfile(path) or tarfile.is_tarfile(path):
+        with open_archive(path) as archive:
+            res = [(path, name) for name in archive.names() if measures_pattern.search(name)]
+    return res
+
+def read_measures(source: str, member: str) -> pd.DataFrame:
+    """
+    read a measures file from a directory or an archive
+    """
+    if os.path.isdir(source):
+        return pd.read_csv(os.path.join(source, member), sep=",")
+    with open_archive(source) as archive:
+        with archive.open(member) as f:
+            return pd.read_csv(f, sep=",")
+
+def load_index(store: str) -> pd.DataFrame:
+    """
+    load index of runs
+    """
+    index = os.path.join(store, "runs.parquet")
+    if os.path.isfile(index):
+        return pd.read_parquet(index)
+    return pd.DataFrame()
+
+def partition_values(info: dict) -> tuple:
+    """
+    get partition values of a run (see ingest)
+    """
+    return tuple(info[col] if info[col] != "" else "unknown" for col in partition_cols)
+
+def drop_runs(store: str, index: pd.DataFrame, runs: List[str], debug: bool = False) -> int:
+    """
+    remove measures of runs from store
+
+    only files of the partitions of runs (see index) are read,
+    files containing measures of runs are rewritten without them
+
+    returns number of rows removed
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    path = os.path.join(store, "measures")
+    selected = index[index["run"].isin(runs)] if not index.empty else index
+    if selected.empty or not os.path.isdir(path):
+        return 0
+
+    partitions = set(partition_values(info) for info in selected.to_dict("records"))
+    expr = None
+    for values in partitions:
+        match = None
+        for (col, value) in zip(partition_cols, values):
+            match = ds.field(col) == value if match is None else match & (ds.field(col) == value)
+        expr = match if expr is None else expr | match
+
+    removed = 0
+    dataset = ds.dataset(path, format="parquet", partitioning=partitioning())
+    for fragment in dataset.get_fragments(filter=expr):
+        table = pq.read_table(fragment.path)
+        mask = pc.is_in(table["run"], value_set=pa.array(runs, type=pa.string()))
+        n = pc.sum(mask).as_py() or 0
+        if not n:
+            continue
+        removed += n
+        if n == len(table):
+            os.unlink(fragment.path)
+        else:
+            pq.write_table(table.filter(pc.invert(mask)), fragment.path)
+        if debug:
+            print(f"drop_runs: {n} rows removed from {fragment.path}")
+    return removed
+
+def ingest(paths: List[str], store: str, nworkers: int = 8, force: bool = False, debug: bool = False) -> pd.DataFrame:
+    """
+    collect measures from result directories or archives into store
+
+    runs already in store are skipped unless force is set
+    returns the index of ingested runs
+    """
+    found = [item for path in paths for item in find_measures(path)]
+    index = load_index(store)
+    known = set(index["run"]) if not index.empty and not force else set()
+    todo = [(source, member) for (source, member) in found if not run_id(source, member) in known]
+    print(f"ingest: {len(todo)} new measures files ({len(found)} found)")
+    if not todo:
+        return pd.DataFrame()
+
+    def task(item: tuple) -> tuple:
+        (source, member) = item
+        df = read_measures(source, member)
+        path = os.path.join(os.path.abspath(source), member)
+        info = run_info(path, df)
+        info.update({"run": run_id(source, member), "source": os.path.abspath(source), "member": member,
+                     "nsteps": len(df), "date": datetime.datetime.now().isoformat()})
+
+        data = df.reset_index(drop=True).rename_axis("step").reset_index()
+        data = data.melt(id_vars="step", var_name="measure", value_name="value")
+        data["value"] = pd.to_numeric(data["value"], errors="coerce")
+        data["run"] = info["run"]
+        for (col, value) in zip(partition_cols, partition_values(info)):
+            data[col] = value
+        if debug:
+            print(f"ingest: {path} -> {info['magnet']}/{info['model']}/{info['current']} ({len(df)} steps, {len(df.columns)} measures)")
+        return (info, data)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(nworkers, len(todo)))) as executor:
+        results = list(executor.map(task, todo))
+
+    runs = pd.DataFrame([info for (info, data) in results])
+    data = pd.concat([data for (info, data) in results], ignore_index=True)
+    os.makedirs(store, exist_ok=True)
+    if force:
+        # measures of runs ingested again replace the previous ones
+        removed = drop_runs(store, index, runs["run"].tolist(), debug)
+        if removed:
+            print(f"ingest: {removed} previous measures removed")
+    data.to_parquet(os.path.join(store, "measures"), partition_cols=partition_cols, index=False)
+
+    if not index.empty:
+        runs = pd.concat([index[~index["run"].isin(runs["run"])], runs], ignore_index=True)
+    runs.to_parquet(os.path.join(store, "runs.parquet"), index=False)
+    return runs
+
+def query(store: str, magnet: Optional[str] = None, model: Optional[str] = None, current: Optional[str] = None, measure: Optional[str] = None, last: bool = True) -> pd.DataFrame:
+    """
+    load measures from store as a table with one row per run (and step)
+
+    magnet, model, current: select partitions
+    measure: regex on measure names
+    last: keep only the last step of each run
+    """
+    if current is not None:
+        current = format_current(current)
+    filters = [(col, "==", value) for (col, value) in zip(partition_cols, [magnet, model, current]) if value is not None]
+    data = pd.read_parquet(os.path.join(store, "measures"), filters=filters if filters else None, partitioning=partitioning())
+    if measure:
+        data = data[data["measure"].str.fullmatch(measure)]
+    if last and not data.empty:
+        data = data[data["step"] == data.groupby("run")["step"].transform("max")]
+    table = data.pivot_table(index=["run", "step"] + partition_cols, columns="measure", values="value", observed=True).reset_index()
+    table.columns.name = None
+    return table
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect simulation measures in a columnar store")
+    parser.add_argument("--store", help="store directory", type=str, default="results")
+    parser.add_argument("--debug", help="activate debug", action='store_true')
+    subparsers = parser.add_subparsers(title="commands", dest="command", help='sub-command help')
+
+    parser_ingest = subparsers.add_parser('ingest', help='collect measures from result directories or archives')
+    parser_ingest.add_argument("paths", help="result directories or archives", type=str, nargs='+')
+    parser_ingest.add_argument("--nworkers", help="number of concurrent readers", type=int, default=8)
+    parser_ingest.add_argument("--force", help="ingest runs already in store", action='store_true')
+
+    subparsers.add_parser('list', help='list runs')
+
+    parser_query = subparsers.add_parser('query', help='query measures')
+    parser_query.add_argument("--magnet", type=str, default=None)
+    parser_query.add_argument("--model", type=str, default=None)
+    parser_query.add_argument("--current", type=str, default=None)
+    parser_query.add_argument("--measure", help="regex on measure names", type=str, default=None)
+    parser_query.add_argument("--all_steps", help="keep all steps (default is last step)", action='store_true')
+    parser_query.add_argument("--output", help="save to csv", type=str, default="")
+    args = parser.parse_args()
+
+    if args.command == 'ingest':
+        runs = ingest(args.paths, args.store, args.nworkers, args.force, args.debug)
+        print(f"ingest: {len(runs)} runs in {args.store}")
+    elif args.command == 'list':
+        print(load_index(args.store).to_string())
+    elif args.command == 'query':
+        table = query(args.store, args.magnet, args.model, args.current, args.measure, not args.all_steps)
+        if args.output:
+            table.to_csv(args.output, index=False)
+        else:
+            print(table.to_string())
+    else:
+        parser.print_help()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -24,7 +24,7 @@ mustache templates
 # TODO check for unit consistency
 # depending on Length base unit
 
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 import sys
 import os
@@ -42,16 +42,22 @@ from .utils import Merge, NMerge
 from .cfg import create_cfg
 from .jsonmodel import create_json
 
-from .insert import Insert_setup, Insert_simfile
+from .insert import Insert_setup, Insert_artifacts
 from .bitter import Bitter_setup, Bitter_simfile
-from .supra import Supra_setup, Supra_simfile
+from .supra import Supra_setup, Supra_artifacts
+from .artifacts import Artifact, cad_artifacts, resolve, save_manifest, load_manifest
+from .meshcache import mesh_key, cached_cmds, default_cachedir
+from .archive import archive_name, save_cmd
+from .batch import sweep_workflow
     
 from .file_utils import MyOpen, findfile, search_paths
+from .meshinfo import mesh_header, select_np, select_partition
 
-def magnet_simfile(MyEnv, confdata: str, addAir: bool = False):
+def magnet_artifacts(MyEnv, confdata: str, addAir: bool = False, debug: bool = False) -> List[Artifact]:
     """
+    Creating list of artifacts for magnet (not resolved)
     """
-    files = []
+    artifacts = []
     yamlfile = confdata["geom"]
 
     if "Helix" in confdata:
@@ -60,40 +66,40 @@ def magnet_simfile(MyEnv, confdata: str, addAir: bool = False):
         cad = None
         with MyOpen(yamlfile, 'r', paths=search_paths(MyEnv, "geom")) as cfgdata:
             cad = yaml.load(cfgdata, Loader = yaml.FullLoader)
-            files.append(cfgdata.name)
-        tmp_files = Insert_simfile(MyEnv, confdata, cad, addAir)
-        for tmp_f in tmp_files:
-            files.append(tmp_f)
+        artifacts.append(Artifact("geom", yamlfile))
+        artifacts += Insert_artifacts(MyEnv, confdata, cad, addAir, debug)
 
     for mtype in ["Bitter", "Supra"]:
         if mtype in confdata:
             print("load a %s insert" % mtype)
-            try:
-                with MyOpen(yamlfile, 'r', paths=search_paths(MyEnv, "geom")) as cfgdata:
-                    cad = yaml.load(cfgdata, Loader = yaml.FullLoader)
-                    files.append(cfgdata.name)
-            except:
-                pass
+            # magnet geometry may not exist (see setup)
+            artifacts.append(Artifact("geom", yamlfile, group=yamlfile))
+
+            # objects geometries are needed to get their artifacts
+            objs = resolve(MyEnv, [Artifact("geom", obj["geom"]) for obj in confdata[mtype]], hash=False, debug=debug)
+            paths = {obj.name: obj.path for obj in objs}
 
             # loop on mtype
             for obj in confdata[mtype]:
                 print("obj:", obj)
                 cad = None
-                yamlfile = obj["geom"]
-                with MyOpen(yamlfile, 'r', paths=search_paths(MyEnv, "geom")) as cfgdata:
+                with open(paths[obj["geom"]], 'r') as cfgdata:
                     cad = yaml.load(cfgdata, Loader = yaml.FullLoader)
     
                 if isinstance(cad, Bitter.Bitter):
-                    files.append(cfgdata.name)
+                    artifacts.append(Artifact("geom", obj["geom"]))
                 elif isinstance(cad, Supra.Supra):
-                    files.append(cfgdata.name)
-                    struct = Supra_simfile(MyEnv, obj, cad)
-                    if struct:
-                        files.append(struct)
+                    artifacts += Supra_artifacts(MyEnv, obj, cad)
                 else:
                     raise Exception(f"setup: unexpected cad type {type(cad)}")
 
-    return files
+    return artifacts
+
+def magnet_simfile(MyEnv, confdata: str, addAir: bool = False, debug: bool = False) -> List[Artifact]:
+    """
+    Creating list of simulation files for magnet
+    """
+    return resolve(MyEnv, magnet_artifacts(MyEnv, confdata, addAir, debug), debug=debug)
 
 def magnet_setup(MyEnv, confdata: str, method_data: List, templates: dict, debug: bool=False):
     """
@@ -157,40 +163,33 @@ def magnet_setup(MyEnv, confdata: str, method_data: List, templates: dict, debug
         print("magnet_setup: mdict=", mdict)
     return (mdict, mmat, mpost)
 
-def msite_simfile(MyEnv, confdata: str, session=None, addAir: bool = False):
+def msite_simfile(MyEnv, confdata: str, session=None, addAir: bool = False, debug: bool = False) -> List[Artifact]:
     """
     Creating list of simulation files for msite
     """
 
-    files = []
-
-    # TODO: get xao and brep if they exist, otherwise go on
     # TODO: add suffix _Air if needed ??
-    try:
-        xaofile = confdata["name"] + ".xao"
-        if addAir:
-            xaofile = confdata["name"] + "_withAir.xao"
-        f =findfile(xaofile, paths=search_paths(MyEnv, "cad"))
-        files.append(f)
-
-        brepfile = confdata["name"] + ".brep"
-        if addAir:
-            brepfile = confdata["name"] + "_withAir.brep"
-        f = findfile(brepfile, paths=search_paths(MyEnv, "cad"))
-        files.append(f)
-    except:
-        for magnet in confdata["magnets"]:
+    name = confdata["name"]
+    if addAir:
+        name = confdata["name"] + "_withAir"
+    files = resolve(MyEnv, cad_artifacts(name), debug=debug)
+    if files:
+        return files
+
+    # resolve artifacts of all magnets at once
+    artifacts = []
+    for magnet in confdata["magnets"]:
+        try:
+            mconfdata = load_object(MyEnv, magnet + "-data.json")
+        except:
             try:
-                mconfdata = load_object(MyEnv, magnet + "-data.json")
+                mconfdata = load_object_from_db(MyEnv, "magnet", magnet, False, session)
             except:
-                try:
-                    mconfdata = load_object_from_db(MyEnv, "magnet", magnet, False, session)
-                except:
-                    raise Exception(f"msite_simfile: failed to load {magnet} from magnetdb")
+                raise Exception(f"msite_simfile: failed to load {magnet} from magnetdb")
 
-            files += magnet_simfile(MyEnv, mconfdata)
+        artifacts += magnet_artifacts(MyEnv, mconfdata, debug=debug)
     
-    return files
+    return resolve(MyEnv, artifacts, debug=debug)
 
 def msite_setup(MyEnv, confdata: str, method_data: List, templates: dict, debug: bool=False, session=None):
     """
@@ -359,7 +358,7 @@ def setup(MyEnv, args, confdata, jsonfile, session=None):
         material_generic_def.append("conduct-nosource") # only for transient with mqs
 
     # create list of files to be archived
-    sim_files = [cfgfile, jsonfile]
+    local_files = [cfgfile, jsonfile]
     if args.method == "cfpdes":
         if args.debug: print("cwd=", cwd)
         from shutil import copyfile
@@ -370,21 +369,20 @@ def setup(MyEnv, args, confdata, jsonfile, session=None):
             if args.debug:
                 print(jfile, "filename=", filename, "src=%s" % src, "dst=%s" % dst)
             copyfile(src, dst)
-            sim_files.append(dst)
+            local_files.append(dst)
 
     # list files to be archived
     
     try:
-        mesh = findfile(meshfile, search_paths(MyEnv, "mesh"))
-        sim_files.append(mesh)
-    except:
+        sim_files = resolve(MyEnv, [Artifact("mesh", meshfile)], debug=args.debug)
+    except FileNotFoundError:
         if "geom" in confdata:
             print("geo:", name)
             yamlfile = confdata["geom"]
-            sim_files += magnet_simfile(MyEnv, confdata, addAir)
+            sim_files = magnet_simfile(MyEnv, confdata, addAir, args.debug)
         else:
             yamlfile = confdata["name"] + ".yaml"
-            sim_files += msite_simfile(MyEnv, confdata, session, addAir)
+            sim_files = msite_simfile(MyEnv, confdata, session, addAir, args.debug)
 
     # TODO create a flow_params from records data
     sdir = os.path.dirname(os.path.abspath(__file__))
@@ -392,38 +390,100 @@ def setup(MyEnv, args, confdata, jsonfile, session=None):
     src = os.path.join(sdir, 'flow_params.json')
     dst = 'flow_params.json'
     copyfile(src, dst)
+    local_files.append(dst)
+
+    # manifest of archived files
+    sim_files = resolve(MyEnv, [Artifact("local", filename) for filename in local_files], debug=args.debug) + sim_files
+    manifestfile = cfgfile.replace('.cfg', '-manifest.json')
+    save_manifest(manifestfile, sim_files)
 
     if args.debug:
-        print("List of simulations files:", sim_files)
+        print("List of simulations files:", [artifact.path for artifact in sim_files])
     import tarfile
     tarfilename = cfgfile.replace('cfg','tgz')
     if os.path.isfile(os.path.join(cwd, tarfilename)):
         raise FileExistsError(f"{tarfilename} already exists")
     else:
         tar = tarfile.open(tarfilename, "w:gz")
-        for filename in sim_files:
+        for artifact in sim_files:
+            filename = artifact.path
             # TODO skip xao and brep if Axi args.geom?
-            if args.geom == 'Axi' and ( filename.endswith('.xao') or filename.endswith('.brep') ) :
+            if args.geom == 'Axi' and artifact.kind == 'cad':
                 if args.debug:
                     print(f"skip {filename}")  
             else:
                 if args.debug:
                     print(f"add {filename} to {tarfilename}")  
                 tar.add(filename)
-                for mname in material_generic_def:
-                    if mname in filename:
-                        if args.debug: print(f"remove {filename}")
-                        os.unlink(filename)
-        tar.add('flow_params.json')
-        os.unlink('flow_params.json')
+                if artifact.kind == 'local' and filename != cfgfile and filename != jsonfile:
+                    if args.debug: print(f"remove {filename}")
+                    os.unlink(filename)
+        tar.add(manifestfile)
         tar.close()
 
     return (yamlfile, cfgfile, jsonfile, xaofile, meshfile, tarfilename)
 
-def setup_cmds(MyEnv, args, name, cfgfile, jsonfile, xaofile, meshfile):
+def mesh_size(MyEnv, meshfile: str, debug: bool = False) -> Tuple[int, int]:
+    """
+    get number of nodes and elements of meshfile
+
+    returns (-1, -1) if mesh is not available
+    """
+    try:
+        mesh = findfile(meshfile, search_paths(MyEnv, "mesh"), debug=False)
+        return mesh_header(mesh, debug)
+    except (FileNotFoundError, ImportError) as e:
+        print(f"mesh_size: cannot get size of {meshfile} ({e})")
+        return (-1, -1)
+
+def get_np(MyEnv, args, server, meshfile: str) -> Tuple[int, str]:
+    """
+    select number of cores for simulation
+
+    unless requested (args.np), NP is chosen from the mesh size
+    to get about args.elements_per_core (see meshinfo.select_np),
+    otherwise all cores of the server are used.
+    If a list of partitions is given (args.partitions),
+    NP is the largest partition within this choice (see meshinfo.select_partition)
+
+    returns NP and the reason of the choice
+    """
+    NP = server.cores
+    if server.multithreading:
+        NP = int(NP/2)
+    if args.debug:
+        print(f"NP={NP} {type(NP)}")
+    if args.np > 0:
+        if args.np > NP:
+            print(f'requested number of cores {args.np} exceed {server.name} capability (max: {NP})')
+            return (NP, "max")
+        return (args.np, "requested")
+
+    choice = "max"
+    (nnodes, nelems) = mesh_size(MyEnv, meshfile, args.debug)
+    if nnodes >= 0:
+        target = getattr(args, "elements_per_core", 0)
+        NP = select_np(nnodes, nelems, NP, args.geom, args.model, target, args.debug)
+        choice = "mesh"
+
+    parts = getattr(args, "partitions", [])
+    if parts:
+        return (select_partition(NP, parts, args.debug), "partition")
+    return (NP, choice)
+
+def partitions(args, NP: int) -> List[int]:
+    """
+    get number of cores for which partitions are created:
+    NP and args.partitions if any
+    """
+    return sorted(set(getattr(args, "partitions", []) or []) | {NP})
+
+def setup_cmds(MyEnv, args, name, cfgfile, jsonfile, xaofile, meshfile, io: Optional[dict] = None):
     """
     create cmds
 
+    io: if given, filled with inputs and outputs of each cmd (see pipeline)
+
     Watchout: gsmh/salome base mesh is always in millimeter
     For simulation it is madatory to use a mesh in meter except maybe for HDG
     """
@@ -438,21 +498,12 @@ def setup_cmds(MyEnv, args, name, cfgfile, jsonfile, xaofile, meshfile):
     
     # get server from MyEnv,
     # get NP from server (with an heuristic from meshsize)
-    # TODO adapt NP to the size of the problem
     # if server is SMP mpirun outside otherwise inside singularity
 
     server = loadmachine(args.machine)
     # print(f'setup_cmds: {server}')
-    NP = server.cores
-    if server.multithreading:
-        NP = int(NP/2)
-    if args.debug:
-        print(f"NP={NP} {type(NP)}")
-    if args.np > 0:
-        if args.np > NP:
-            print(f'requested number of cores {args.np} exceed {server.name} capability (max: {NP})')
-        else:
-            NP = args.np
+    (NP, NP_choice) = get_np(MyEnv, args, server, meshfile)
+    print(f"setup_cmds: NP={NP} ({NP_choice})")
 
     simage_path = MyEnv.simage_path()
     hifimagnet = AppCfg["mesh"]["hifimagnet"]
@@ -478,6 +529,7 @@ def setup_cmds(MyEnv, args, name, cfgfile, jsonfile, xaofile, meshfile):
         geocmd = f"salome -w1 -t $HIFIMAGNET/HIFIMAGNET_Cmd.py args:{name},2,2,--wd,{workingdir}"
         meshcmd = f"salome -w1 -t $HIFIMAGNET/HIFIMAGNET_Cmd.py args:{name},2,2,--wd,$PWD,mesh,--group,CoolingChannels,Isolants"
 
+    medfile = meshfile
     gmshfile = meshfile.replace(".med", ".msh")
     meshconvert = ""
 
@@ -496,15 +548,18 @@ def setup_cmds(MyEnv, args, name, cfgfile, jsonfile, xaofile, meshfile):
     scale = ""
     if args.method != "HDG":
         scale = "--mesh.scale=0.001"
+    # partitions for several NP in a single pass (eg. to retarget the case on other machines)
+    parts = partitions(args, NP)
+    part = ' '.join([str(n) for n in parts])
     h5file = xaofile.replace(".xao", f"_p{NP}.json")
-    partcmd = f"{partitioner} --ifile {gmshfile} --odir {workingdir} --part {NP} {scale}"
+    partcmd = f"{partitioner} --ifile {gmshfile} --odir {workingdir} --part {part} {scale}"
     if args.geom == "Axi":
-        partcmd = f"{partitioner} --nochdir --dim 2 --ifile {workingdir}/{gmshfile} --odir {workingdir} --part {NP} {scale}"
+        partcmd = f"{partitioner} --nochdir --dim 2 --ifile {workingdir}/{gmshfile} --odir {workingdir} --part {part} {scale}"
         
     tarfile = cfgfile.replace("cfg", "tgz")
     # TODO if cad exist do not print CAD command
     cmds = {
-        "Pre": f"export HIFIMAGNET={hifimagnet}",
+        "Pre": f"export HIFIMAGNET={hifimagnet} NP={NP} NP_CHOICE={NP_choice}",
         "Unpack": f"tar zxvf {tarfile}",
         "CAD": f"singularity exec {simage_path}/{salome} {geocmd}"
     }
@@ -520,6 +575,19 @@ def setup_cmds(MyEnv, args, name, cfgfile, jsonfile, xaofile, meshfile):
         cmds["Convert"] = f"singularity exec {simage_path}/{salome} {meshconvert}"
     
     cmds["Partition"] = f"singularity exec {simage_path}/{feelpp} {partcmd}"
+
+    # reuse meshes and partitions from cache
+    manifestfile = cfgfile.replace('.cfg', '-manifest.json')
+    mesh_cached = False
+    if not getattr(args, "no_mesh_cache", False) and os.path.isfile(manifestfile):
+        air = "mqs" in args.model or "mag" in args.model
+        key = mesh_key(load_manifest(manifestfile), air, f"{args.geom}|{geocmd}|{meshcmd}|{meshconvert}")
+        partmesh = f"{workingdir}/{gmshfile}" if args.geom == "Axi" else gmshfile
+        partfiles = {n: f"{workingdir}/" + xaofile.replace(".xao", f"_p{n}.*") for n in parts}
+        cmds = cached_cmds(cmds, getattr(args, "mesh_cache", default_cachedir), key, NP, scale, partmesh, partfiles, workingdir)
+        mesh_cached = True
+        print(f"setup_cmds: mesh cache key={key}")
+
     meshfile = h5file
     update_partition = f"perl -pi -e \'s|gmsh.partition=.*|gmsh.partition = 0|\' {cfgfile}" 
 
@@ -543,10 +611,18 @@ def setup_cmds(MyEnv, args, name, cfgfile, jsonfile, xaofile, meshfile):
 
     # compute resultdir:
     with open(cfgfile, 'r') as f:
-        directory = re.sub('directory=', '', f.readline(),  flags=re.DOTALL)
+        directory = re.sub('directory=', '', f.readline(),  flags=re.DOTALL).rstrip()
+
+    # sweep (see batch.create_jobs): each task of the Workflow array job runs current $VALUE
+    # in its own feelpp directory (see batch.sweep_workflow),
+    # Postprocessing, Stats and Save are run per task
+    suffix = ""
+    if getattr(args, "sweep", []):
+        (directory, suffix) = sweep_workflow(cmds, cfgfile, directory)
+
     home_env = 'HOME'
-    result_dir = f'{os.getenv(home_env)}/feelppdb/{directory.rstrip()}/np_{NP}'
-    result_arch = cfgfile.replace('.cfg', f'_res.tgz')
+    result_dir = f'{os.getenv(home_env)}/feelppdb/{directory}/np_{NP}'
+    result_arch = archive_name(cfgfile.replace('.cfg', f'{suffix}.cfg'))
     print(f'result_dir={result_dir}')
 
     paraview = AppCfg["post"]["paraview"]
@@ -554,16 +630,49 @@ def setup_cmds(MyEnv, args, name, cfgfile, jsonfile, xaofile, meshfile):
     # get expr and exprlegend from method/model/...
     if "post" in AppCfg[args.method][args.time][args.geom][args.model]:
         postdata = AppCfg[args.method][args.time][args.geom][args.model]["post"]
-        for key in postdata:
-            pyparaview = f'pv-scalarfield.py --cfgfile {cfgfile}  --jsonfile {jsonfile} --expr {key} --exprlegend \"{postdata[key]}\" --resultdir ${result_dir}'
-            pyparaviewcmd = f"pvpython {pyparaview}"
-            cmds["Postprocessing"] = f"singularity exec {simage_path}/{paraview} {pyparaviewcmd}"
+        # render all exprs in a single session
+        exprs = ' '.join(postdata.keys())
+        legends = ' '.join([f'\"{legend}\"' for legend in postdata.values()])
+        post_manifest = cfgfile.replace('.cfg', f'{suffix}-post.json')
+        pyparaview = f'pv-scalarfield.py --cfgfile {cfgfile}  --jsonfile {jsonfile} --expr {exprs} --exprlegend {legends} --resultdir {result_dir} --manifest {post_manifest}'
+        pyparaviewcmd = f"pvbatch {pyparaview}"
+        cmds["Postprocessing"] = f"singularity exec {simage_path}/{paraview} {pyparaviewcmd}"
             
-    cmds["Save"] = f"tmpdir=$(pwd) && pushd {result_dir}/.. && tar zcf $tmpdir/{result_arch} np_{NP} && popd"
-
-    # TODO jobmanager if server.manager != JobManagerType.none
-    # Need user email at this point
-    # Template for oar and slurm
+    # field statistics per marker without paraview (requires postprocessing installed in workingdir)
+    stats_file = cfgfile.replace('.cfg', f'{suffix}-stats.csv')
+    if getattr(args, "stats", False):
+        cmds["Stats"] = f"singularity exec {simage_path}/{feelpp} python3 postprocessing/ensight-stats.py {result_dir} --output {stats_file}"
+
+    cmds["Save"] = save_cmd(result_dir, NP, result_arch)
+
+    # job scripts for server.manager != JobManagerType.none: see batch.create_jobs
+
+    # inputs and outputs of cmds, relative to the directory where tarfile is unpacked
+    if io is not None:
+        cad = os.path.join(workingdir, xaofile)
+        gmsh = os.path.join(workingdir, gmshfile) if not meshconvert else gmshfile
+        partition = os.path.join(workingdir, h5file)
+        partition_files = [os.path.join(workingdir, xaofile.replace(".xao", f"_p{n}.json")) for n in parts]
+        io.update({
+            "Unpack": {"inputs": [tarfile], "outputs": [cfgfile, jsonfile]},
+            "CAD": {"inputs": [], "outputs": [cad]},
+            "Mesh": {"inputs": [cad], "outputs": [gmsh if not meshconvert else medfile]},
+            "Convert": {"inputs": [medfile], "outputs": [gmsh]},
+            "Partition": {"inputs": [gmsh], "outputs": partition_files},
+            "Update_Mesh": {"inputs": [cfgfile], "outputs": []},
+            "Update_Partition": {"inputs": [cfgfile], "outputs": []},
+            "Run": {"inputs": [cfgfile, jsonfile, partition], "outputs": [result_dir]},
+            "Workflow": {"inputs": [cfgfile, jsonfile, partition], "outputs": [result_dir]},
+            "Save": {"inputs": [result_dir], "outputs": [result_arch]},
+        })
+        if "Postprocessing" in cmds:
+            io["Postprocessing"] = {"inputs": [result_dir], "outputs": [post_manifest]}
+        if "Stats" in cmds:
+            io["Stats"] = {"inputs": [result_dir], "outputs": [stats_file]}
+        # on a cache hit only the partition is restored (see meshcache.cached_cmds)
+        if mesh_cached:
+            for stage in ["CAD", "Mesh", "Convert"]:
+                io[stage]["outputs"] = []
 
     # TODO get results (value.csv, png, raw data) to magnetdb 
     
@@ -9,23 +9,20 @@ from .jsonmodel import create_params_supra, create_bcs_supra, create_materials_s
 from .utils import NMerge
 
 from .file_utils import MyOpen, findfile
-
-def Supra_simfile(MyEnv, confdata: dict, cad: Supra):
+from .artifacts import Artifact, resolve
+
+def Supra_artifacts(MyEnv, confdata: dict, cad: Supra) -> List[Artifact]:
+    """
+    get artifacts needed for supra simulation
+    """
+    artifacts = [Artifact("geom", confdata["geom"])]
+    if cad.struct:
+        artifacts.append(Artifact("geom", cad.struct)) # + '.json'
+    return artifacts
+
+def Supra_simfile(MyEnv, confdata: dict, cad: Supra, debug: bool = False) -> List[Artifact]:
     print("Supra_simfile: %s" % cad.name)
-
-    from .file_utils import MyOpen, findfile
-
-    files = []
-
-    yamlfile = confdata["geom"]
-    with MyOpen(yamlfile, 'r', paths=[ os.getcwd(), default_pathes["geom"]]) as f:
-        files.append(f.name)
-
-    structfile = cad.struct # + '.json'
-    with MyOpen(structfile, 'r', paths=[ os.getcwd(), default_pathes["geom"]]) as f:
-        files.append(f.name)
-
-    return files
+    return resolve(MyEnv, Supra_artifacts(MyEnv, confdata, cad), debug=debug)
 
 def Supra_setup(MyEnv, confdata: dict, cad: Supra, method_data: List, templates: dict, debug: bool=False):
     print("Supra_setup: %s" % cad.name)
@@ -7,9 +7,9 @@ import re
 import json
 from tabulate import tabulate
 
-from .params import targetdefs, setTarget, getTarget, getparam, update, Merge
+from .params import create_targetdefs, getmagnets, setTarget, getTarget, getparam, update, update_overlay, Merge
 from .solver import init, solve
-from .real_methods import flow_params
+from .real_methods import flow_params, water_props
 # from ..units import load_units
 
 def main():
@@ -24,14 +24,18 @@ def main():
     parser = argparse.ArgumentParser(description="Cfpdes HiFiMagnet Fully Coupled model")
     parser.add_argument("cfgfile", help="input cfg file (ex. HL-31.cfg)")
     parser.add_argument("--wd", help="set a working directory", type=str, default="")
-    parser.add_argument("--current", help="specify requested current (default: 31kA)", nargs='+', metavar='Current', type=float, default=31.e+3)
+    parser.add_argument("--current", help="specify requested current (default: 31kA), one per magnet type (insert, bitter)", nargs='+', metavar='Current', type=float, default=[31.e+3])
     parser.add_argument("--cooling", help="choose cooling type", type=str,
                     choices=['mean', 'grad', 'meanH', 'gradH'], default='mean')
     parser.add_argument("--eps", help="specify requested tolerance (default: 1.e-3)", type=float, default=1.e-3)
     parser.add_argument("--itermax", help="specify maximum iteration (default: 10)", type=int, default=10)
+    parser.add_argument("--telemetry", help="write per-iteration convergence data to a json lines file", type=str, default="")
+    parser.add_argument("--overlay", help="save updated parameters as an overlay of the json model instead of a new json model", action='store_true')
+    parser.add_argument("--overlay_table", help="gather updated parameters for all currents in a single overlay table", type=str, default="")
     parser.add_argument("--debug", help="activate debug", action='store_true')
     parser.add_argument("--verbose", help="activate verbose", action='store_true')
     parser.add_argument("--flow_params", help="select flow param json file", type=str, default="flow_params.json")
+    parser.add_argument("--water_props", help="select tabulated water properties (basename of .npy/.json files, see waterprops)", type=str, default="")
     # TODO add flow max, Vpmax, Imax, Vpump correlation 
 
     args = parser.parse_args()
@@ -48,6 +52,10 @@ def main():
 
     # load flow params
     flow_params(args.flow_params)
+
+    # load tabulated water properties
+    if args.water_props:
+        water_props(args.water_props)
         
     print("Current:", args.current)
 
@@ -73,29 +81,40 @@ def main():
         dict_json = json.loads(jsonfile.read())
         parameters = dict_json['Parameters']
 
+    # create targets for all magnets in the model (insert: IH, bitter: IB)
+    defs = create_targetdefs(dict_json, args.debug)
+    magnets = getmagnets(defs)
+    print("Magnets:", magnets)
+
     params = {}
+    mparams = {}
     bc_params = {}
     control_params = []
-    for p in targetdefs['IH']['control_params']:
-        if args.debug: print(f"extract control params for {p[0]}")
-        control_params.append(p[0])
-        tmp = getparam(p[0], parameters, p[1], args.debug)
-        params = Merge(tmp, params, args.debug)
-
-    for p in targetdefs['IH']['params']:
-        if args.debug: print(f"extract compute params for {p[0]}")
-        tmp = getparam(p[0], parameters, p[1], args.debug)
-        params = Merge(tmp, params, args.debug)
+    for name in magnets:
+        mparams[name] = {}
+        for p in defs[name]['control_params']:
+            if args.debug: print(f"extract control params for {name}: {p[0]}")
+            if not p[0] in control_params:
+                control_params.append(p[0])
+            tmp = getparam(p[0], parameters, p[1], args.debug)
+            mparams[name] = Merge(tmp, mparams[name], args.debug)
+
+        for p in defs[name]['params']:
+            if args.debug: print(f"extract compute params for {name}: {p[0]}")
+            tmp = getparam(p[0], parameters, p[1], args.debug)
+            mparams[name] = Merge(tmp, mparams[name], args.debug)
+
+        params = Merge(mparams[name], params, args.debug)
 
     # Get Bc params
     for p in [ 'HeatCoeff', 'DT' ]:
         if args.debug: print(f"extract bc params for {p}")
-        for bc_p in targetdefs[p]['params']:
+        for bc_p in defs[p]['params']:
             if args.debug: print(f"{bc_p[0]}")
             tmp = getparam(bc_p[0], parameters, bc_p[1], args.debug)
             bc_params = Merge(tmp, bc_params, args.debug)
         if args.debug: print(f"extract bc control_params for {p}")
-        for bc_p in targetdefs[p]['control_params']:
+        for bc_p in defs[p]['control_params']:
             if args.debug: print(f"{bc_p[0]}")
             tmp = getparam(bc_p[0], parameters, bc_p[1], args.debug)
             bc_params = Merge(tmp, bc_params, args.debug)
@@ -104,39 +123,46 @@ def main():
     if args.debug:
         print("bc_params:", bc_params)
 
-    # define targets
-    # TODO for insert + bitter [ + supra] ???
-    # shall build targetdefs on the fly
-    # insert: IH, params N_H\* control_params U_H\* 'Statistics_Intensity_H\w+_integrate'
-    # bitter: IB, other U_\*, extract name from U_* to get N_*
-    # supra: IS params from I_\*, ............. I_\* to get N_*
-    targets = setTarget('IH', params, args.current[0], args.debug)
+    # define targets: currents are given in magnets order,
+    # the last one is used for remaining magnets
+    targets = {}
+    for i, name in enumerate(magnets):
+        current = args.current[min(i, len(args.current)-1)]
+        print(f"{name}: {current} [A]")
+        targets[name] = setTarget(name, mparams[name], current, args.debug, defs)
     # print("targets:", targets)
     
     # init feelpp env
     (feelpp_env, feel_pb) = init(args)
     
-    # solve (output params contains both control_params and bc_params values )
-    (params, bcparams) = solve(feelpp_env, feel_pb, args, 'IH', params, control_params, bc_params, targets)
+    # solve: drive all magnets currents simultaneously
+    # (output params contains both control_params and bc_params values )
+    (params, bcparams) = solve(feelpp_env, feel_pb, args, magnets, params, control_params, bc_params, targets, defs)
     
     # update
-    update(cwd, jsonmodel, params, control_params, bcparams, args.current[0], args.debug)
+    if feelpp_env.isMasterRank():
+        if args.overlay or args.overlay_table:
+            update_overlay(cwd, jsonmodel, params, control_params, bcparams, args.current[0], args.overlay_table, args.debug)
+        else:
+            update(cwd, jsonmodel, params, control_params, bcparams, args.current[0], args.debug)
 
     # display csv results
     # TODO use units 
     # get Power for Insert, Bitter
     if feelpp_env.isMasterRank():
         print(f"update: workingdir={ os.getcwd() }")
-    df = getTarget('Power', feelpp_env, args.debug)
+    df = getTarget('Power', feelpp_env, args.debug, defs)
     # df = getTarget('MeanT', feelpp_env, args.debug)
     # df = getTarget('MaxT', feelpp_env, args.debug)
     if feelpp_env.isMasterRank():
         print(f"I: {args.current[0]} [A]\tPower: {df.iloc[-1][0]} [W]")
-        # TODO add bitter current and power if any Bitters
 
-    # stats by Helices
-    for p in ['PowerH', 'MeanTH', 'MaxTH', 'Flux']:
-        df = getTarget(p, feelpp_env, args.debug)
+    # stats by Helices and by Bitters
+    stats = ['PowerH', 'MeanTH', 'MaxTH', 'Flux']
+    if 'IB' in magnets:
+        stats += ['PowerB', 'MeanTB']
+    for p in stats:
+        df = getTarget(p, feelpp_env, args.debug, defs)
 
         # TODO change keys (symbols+units)
         # create new key dict
@@ -144,8 +170,9 @@ def main():
         nkeys = {}
         for item in keys:
             nitem = item
-            if re.match(targetdefs[p]['rematch'], item):
-                regexp = re.split('_', targetdefs[p]['rematch'])
+            rematch = defs[p]['rematch']
+            if re.match(rematch, item):
+                regexp = re.split('_', getattr(rematch, 'pattern', rematch))
                 nitem = item.replace(regexp[0], '')
                 nitem = nitem.replace(regexp[1], '')
                 nitem = nitem.replace(regexp[3], '')
@@ -158,9 +185,8 @@ def main():
             
         df.rename(columns=nkeys, inplace=True)
         if feelpp_env.isMasterRank():
-            print(f"{p} [{targetdefs[p]['unit']}]:\n{tabulate(df, headers='keys', tablefmt='simple')}\n")
+            print(f"{p} [{defs[p]['unit']}]:\n{tabulate(df, headers='keys', tablefmt='simple')}\n")
             
-    # Same for Bitters
     # Same for Supras
 
 if __name__ == "__main__":
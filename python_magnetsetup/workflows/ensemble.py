@@ -0,0 +1,175 @@
+"""
+Run an ensemble of independent workflow cases under one allocation
+
+Cases are defined in a json file as a list of dict, eg:
+
+[
+    {"cfgfile": "HL-31-cfpdes-thelec-Axi-sim.cfg", "wd": "HL-31", "current": [31000], "cooling": "mean"},
+    {"cfgfile": "M9-cfpdes-thelec-Axi-sim.cfg", "wd": "M9", "current": [25000], "cooling": "grad", "np": 4}
+]
+
+The available cores are split into groups, each group running one case
+with its own MPI communicator (feelpp environment is bound to MPI_COMM_WORLD,
+so each case is started as a separate mpirun) and cases are run concurrently.
+Results of each case are gathered into a single csv file once all cases are done.
+"""
+
+from typing import List
+
+import sys
+import os
+import json
+import time
+import argparse
+import threading
+import subprocess
+
+import pandas as pd
+
+from concurrent.futures import ThreadPoolExecutor
+
+# keys of a case passed as option to workflows.cli
+case_options = ['current', 'cooling', 'eps', 'itermax', 'flow_params', 'water_props', 'telemetry']
+
+def load_cases(filename: str, debug: bool = False) -> List[dict]:
+    """
+    load ensemble cases from json file
+    """
+    with open(filename, 'r') as f:
+        cases = json.loads(f.read())
+
+    for i, case in enumerate(cases):
+        if not 'cfgfile' in case:
+            raise RuntimeError(f"load_cases: case {i} in {filename} has no cfgfile")
+        case.setdefault('wd', '')
+        if debug:
+            print(f"case {i}: {case}")
+    return cases
+
+def split_cores(cases: List[dict], NP: int, np_per_case: int = 0) -> List[int]:
+    """
+    get number of cores for each case
+
+    unless given in the case definition, each case gets np_per_case cores
+    (default: NP evenly split between cases)
+    """
+    if np_per_case <= 0:
+        np_per_case = max(1, NP // len(cases))
+
+    nps = []
+    for case in cases:
+        n = case.get('np', np_per_case)
+        if n > NP:
+            print(f"requested number of cores for {case['cfgfile']} ({n}) exceed allocation (max: {NP})")
+            n = NP
+        nps.append(n)
+    return nps
+
+def case_cmd(case: dict, n: int, mpirun: str = "mpirun -np") -> List[str]:
+    """
+    create command to run case on n cores
+    """
+    cmd = mpirun.split() + [str(n), sys.executable, '-m', f'{__package__}.cli', case['cfgfile']]
+    for key in case_options:
+        if key in case:
+            value = case[key]
+            cmd.append(f'--{key}')
+            if isinstance(value, list):
+                cmd += [str(v) for v in value]
+            else:
+                cmd.append(str(value))
+    return cmd
+
+def run_case(case: dict, n: int, mpirun: str, debug: bool = False) -> dict:
+    """
+    run a case and return its status
+    """
+    cwd = os.getcwd()
+    wd = os.path.join(cwd, case['wd'])
+    cmd = case_cmd(case, n, mpirun)
+    logfile = os.path.join(wd, case['cfgfile'].replace('.cfg', '-ensemble.log'))
+    print(f"run_case: {' '.join(cmd)} (wd={wd}, log={logfile})")
+
+    start = time.perf_counter()
+    with open(logfile, 'w') as log:
+        status = subprocess.run(cmd, cwd=wd, stdout=log, stderr=subprocess.STDOUT).returncode
+    elapsed = time.perf_counter() - start
+
+    res = {
+        'cfgfile': case['cfgfile'],
+        'wd': case['wd'],
+        'np': n,
+        'status': status,
+        'time': elapsed
+    }
+
+    # get last iteration of the workflow (see solver.solve)
+    if status == 0 and 'current' in case:
+        current = case['current'][0] if isinstance(case['current'], list) else case['current']
+        resfile = os.path.join(wd, case['cfgfile'].replace('.cfg', f'-I{str(float(current))}A.csv'))
+        if os.path.isfile(resfile):
+            df = pd.read_csv(resfile, index_col=0)
+            res['current'] = current
+            for key in df.columns.values.tolist():
+                res[key] = df[key].iloc[-1]
+        elif debug:
+            print(f"run_case: no result file {resfile}")
+
+    print(f"run_case: {case['cfgfile']} done (status={status}, time={elapsed:.1f} s)")
+    return res
+
+def run(cases: List[dict], NP: int, np_per_case: int = 0, mpirun: str = "mpirun -np", debug: bool = False) -> pd.DataFrame:
+    """
+    run cases concurrently with at most NP cores in use
+
+    each case is started as soon as its own number of cores is free,
+    so that cases with different core counts share the allocation
+
+    returns a dataframe with one row per case
+    """
+    nps = split_cores(cases, NP, np_per_case)
+    print(f"ensemble: {len(cases)} cases on {NP} cores")
+
+    free = [NP]
+    cores = threading.Condition()
+
+    def task(case: dict, n: int) -> dict:
+        with cores:
+            cores.wait_for(lambda: free[0] >= n)
+            free[0] -= n
+        try:
+            return run_case(case, n, mpirun, debug)
+        finally:
+            with cores:
+                free[0] += n
+                cores.notify_all()
+
+    with ThreadPoolExecutor(max_workers=len(cases)) as executor:
+        futures = [executor.submit(task, case, n) for (case, n) in zip(cases, nps)]
+        results = [future.result() for future in futures]
+
+    return pd.DataFrame(results)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an ensemble of Cfpdes HiFiMagnet workflows")
+    parser.add_argument("casesfile", help="input json file listing cases (ex. cases.json)")
+    parser.add_argument("--wd", help="set a working directory", type=str, default="")
+    parser.add_argument("--np", help="total number of cores (default: number of cpus)", type=int, default=os.cpu_count())
+    parser.add_argument("--np_per_case", help="number of cores per case (default: np / number of cases)", type=int, default=0)
+    parser.add_argument("--mpirun", help="mpi launcher (default: 'mpirun -np')", type=str, default="mpirun -np")
+    parser.add_argument("--output", help="output csv file for gathered results", type=str, default="ensemble.csv")
+    parser.add_argument("--debug", help="activate debug", action='store_true')
+    args = parser.parse_args()
+
+    if args.wd:
+        os.chdir(args.wd)
+
+    cases = load_cases(args.casesfile, args.debug)
+    df = run(cases, args.np, args.np_per_case, args.mpirun, args.debug)
+
+    print(f"Export ensemble results to csv: {os.getcwd() + '/' + args.output}")
+    df.to_csv(args.output, encoding='utf-8')
+    return 0 if (df['status'] == 0).all() else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
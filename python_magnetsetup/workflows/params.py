@@ -11,14 +11,15 @@ value: name of the method to compute name
 from typing import List, Union, Optional
 
 import os
+import re
+import copy
 
 import pandas as pd
 import json
 
 from .real_methods import *
 
-# TODO create/modify targetdefs on the fly
-
+# default targets (Insert only), see create_targetdefs for insert + bitter + supra
 targetdefs = {
     "IH": {
         "csv": 'heat.measures/values.csv', 
@@ -102,11 +103,121 @@ targetdefs = {
     },
 }
 
-def setTarget(name: str, params: dict, objectif: float, debug: bool = False):
+def getmeasures(postprocess: dict, measure: str = "Intensity", debug: bool = False) -> List[str]:
+    """
+    get markers for which measure is defined in PostProcess section
+
+    eg: "Intensity_%1%": {"index1": ["H1_Cu1", "H1_Cu2"]} gives ["H1_Cu1", "H1_Cu2"]
+    """
+    markers = []
+    for section in postprocess:
+        if not isinstance(postprocess[section], dict) or not 'Measures' in postprocess[section]:
+            continue
+        stats = postprocess[section]['Measures'].get('Statistics', {})
+        for key in stats:
+            if not key.startswith(measure + '_'):
+                continue
+            name = key.replace(measure + '_', '', 1)
+            if '%1%' in name and 'index1' in stats[key]:
+                markers += [name.replace('%1%', str(index)) for index in stats[key]['index1']]
+            else:
+                markers.append(name)
+
+    if debug:
+        print(f"getmeasures {measure}: {markers}")
+    return markers
+
+def create_targetdefs(dict_json: dict, debug: bool = False) -> dict:
+    """
+    create targets from Parameters and PostProcess sections of json model
+
+    adds a target for every kind of magnet found in the model:
+    insert: IH, params N_H*_Cu* control_params U_H*_Cu*
+    bitter: IB, params N_{name}_B* control_params U_{name}_B*
+
+    supras are not driven: their json model has no current parameters
+    (see jsonmodel.create_params_supra)
+    """
+
+    defs = copy.deepcopy(targetdefs)
+    del defs['IH']
+
+    parameters = dict_json['Parameters']
+    measured = getmeasures(dict_json.get('PostProcess', {}), "Intensity", debug)
+
+    insert_regex = re.compile(r'U_(H\d+_Cu\d+)')
+    bitter_regex = re.compile(r'U_(\w+)_B\d+')
+
+    helices = []
+    bitters = []
+    for p in parameters:
+        match = insert_regex.fullmatch(p)
+        if match:
+            helices.append(match.group(1))
+            continue
+        match = bitter_regex.fullmatch(p)
+        if match:
+            if not match.group(1) in bitters:
+                bitters.append(match.group(1))
+
+    if helices:
+        defs['IH'] = {
+            "csv": 'heat.measures/values.csv',
+            "rematch": re.compile(r'Statistics_Intensity_H\d+_Cu\d+_integrate'),
+            "params": [('N', re.compile(r'N_H\d+_Cu\d+'))],
+            "control_params": [('U', re.compile(r'U_H\d+_Cu\d+'), update_U)],
+            "value": (getCurrent, setCurrent),
+            "unit": "Current"
+        }
+
+    if bitters:
+        names = '|'.join([re.escape(name) for name in bitters])
+        defs['IB'] = {
+            "csv": 'heat.measures/values.csv',
+            "rematch": re.compile(rf'Statistics_Intensity_({names})_B\d+_integrate'),
+            "params": [('N', re.compile(rf'N_({names})_B\d+'))],
+            "control_params": [('U', re.compile(rf'U_({names})_B\d+'), update_U)],
+            "value": (getCurrent, setCurrent),
+            "unit": "Current"
+        }
+        defs['PowerB'] = {
+            "csv": 'heat.measures/values.csv',
+            "rematch": re.compile(rf'Statistics_Power_({names})_integrate'),
+            "params": [],
+            "control_params": [],
+            "value": (getPower, setPower),
+            "unit": "Power"
+        }
+        defs['MeanTB'] = {
+            "csv": 'heat.measures/values.csv',
+            "rematch": re.compile(rf'Statistics_MeanT_({names})_mean'),
+            "params": [],
+            "control_params": [],
+            "value": (getMeanT, setMeanT),
+            "unit": "Temperature"
+        }
+
+    for (name, markers) in [('IH', helices), ('IB', bitters)]:
+        if markers:
+            missing = [marker for marker in markers if measured and not any(m.startswith(marker) for m in measured)]
+            if missing:
+                print(f"create_targetdefs: {name} no Intensity measure for {missing} in PostProcess")
+            if debug:
+                print(f"create_targetdefs: {name} markers={markers}")
+
+    return defs
+
+def getmagnets(defs: dict) -> List[str]:
+    """
+    get current targets defined in defs, in the order: insert, bitter
+    """
+    return [name for name in ['IH', 'IB'] if name in defs]
+
+def setTarget(name: str, params: dict, objectif: float, debug: bool = False, defs: dict = targetdefs):
     # print(f"setTarget: workingdir={ os.getcwd() } name={name}")
     targets = {}
     for key in params:
-        I_target = targetdefs[name]['value'][1](key, params, objectif)
+        I_target = defs[name]['value'][1](key, params, objectif)
         if debug:
             print(f"{name} objectif={objectif}, setvalue={I_target}")
         targets[key] = I_target
@@ -114,10 +225,10 @@ def setTarget(name: str, params: dict, objectif: float, debug: bool = False):
     if debug: print(f"targets: {targets}")
     return targets
 
-def getTarget(name: str, e, debug: bool = False):
+def getTarget(name: str, e, debug: bool = False, defs: dict = targetdefs):
     # print(f"getTarget: workingdir={ os.getcwd() } name={name}")
     
-    defs = targetdefs[name]
+    defs = defs[name]
     if debug:
         print(f"defs: {defs}")
         print(f"csv: {defs['csv']}")
@@ -168,7 +279,7 @@ def getparam(param:str, parameters: dict, rmatch: str, debug: bool = False ):
     n = 0
     val = {}
 
-    import re
+    # rmatch may be already compiled
     regex_match = re.compile(rmatch)
     for p in parameters.keys() :
         if regex_match.fullmatch(p):
@@ -201,7 +312,7 @@ def post(csv: str, rmatch: str, debug: bool = False):
     df = pd.DataFrame()
     if debug: print("post: loading {csv_}")
     with open(csv, 'r') as f:
-        _df = pd.read_csv(f, sep=",", engine='python')
+        _df = pd.read_csv(f, sep=",")
         if debug:
             for key in _df.columns.values.tolist():
                 print(key)
@@ -213,9 +324,81 @@ def post(csv: str, rmatch: str, debug: bool = False):
 
     return df
 
+def getoverlay(paramsdict: dict, params: List[str], bcparams: dict) -> dict:
+    """
+    get updated parameters as a flat dict {name: value}
+    """
+    overlay = {}
+    for key in paramsdict:
+        for p in params:
+            if p in paramsdict[key]:
+                overlay[f'{p}_{key}'] = paramsdict[key][p]
+
+    for key in bcparams:
+        overlay[key] = bcparams[key]
+    return overlay
+
+def update_overlay(cwd: str, jsonmodel: str, paramsdict: dict, params: List[str], bcparams: dict, objectif: float, table: str = "", debug: bool=False) -> str:
+    """
+    write updated parameters as an overlay of jsonmodel
+
+    without table, the overlay is written to {jsonmodel}-I{objectif}A.params.json
+    otherwise it is added to table, a json file gathering overlays of all objectifs
+    (eg. for a sweep in current)
+
+    see load_model to get the actual model
+    """
+    overlay = getoverlay(paramsdict, params, bcparams)
+
+    if table:
+        filename = os.path.join(cwd, table)
+        data = {"model": jsonmodel, "overlays": {}}
+        if os.path.isfile(filename):
+            with open(filename, 'r') as f:
+                data = json.loads(f.read())
+            if data["model"] != jsonmodel:
+                raise RuntimeError(f"update_overlay: {table} is an overlay table for {data['model']} not {jsonmodel}")
+        data["overlays"][str(objectif)] = overlay
+    else:
+        filename = os.path.join(cwd, jsonmodel.replace('.json', f'-I{str(objectif)}A.params.json'))
+        data = {"model": jsonmodel, "Parameters": overlay}
+
+    if debug:
+        print(f"update_overlay: {filename} {overlay}")
+    with open(filename, 'w') as f:
+        f.write(json.dumps(data, separators=(',', ':')))
+
+    return filename
+
+def load_model(jsonmodel: str, overlay: str = "", objectif: Optional[float] = None, debug: bool=False) -> dict:
+    """
+    load jsonmodel and apply overlay parameters
+
+    overlay: overlay file (see update_overlay)
+    objectif: select overlay in an overlay table
+    """
+    with open(jsonmodel, 'r') as jsonfile:
+        dict_json = json.loads(jsonfile.read())
+
+    if overlay:
+        with open(overlay, 'r') as f:
+            data = json.loads(f.read())
+
+        if "overlays" in data:
+            if objectif is None:
+                raise RuntimeError(f"load_model: {overlay} is an overlay table, an objectif is required (available: {list(data['overlays'].keys())})")
+            parameters = data["overlays"][str(objectif)]
+        else:
+            parameters = data["Parameters"]
+
+        if debug:
+            print(f"load_model: {jsonmodel} + {overlay}: {parameters}")
+        dict_json['Parameters'].update(parameters)
+
+    return dict_json
+
 def update(cwd: str, jsonmodel: str, paramsdict: dict, params: List[str], bcparams: dict, objectif: float, debug: bool=False):
     # Update tensions U
-    import re
     
     pwd = os.getcwd()
     os.chdir(cwd)
@@ -228,6 +411,8 @@ def update(cwd: str, jsonmodel: str, paramsdict: dict, params: List[str], bcpara
     
     for key in paramsdict:
         for p in params:
+            if not p in paramsdict[key]:
+                continue
             if debug:
                 print(f"param: {p}")
                 print(f"init {p}_{key} = {parameters[f'{p}_{key}']}")
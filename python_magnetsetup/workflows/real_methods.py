@@ -1,6 +1,6 @@
 import json
 import pandas as pd
-import math
+import numpy as np
 
 import warnings
 from pint import UnitRegistry, Unit, Quantity
@@ -20,6 +20,9 @@ Pmax = 22 # bar
 Pmin = 4 # bar
 Imax = 28000 # A
 
+# Tabulated water properties (see waterprops)
+water = None
+
 # Flow params
 def flow_params(filename: str):
     with open(filename, 'r') as f:
@@ -36,6 +39,16 @@ def flow_params(filename: str):
 
     pass
 
+# Water props
+def water_props(basename: str):
+    from .waterprops import WaterTable
+
+    global water
+    print(f"Load water properties from {basename}.npy")
+    water = WaterTable(basename)
+
+    pass
+
 def update_U(params: dict, marker: str, target: float, val: float):
     return float(params[marker]['U']) * target/val
     pass
@@ -103,16 +116,26 @@ def umean(objectif: float, section: float) -> float:
 
 def rho(Tw: float, P: float) -> float:
     """
-    compute water volumic mass in ???
-    TODO link with freesteam
+    compute water volumic mass in kg/m^3
+
+    Tw: K
+    P: bar
+    Tw and P may be arrays when water properties are tabulated
     """
+    if water:
+        return water('rho', Tw, P)
     return 1.e+3
 
 def Cp(Tw: float, P: float) -> float:
     """
-    compute water specific heat in ???
-    TODO link with freesteam
+    compute water specific heat in J/kg/K
+
+    Tw: K
+    P: bar
+    Tw and P may be arrays when water properties are tabulated
     """
+    if water:
+        return water('Cp', Tw, P)
     return 2840
 
 def montgomery(Tw: float, Umean: float, Dh: float) -> float:
@@ -124,7 +147,7 @@ def montgomery(Tw: float, Umean: float, Dh: float) -> float:
     Dh: meter
     """
     
-    return 1426*(1+1.5e-2*(Tw-273))*math.exp(math.log(Umean)*0.8)/math.exp(math.log(Dh)*0.2)
+    return 1426*(1+1.5e-2*(Tw-273))*np.exp(np.log(Umean)*0.8)/np.exp(np.log(Dh)*0.2)
 
 def getDT(objectif: float, Power: float, Tw: float, P: float) -> float:
     # compute dT as Power / rho *Cp * Flow(I)
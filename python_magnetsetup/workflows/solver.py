@@ -7,9 +7,11 @@ import feelpp.toolboxes.cfpdes as cfpdes
 import sys
 import os
 import pandas as pd
+import numpy as np
 
 from .params import targetdefs, getTarget
 from .real_methods import pressure, umean, flow, montgomery
+from .telemetry import Telemetry
 
 # TODO create toolboxes_options on the fly
 def init(args):
@@ -25,24 +27,39 @@ def init(args):
 
     return (e, f)
 
-def solve(e, f: str, args, objectif: str, paramsdict: dict, params: List[str], bcs_params: dict, targets: dict):
+def solve(e, f: str, args, objectif: Union[str, List[str]], paramsdict: dict, params: List[str], bcs_params: dict, targets: dict, defs: dict = targetdefs):
+    """
+    objectif: name of the target to reach,
+    or list of names to drive all magnets currents simultaneously,
+    in this case targets are given per name (eg. {'IH': {...}, 'IB': {...}})
+    """
     if e.isMasterRank(): print(f"solve: workingdir={ os.getcwd() }")
     it = 0
     err_max = 2 * args.eps
 
+    objectifs = objectif
+    if isinstance(objectif, str):
+        objectifs = [objectif]
+        targets = {objectif: targets}
+
     table = []
     headers = ['it']
-    for key in paramsdict:
-        for p in params:
-            headers.append(f'{p}_{key}')
+    for name in objectifs:
+        for key in targets[name]:
+            for p in defs[name]['control_params']:
+                headers.append(f'{p[0]}_{key}')
     headers.append('err_max')
 
     bcparams = {}
+    telemetry = Telemetry(e, getattr(args, 'telemetry', ''))
     while err_max > args.eps and it < args.itermax :
+        record = {'it': it}
         
         # Update new value of U_Hi_Cuj on feelpp's senvironment
         for key in paramsdict:
             for p in params:
+                if not p in paramsdict[key]:
+                    continue
                 entry = f'{p}_{key}'
                 val = float(paramsdict[key][p])
                 # print(f"{entry}: {val}")
@@ -54,14 +71,15 @@ def solve(e, f: str, args, objectif: str, paramsdict: dict, params: List[str], b
 
         # Solve and export the simulation
         # try:
+        telemetry.start('solve')
         f.solve()
+        telemetry.stop('solve')
+        telemetry.start('export')
         f.exportResults()
+        telemetry.stop('export')
         # except:
         #    raise RuntimeError("cfpdes solver or exportResults fails - check feelpp logs for more info")
 
-        # TODO: get csv to look for depends on cfpdes model used
-        filtered_df = getTarget(objectif, e, args.debug)
-
         # TODO: define a function to handle error calc
         # and update depending on param 
         
@@ -70,19 +88,30 @@ def solve(e, f: str, args, objectif: str, paramsdict: dict, params: List[str], b
         num = 0
 
         # logging in table
-        if e.isMasterRank():
-            print(f"Compute error on {objectif}")
         table_ = [it]
-        for key in targets:
-            val = targetdefs[objectif]['value'][0](filtered_df, key)
-            target = targets[key]
-            err_max = max(abs(1 - val/target), err_max)
-
-            # update val
-            for p in targetdefs[objectif]['control_params']:
-                table_.append(float(paramsdict[key][p[0]]))
-                paramsdict[key][p[0]] = p[2](paramsdict, key, target, val)
+        record['markers'] = {}
+        for name in objectifs:
+            # TODO: get csv to look for depends on cfpdes model used
+            telemetry.start('csv')
+            filtered_df = getTarget(name, e, args.debug, defs)
+            telemetry.stop('csv')
+
+            if e.isMasterRank():
+                print(f"Compute error on {name}")
+            for key in targets[name]:
+                val = defs[name]['value'][0](filtered_df, key)
+                target = targets[name][key]
+                err = abs(1 - val/target)
+                err_max = max(err, err_max)
+                record['markers'][key] = {'value': val, 'target': target, 'err': err}
+
+                # update val
+                for p in defs[name]['control_params']:
+                    table_.append(float(paramsdict[key][p[0]]))
+                    paramsdict[key][p[0]] = p[2](paramsdict, key, target, val)
+                    record['markers'][key][p[0]] = float(paramsdict[key][p[0]])
         table_.append(err_max)
+        record['err_max'] = err_max
 
         if e.isMasterRank():
             print(f"it={it}, err_max={err_max}")
@@ -90,58 +119,81 @@ def solve(e, f: str, args, objectif: str, paramsdict: dict, params: List[str], b
 
                 
         # update bcs 
-        if e.isMasterRank():
-            print("Update Bcs")
-        flux_df = getTarget('Flux', e, args.debug)
-        power_df = getTarget('PowerH', e, args.debug)
-        SPower_H = power_df.iloc[-1].sum()
-        Power = getTarget("Power", e, args.debug)
-        if args.debug and e.isMasterRank():
-            print(f'it={it} Power={Power.iloc[-1]} SPower_H={SPower_H} PowerH={power_df.iloc[-1]}')
-        Pressure = pressure(args.current[0])
-
+        # cooling bcs are only defined for magnets with water channels (insert: PowerH, bitter: PowerB)
+        powers = [power for (name, power) in [('IH', 'PowerH'), ('IB', 'PowerB')] if name in objectifs and power in defs]
         Dh = []
         Sh = []
         for p in bcs_params:
             if "Dh" in p: Dh.append(float(bcs_params[p]['Dh']))
             if "Sh" in p: Sh.append(float(bcs_params[p]['Sh']))
 
-        Umean = umean(args.current[0], sum(Sh))
-        if args.debug and e.isMasterRank():
-            print(f'it={it} Umean={Umean} Flow={flow(args.current[0])}')
-        for i,(d, s) in enumerate(zip(Dh, Sh)):
-            PowerCh = flux_df[f'Statistics_Flux_Channel{i}_integrate'].iloc[-1]
+        if not powers or not Dh or sum(Sh) <= 0:
+            if e.isMasterRank():
+                print(f"Skip Bcs update: no cooling channels (magnets={objectifs}, Dh={Dh}, Sh={Sh})")
+        else:
+            if e.isMasterRank():
+                print("Update Bcs")
+            telemetry.start('csv')
+            flux_df = getTarget('Flux', e, args.debug, defs)
+            SPower_H = 0
+            for power in powers:
+                power_df = getTarget(power, e, args.debug, defs)
+                SPower_H += power_df.iloc[-1].sum()
+            Power = getTarget("Power", e, args.debug, defs)
+            telemetry.stop('csv')
             if args.debug and e.isMasterRank():
-                print(f"Channel{i}: umean={Umean}, Dh={d}, Sh={s}, Power={PowerCh}")
-            Tw = float(bcs_params[f'Tw{i}']['TwH'])
-            dTwi = targetdefs['DT']['value'][0](args.current[0], PowerCh, Tw, Pressure)
-            hi = targetdefs['HeatCoeff']['value'][0](d, Umean, Tw)
-            f.addParameterInModelProperties(f'dTw{i}', dTwi)
-            f.addParameterInModelProperties(f'h{i}', hi)        
+                print(f'it={it} Power={Power.iloc[-1]} SPower_H={SPower_H}')
+            Pressure = pressure(args.current[0])
+
+            Umean = umean(args.current[0], sum(Sh))
             if args.debug and e.isMasterRank():
-                print(f'it={it} dTw{i}: {dTwi} hw{i}: {hi}')
-            bcparams[f'dTw{i}'] = dTwi
-            bcparams[f'h{i}'] = hi
-
-        Tw = float(bcs_params['Tw']['Tw'])
-        dTw = targetdefs['DT']['value'][0](args.current[0], SPower_H, Tw, Pressure)
-        hw = montgomery(Tw, Umean, sum(Dh)/len(Dh))
-        f.addParameterInModelProperties("dTw", dTw)
-        f.addParameterInModelProperties("hw", hw )        
-        if args.debug and e.isMasterRank():
-            print(f'it={it}: dTw={dTw} hw={hw}')
-        bcparams['dTw'] = dTw
-        bcparams['hw'] = hw
+                print(f'it={it} Umean={Umean} Flow={flow(args.current[0])}')
+            # compute dTw and h for all channels at once
+            # (only for channels with a Flux measure and a Tw param)
+            channels = [i for i in range(len(Dh)) if f'Statistics_Flux_Channel{i}_integrate' in flux_df and f'Tw{i}' in bcs_params]
+            if len(channels) != len(Dh) and e.isMasterRank():
+                print(f"Skip channels Bcs update: missing Flux or Tw for channels {[i for i in range(len(Dh)) if not i in channels]}")
+            if len(channels) == len(Dh):
+                PowerCh = np.array([flux_df[f'Statistics_Flux_Channel{i}_integrate'].iloc[-1] for i in range(len(Dh))])
+                TwCh = np.array([float(bcs_params[f'Tw{i}']['TwH']) for i in range(len(Dh))])
+                dTwCh = defs['DT']['value'][0](args.current[0], PowerCh, TwCh, Pressure)
+                hCh = defs['HeatCoeff']['value'][0](np.array(Dh), Umean, TwCh)
+                for i,(d, s) in enumerate(zip(Dh, Sh)):
+                    if args.debug and e.isMasterRank():
+                        print(f"Channel{i}: umean={Umean}, Dh={d}, Sh={s}, Power={PowerCh[i]}")
+                    dTwi = float(dTwCh[i])
+                    hi = float(hCh[i])
+                    f.addParameterInModelProperties(f'dTw{i}', dTwi)
+                    f.addParameterInModelProperties(f'h{i}', hi)
+                    if args.debug and e.isMasterRank():
+                        print(f'it={it} dTw{i}: {dTwi} hw{i}: {hi}')
+                    bcparams[f'dTw{i}'] = dTwi
+                    bcparams[f'h{i}'] = hi
+
+            if 'Tw' in bcs_params:
+                Tw = float(bcs_params['Tw']['Tw'])
+                dTw = float(defs['DT']['value'][0](args.current[0], SPower_H, Tw, Pressure))
+                hw = float(montgomery(Tw, Umean, sum(Dh)/len(Dh)))
+                f.addParameterInModelProperties("dTw", dTw)
+                f.addParameterInModelProperties("hw", hw )        
+                if args.debug and e.isMasterRank():
+                    print(f'it={it}: dTw={dTw} hw={hw}')
+                bcparams['dTw'] = dTw
+                bcparams['hw'] = hw
 
         f.updateParameterValues()
 
+        record['bcs'] = dict(bcparams)
+        telemetry.write(record)
 
         it += 1
 
+    telemetry.close()
+
     # Save table (need headers)
     # print(tabulate(table, headers, tablefmt="simple"))
 
-    resfile = args.cfgfile.replace('.cfg', '-I{str(args.current[0])}A.csv')
+    resfile = args.cfgfile.replace('.cfg', f'-I{str(args.current[0])}A.csv')
     if e.isMasterRank(): 
         print(f"Export result to csv: {os.getcwd() + '/' + resfile}")
     with open(resfile,"w+") as f:
@@ -0,0 +1,44 @@
+"""
+Convergence telemetry for workflows
+
+One json record per iteration is appended to the telemetry file
+and flushed right away so that long runs can be monitored live, eg:
+
+tail -f HL-31-cfpdes-thelec-Axi-sim-telemetry.jsonl
+"""
+
+import json
+import time
+
+class Telemetry():
+    """
+    write per-iteration records as json lines (master rank only)
+    """
+
+    def __init__(self, e, filename: str = ""):
+        self.file = None
+        if filename and e.isMasterRank():
+            print(f"Telemetry: {filename}")
+            self.file = open(filename, "w")
+        self.timers = {}
+
+    def start(self, name: str):
+        self.timers[name] = self.timers.get(name, 0) - time.perf_counter()
+
+    def stop(self, name: str):
+        self.timers[name] += time.perf_counter()
+
+    def write(self, record: dict):
+        """
+        write record along with timers, then reset timers
+        """
+        if self.file:
+            record["time"] = self.timers
+            self.file.write(json.dumps(record, default=float) + "\n")
+            self.file.flush()
+        self.timers = {}
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,132 @@
+"""
+Tabulated water properties
+
+The table is computed once offline with iapws (IAPWS-IF97)
+over the operating T/P range and saved as a numpy array (.npy)
+along with a json header describing the grid:
+
+python -m python_magnetsetup.workflows.waterprops water_props --Tmin 273.16 --Tmax 373.15
+
+At runtime the table is memory-mapped and properties are
+obtained by bilinear interpolation on the (T, P) grid.
+"""
+
+from typing import Union
+
+import sys
+import json
+import argparse
+
+import numpy as np
+
+# name, unit
+props = [
+    ("rho", "kg/m3"),
+    ("Cp", "J/kg/K"),
+    ("mu", "Pa.s"),
+    ("k", "W/m/K"),
+]
+
+def generate(basename: str, Tmin: float, Tmax: float, nT: int, Pmin: float, Pmax: float, nP: int, debug: bool = False):
+    """
+    compute water properties table with iapws
+
+    T: K
+    P: bar
+    """
+    from iapws import IAPWS97
+
+    T = np.linspace(Tmin, Tmax, nT)
+    P = np.linspace(Pmin, Pmax, nP)
+
+    table = np.empty((len(props), nT, nP))
+    for i, t in enumerate(T):
+        for j, p in enumerate(P):
+            # iapws expects pressure in MPa and returns cp in kJ/kg/K
+            water = IAPWS97(T=float(t), P=float(p)*0.1)
+            table[0, i, j] = water.rho
+            table[1, i, j] = water.cp * 1.e+3
+            table[2, i, j] = water.mu
+            table[3, i, j] = water.k
+        if debug:
+            print(f"T={t}: {table[:, i, 0]}")
+
+    np.save(basename + ".npy", table)
+
+    header = {
+        "T": {"min": Tmin, "max": Tmax, "n": nT, "unit": "K"},
+        "P": {"min": Pmin, "max": Pmax, "n": nP, "unit": "bar"},
+        "props": {name: unit for (name, unit) in props}
+    }
+    with open(basename + ".json", "w") as f:
+        f.write(json.dumps(header, indent=4))
+
+    print(f"Water properties saved to {basename}.npy ({nT}x{nP} points)")
+    pass
+
+class WaterTable():
+    """
+    memory-mapped water properties table
+    """
+
+    def __init__(self, basename: str, debug: bool = False):
+        with open(basename + ".json", "r") as f:
+            header = json.loads(f.read())
+        self.table = np.load(basename + ".npy", mmap_mode='r')
+
+        self.names = [name for name in header["props"]]
+        self.Tmin = header["T"]["min"]
+        self.Tmax = header["T"]["max"]
+        self.nT = header["T"]["n"]
+        self.Pmin = header["P"]["min"]
+        self.Pmax = header["P"]["max"]
+        self.nP = header["P"]["n"]
+        if self.table.shape != (len(self.names), self.nT, self.nP):
+            raise RuntimeError(f"WaterTable: {basename}.npy shape {self.table.shape} does not match {basename}.json")
+
+        if debug:
+            print(f"WaterTable: T=[{self.Tmin}, {self.Tmax}] K ({self.nT}), P=[{self.Pmin}, {self.Pmax}] bar ({self.nP})")
+
+    def __call__(self, name: str, T: Union[float, np.ndarray], P: Union[float, np.ndarray]):
+        """
+        bilinear interpolation of property name at (T, P)
+
+        T and P may be scalars or arrays (broadcast together),
+        values outside the table range are clipped
+        """
+        values = self.table[self.names.index(name)]
+
+        (T, P) = np.broadcast_arrays(np.asarray(T, dtype=float), np.asarray(P, dtype=float))
+        x = (np.clip(T, self.Tmin, self.Tmax) - self.Tmin) / (self.Tmax - self.Tmin) * (self.nT - 1)
+        y = (np.clip(P, self.Pmin, self.Pmax) - self.Pmin) / (self.Pmax - self.Pmin) * (self.nP - 1)
+        i = np.minimum(x.astype(int), self.nT - 2)
+        j = np.minimum(y.astype(int), self.nP - 2)
+        fx = x - i
+        fy = y - j
+
+        res = (1-fx) * (1-fy) * values[i, j] \
+            + fx * (1-fy) * values[i+1, j] \
+            + (1-fx) * fy * values[i, j+1] \
+            + fx * fy * values[i+1, j+1]
+
+        if res.ndim == 0:
+            return float(res)
+        return res
+
+def main():
+    parser = argparse.ArgumentParser(description="Create tabulated water properties (requires iapws)")
+    parser.add_argument("basename", help="output basename (ex. water_props)", type=str)
+    parser.add_argument("--Tmin", help="min temperature in K", type=float, default=273.16)
+    parser.add_argument("--Tmax", help="max temperature in K", type=float, default=373.15)
+    parser.add_argument("--nT", help="number of temperature points", type=int, default=201)
+    parser.add_argument("--Pmin", help="min pressure in bar", type=float, default=1)
+    parser.add_argument("--Pmax", help="max pressure in bar", type=float, default=30)
+    parser.add_argument("--nP", help="number of pressure points", type=int, default=59)
+    parser.add_argument("--debug", help="activate debug", action='store_true')
+    args = parser.parse_args()
+
+    generate(args.basename, args.Tmin, args.Tmax, args.nT, args.Pmin, args.Pmax, args.nP, args.debug)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
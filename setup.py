@@ -71,7 +71,8 @@ setup(
         'templates/cfpdes/3D/thelec/*.mustache', 
         'templates/cfpdes/3D/thelec/*.json',
         'templates/CG/3D/thelec/*.mustache', 
-        'templates/CG/3D/thelec/*.json'
+        'templates/CG/3D/thelec/*.json',
+        'templates/jobmanager/*.mustache'
         ]},
     setup_requires=setup_requirements,
     test_suite='tests',
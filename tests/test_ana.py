@@ -0,0 +1,136 @@
+"""Tests for analytic field maps (python_magnetsetup.ana, python_magnetsetup.anafield)
+
+MagnetTools and python_magnetgeo are replaced by stubs:
+MagnetTools elements keep their constructor arguments
+and the field evaluator (see stub_field) is computed from them.
+"""
+
+import sys
+import types
+import multiprocessing
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+# elements weighting the field of stub_field (see element_weight)
+zweight = 0.5
+
+class Element():
+    """MagnetTools UnifMagnet/BitterMagnet stub"""
+
+    def __init__(self, r2, r1, h, j, z_offset, fillingfactor, rho):
+        self.args = (r2, r1, h, j, z_offset, fillingfactor, rho)
+        self.z_offset = z_offset
+
+def element_weight(element: Element) -> float:
+    return 1. if element.z_offset > zweight else 1.e-6
+
+def stub_field(Tubes, Helices, OHelices, BMagnets, UMagnets, Shims, r, z):
+    """
+    field evaluator stub: Br = r, Bz = z + weighted number of UMagnets
+    calls are recorded in calls (number of points)
+    """
+    calls.append(len(r))
+    return np.column_stack((r, z + sum(element_weight(e) for e in UMagnets)))
+
+calls = []
+
+def stub_modules() -> dict:
+    mt = types.ModuleType("MagnetTools.MagnetTools")
+    mt.BitterMagnet = Element
+    mt.BitterfMagnet = Element
+    mt.UnifMagnet = Element
+    for name in ["VectorOfBitters", "VectorOfUnifs", "VectorOfTubes", "VectorOfShims", "VectorOfStacks"]:
+        setattr(mt, name, type(name, (list,), {}))
+    package = types.ModuleType("MagnetTools")
+    package.MagnetTools = mt
+
+    geo = types.ModuleType("python_magnetgeo")
+    for name in ["Insert", "MSite", "Supra", "python_magnetgeo"]:
+        setattr(geo, name, type(name, (), {}))
+    geo.Bitter = SimpleNamespace(Bitter=type("Bitter", (), {}))
+    geo.SupraStructure = type("SupraStructure", (), {"HTSinsert": type("HTSinsert", (), {})})
+
+    fields = types.ModuleType("stub_fields")
+    fields.field = stub_field
+    return {"MagnetTools": package, "MagnetTools.MagnetTools": mt, "python_magnetgeo": geo, "stub_fields": fields}
+
+@pytest.fixture(scope="module")
+def ana():
+    with pytest.MonkeyPatch.context() as mp:
+        for (name, module) in stub_modules().items():
+            mp.setitem(sys.modules, name, module)
+        for name in ["python_magnetsetup.ana", "python_magnetsetup.anafield"]:
+            mp.delitem(sys.modules, name, raising=False)
+        import python_magnetsetup
+        from python_magnetsetup import ana, anafield
+        yield SimpleNamespace(ana=ana, anafield=anafield)
+        for name in ["ana", "anafield"]:
+            sys.modules.pop(f"python_magnetsetup.{name}", None)
+            if hasattr(python_magnetsetup, name):
+                delattr(python_magnetsetup, name)
+
+def umagnets(ana, zs):
+    data = ana.ana.empty_data()
+    data["UMagnets"] = ana.ana.elements_data([(2., 1., 0.1, 1., z, 1., 0.) for z in zs])
+    return data
+
+def test_load_evaluator(ana):
+    assert ana.ana.load_evaluator("stub_fields:field") is stub_field
+    with pytest.raises(ValueError):
+        ana.ana.load_evaluator("stub_fields")
+
+def test_field(ana):
+    model = ana.ana.create_model(umagnets(ana, [1., 1.]))
+    r = np.linspace(0, 1, 5)
+    z = np.linspace(-1, 1, 5)
+    del calls[:]
+    res = ana.ana.field(model, r, z, stub_field)
+    assert calls == [5]
+    assert np.allclose(res, np.column_stack((r, z + 2)))
+
+    with pytest.raises(RuntimeError):
+        ana.ana.field(model, r, z, lambda *args: np.zeros(2))
+
+def test_chunks(ana):
+    assert ana.anafield.chunks(10, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert ana.anafield.chunks(0, 4) == []
+
+@pytest.mark.parametrize("nprocs", [1, 3])
+def test_fieldmap(ana, nprocs):
+    if nprocs > 1 and multiprocessing.get_start_method() != "fork":
+        pytest.skip("stub modules are only inherited by forked workers")
+
+    data = umagnets(ana, [1., 1., 0.])
+    (r, z) = ana.anafield.grid(0, 1, 7, -1, 1, 9)
+    del calls[:]
+    res = ana.anafield.fieldmap(data, r, z, "stub_fields:field", nprocs=nprocs, chunksize=10)
+    assert res["Br"].shape == r.shape
+    assert np.allclose(res["Br"], r)
+    assert np.allclose(res["Bz"], z + 2 + 1.e-6)
+    if nprocs == 1:
+        # one evaluator call per chunk
+        assert calls == [10] * 6 + [3]
+
+def dblepancake(z0: float, h: float = 0.1, n: int = 3):
+    tape = SimpleNamespace(h=h/2., w=0.001, getFillingFactor=lambda: 1., getArea=lambda: 1.)
+    pancake = SimpleNamespace(n=n, tape=tape, getH=lambda: h/2., getFillingFactor=lambda: 1., getArea=lambda: 1.,
+                              getR=lambda: [0.1 + 0.001*i for i in range(n)])
+    return SimpleNamespace(pancake=pancake, getH=lambda: h, getZ0=lambda: z0, getFillingFactor=lambda: 1., getArea=lambda: 1.)
+
+def test_adaptive(ana):
+    # only the double pancake above zweight contributes to the field,
+    # each refinement adds elements so its error is above tol
+    struct = SimpleNamespace(name="S", r0=0.1, r1=0.2, dblepancakes=[dblepancake(z) for z in [-1., 0., 1.]])
+    data = ana.ana.adaptive_UMagnets_data(struct, [0., 0.], [-0.1, 0.1], stub_field, tol=1.e-3)
+
+    ntapes = 2 * 3
+    assert len(data["r1"]) == 1 + 1 + ntapes
+    assert np.allclose(data["z_offset"][:2], [-1., 0.])
+    assert np.all(data["z_offset"][2:] > zweight)
+
+    # with a large tolerance no double pancake is refined
+    data = ana.ana.adaptive_UMagnets_data(struct, [0.], [0.], stub_field, tol=10.)
+    assert len(data["r1"]) == 3
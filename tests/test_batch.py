@@ -0,0 +1,118 @@
+"""Tests for batch jobs (python_magnetsetup.batch) run with the FakeScheduler."""
+
+import os
+
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("chevron")
+
+from python_magnetsetup import batch
+from python_magnetsetup.machines import machine, jobmanager, load_machines, JobManagerType
+
+templates = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "python_magnetsetup", "templates")
+MyEnv = SimpleNamespace(template_path=lambda: templates)
+
+stages = ["Unpack", "CAD", "Mesh", "Partition", "Run", "Postprocessing", "Save"]
+
+
+def create_cmds(stages: list) -> dict:
+    """cmds appending their stage name to a log"""
+    cmds = {"Pre": "export NP=2"}
+    for stage in stages:
+        cmds[stage] = f"echo {stage} >> stages.log"
+    return cmds
+
+
+def slurm(cores: int = 8, multithreading: bool = False) -> machine:
+    return machine("test", "localhost", cores=cores, multithreading=multithreading, manager=jobmanager(JobManagerType.slurm))
+
+
+def test_chain(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cmds = create_cmds(stages)
+    jobs = batch.create_jobs(MyEnv, slurm(), "HL-test", cmds, 4, workdir=str(tmp_path))
+
+    assert [job.stage for job in jobs] == stages
+    after = {job.stage: job.after for job in jobs}
+    assert after == {"Unpack": None, "CAD": "Unpack", "Mesh": "CAD", "Partition": "Mesh", "Run": "Partition",
+                     "Postprocessing": "Run", "Save": "Run"}
+    assert all(job.array == 0 for job in jobs)
+
+    sched = batch.scheduler(JobManagerType.slurm, fake=True)
+    ids = batch.submit(jobs, sched)
+    assert all(sched.jobs[jobid]["status"] == 0 for jobid in ids.values())
+    assert (tmp_path / "stages.log").read_text().split() == stages
+
+    # jobs after a failing one are never run
+    cmds["Mesh"] = "false"
+    jobs = batch.create_jobs(MyEnv, slurm(), "HL-test", cmds, 4, workdir=str(tmp_path))
+    sched = batch.FakeScheduler()
+    ids = batch.submit(jobs, sched)
+    status = {stage: sched.jobs[jobid]["status"] for (stage, jobid) in ids.items()}
+    assert status["CAD"] == 0 and status["Mesh"] != 0
+    assert all(status[stage] == -1 for stage in ["Partition", "Run", "Postprocessing", "Save"])
+
+
+def test_write_submit(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    jobs = batch.create_jobs(MyEnv, slurm(), "HL-test", create_cmds(stages), 4)
+    batch.write_submit(jobs, JobManagerType.slurm, "submit.sh")
+    lines = (tmp_path / "submit.sh").read_text().splitlines()
+    assert "jid_Unpack=$(sbatch --parsable HL-test-Unpack.slurm)" in lines
+    assert "jid_Save=$(sbatch --parsable --dependency=afterok:$jid_Run HL-test-Save.slurm)" in lines
+
+
+def test_sweep(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "HL-test.cfg").write_text("directory=cfpdes/HL-test\nmesh.filename=HL-test.json\n")
+    # workflow writing its result in the feelpp directory of its cfg file
+    (tmp_path / "workflow.sh").write_text(
+        "directory=$(sed -n 's/^directory=//p' $1)\n"
+        "mkdir -p feelppdb/$directory && echo $3 > feelppdb/$directory/values.csv\n")
+
+    cmds = create_cmds(["Unpack", "Partition", "Run"])
+    cmds["Workflow"] = "bash workflow.sh HL-test.cfg"
+    (directory, suffix) = batch.sweep_workflow(cmds, "HL-test.cfg", "cfpdes/HL-test")
+    assert directory == "cfpdes/HL-test/I${VALUE}"
+    cmds["Stats"] = f"cp feelppdb/{directory}/values.csv HL-test{suffix}-stats.csv"
+    cmds["Save"] = f"tar czf HL-test{suffix}_res.tgz -C feelppdb/{directory} ."
+
+    sweep = ["25000", "31000"]
+    jobs = batch.create_jobs(MyEnv, slurm(), "HL-test", cmds, 4, workdir=str(tmp_path), sweep=sweep)
+    array = {job.stage: job.array for job in jobs}
+    assert array == {"Unpack": 0, "Partition": 0, "Workflow": 2, "Stats": 2, "Save": 2}
+    assert {job.stage: job.after for job in jobs}["Stats"] == "Workflow"
+    assert "#SBATCH --array=0-1" in (tmp_path / "HL-test-Workflow.slurm").read_text()
+
+    sched = batch.FakeScheduler()
+    batch.submit(jobs, sched)
+    assert all(job["status"] == 0 for job in sched.jobs.values())
+    for value in sweep:
+        assert (tmp_path / f"HL-test-I{value}.cfg").read_text().startswith(f"directory=cfpdes/HL-test/I{value}\n")
+        assert (tmp_path / "feelppdb" / "cfpdes" / "HL-test" / f"I{value}" / "values.csv").read_text().strip() == value
+        assert (tmp_path / f"HL-test-I{value}-stats.csv").read_text().strip() == value
+        assert (tmp_path / f"HL-test-I{value}_res.tgz").is_file()
+
+    # cmds not created for a sweep are rejected
+    with pytest.raises(RuntimeError):
+        batch.create_jobs(MyEnv, slurm(), "HL-test", create_cmds(["Run", "Workflow"]), 4, sweep=sweep)
+
+
+def test_resources(tmp_path, monkeypatch):
+    server = load_machines()["stokes"]
+    assert server.manager.otype == JobManagerType.slurm
+    # 64 cores with multithreading: 32 physical cores per node
+    assert batch.resources(server, 1) == (1, 1)
+    assert batch.resources(server, 32) == (1, 32)
+    assert batch.resources(server, 48) == (2, 24)
+    assert batch.resources(server, 65) == (3, 22)
+    assert batch.resources(slurm(cores=8), 20) == (3, 7)
+
+    monkeypatch.chdir(tmp_path)
+    batch.create_jobs(MyEnv, server, "HL-test", create_cmds(["Mesh", "Run"]), 48)
+    run = (tmp_path / "HL-test-Run.slurm").read_text()
+    assert "#SBATCH -N 2" in run and "#SBATCH -n 48" in run and "#SBATCH --ntasks-per-node=24" in run
+    mesh = (tmp_path / "HL-test-Mesh.slurm").read_text()
+    assert "#SBATCH -N 1" in mesh and "#SBATCH -n 1" in mesh
@@ -0,0 +1,102 @@
+"""Tests for the json renderer of mustache templates (python_magnetsetup.jsonmodel)
+
+python_magnetgeo is replaced by a stub (imported by python_magnetsetup.units).
+"""
+
+import os
+import sys
+import json
+import types
+
+import pytest
+
+pytest.importorskip("chevron")
+pytest.importorskip("pint")
+
+templates = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "python_magnetsetup", "templates")
+
+@pytest.fixture(scope="module")
+def jsonmodel():
+    geo = types.ModuleType("python_magnetgeo")
+    for name in ["Insert", "MSite", "Bitter", "Supra", "Supras", "Bitters", "SupraStructure", "python_magnetgeo"]:
+        setattr(geo, name, types.ModuleType(name))
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setitem(sys.modules, "python_magnetgeo", geo)
+        loaded = set(sys.modules)
+        import python_magnetsetup
+        from python_magnetsetup import jsonmodel
+        yield jsonmodel
+        # drop modules bound to the stub
+        for name in set(sys.modules) - loaded:
+            if name.startswith("python_magnetsetup."):
+                del sys.modules[name]
+                if hasattr(python_magnetsetup, name.split(".")[1]):
+                    delattr(python_magnetsetup, name.split(".")[1])
+
+def render(jsonmodel, tmp_path, template: str, data: dict) -> str:
+    filename = tmp_path / "template.mustache"
+    filename.write_text(template)
+    return jsonmodel.render(str(filename), data)
+
+items = [{"name": "H1", "value": 1}, {"name": "H2", "value": 2}, {"name": "H3", "value": 3}]
+
+@pytest.mark.parametrize("separator", ["", ","])
+def test_separators(jsonmodel, tmp_path, separator):
+    template = '{\n{{#items}}\n  "{{name}}": {"expr": "{{value}}"}%s\n{{/items}}\n}' % separator
+    text = render(jsonmodel, tmp_path, template, {"items": items})
+    assert json.loads(text) == {"H1": {"expr": "1"}, "H2": {"expr": "2"}, "H3": {"expr": "3"}}
+
+    # single item
+    text = render(jsonmodel, tmp_path, template, {"items": items[:1]})
+    assert json.loads(text) == {"H1": {"expr": "1"}}
+
+@pytest.mark.parametrize("separator", ["", ","])
+def test_list_separators(jsonmodel, tmp_path, separator):
+    template = '{"names": [{{#items}}"{{name}}"%s{{/items}}], "last": 0}' % separator
+    text = render(jsonmodel, tmp_path, template, {"items": items})
+    assert json.loads(text) == {"names": ["H1", "H2", "H3"], "last": 0}
+
+def test_empty(jsonmodel, tmp_path):
+    template = '{\n "a": [{{#items}}"{{name}}",{{/items}}],\n "b": {\n{{#items}}\n  "{{name}}": {{value}},\n{{/items}}\n },\n "c": 1\n}'
+    text = render(jsonmodel, tmp_path, template, {"items": []})
+    assert json.loads(text) == {"a": [], "b": {}, "c": 1}
+
+    # missing key and inverted section
+    template = '{"a": [{{#items}}{{value}}{{/items}}]{{^items}}, "none": true{{/items}}}'
+    assert json.loads(render(jsonmodel, tmp_path, template, {})) == {"a": [], "none": True}
+
+def test_nested(jsonmodel, tmp_path):
+    template = ('{\n{{#helices}}\n "{{name}}": {\n  "markers": [{{#sections}}"{{name}}_{{.}}",{{/sections}}],\n'
+                '  "material": "{{material.name}}", "T": {{Tinit}}\n },\n{{/helices}}\n}')
+    data = {"Tinit": 293, "helices": [{"name": "H1", "sections": [1, 2], "material": {"name": "Cu"}},
+                                      {"name": "H2", "sections": [], "material": {"name": "CuAg"}}]}
+    text = render(jsonmodel, tmp_path, template, data)
+    assert json.loads(text) == {"H1": {"markers": ["H1_1", "H1_2"], "material": "Cu", "T": 293},
+                                "H2": {"markers": [], "material": "CuAg", "T": 293}}
+
+def test_lookup(jsonmodel, tmp_path):
+    # . is the current item, lists and dicts are rendered as json
+    template = '{"values": [{{#values}}{{.}}{{/values}}], "markers": {{markers}}, "bc": {{bc}}, "x": "{{missing}}"}'
+    data = {"values": [1, 2.5], "markers": ["H1", "H2"], "bc": {"expr": "0"}}
+    text = render(jsonmodel, tmp_path, template, data)
+    assert json.loads(text) == {"values": [1, 2.5], "markers": ["H1", "H2"], "bc": {"expr": "0"}, "x": ""}
+
+    scopes = [{"a": {"b": {"c": 1}}, "d": 2}, {"d": 3}]
+    assert jsonmodel._lookup("a.b.c", scopes) == 1
+    assert jsonmodel._lookup("d", scopes) == 3
+    assert jsonmodel._lookup(".", scopes) == {"d": 3}
+    assert jsonmodel._lookup("a.x", scopes) is None
+
+def test_loads(jsonmodel):
+    assert jsonmodel.loads('{"a": 1}') == {"a": 1}
+    with pytest.raises(ValueError) as e:
+        jsonmodel.loads('{\n  "a": 1\n  "b": 2\n}', "model.mustache")
+    lines = str(e.value).splitlines()
+    assert lines[0].startswith("model.mustache: line 3 column 3:")
+    assert lines[1:] == ['  "b": 2', '  ^']
+
+def test_templates(jsonmodel, tmp_path):
+    from python_magnetsetup.precompile import compile_templates
+    report = compile_templates(templates, cachefile=str(tmp_path / "templates.pickle"), repeat=1)
+    assert report
+    assert [res["template"] for res in report if res["error"]] == []
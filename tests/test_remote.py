@@ -0,0 +1,124 @@
+"""Tests for remote execution (python_magnetsetup.remote) with a LocalExecutor."""
+
+import os
+import tarfile
+
+from python_magnetsetup import remote
+from python_magnetsetup.artifacts import Artifact, checksum, save_manifest
+
+
+def create_archive(tarfilename: str, files: dict):
+    """create a simulation archive from a dict of path: content"""
+    with tarfile.open(tarfilename, "w:gz") as tar:
+        for (path, content) in files.items():
+            filename = os.path.join(os.path.dirname(tarfilename), "src", path.lstrip('/'))
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, "w") as f:
+                f.write(content)
+            tar.add(filename, arcname=path.lstrip('/'))
+
+
+def wait_all(names: list, timeout: int = 50) -> str:
+    """cmd creating a marker then waiting for the markers of the other stages"""
+    test = " && ".join([f"[ -f {name} ]" for name in names])
+    return f"for i in $(seq {timeout}); do {test} && exit 0; sleep 0.1; done; exit 1"
+
+
+def test_stream_archive(tmp_path):
+    tarfilename = str(tmp_path / "case.tgz")
+    create_archive(tarfilename, {"case.cfg": "directory=case", "data/case.json": "{}"})
+    executor = remote.LocalExecutor(str(tmp_path / "home"))
+
+    assert remote.stream_archive(executor, tarfilename, "case") == 0
+    with executor.open("case/case.cfg") as f:
+        assert f.read() == b"directory=case"
+    assert os.path.isfile(tmp_path / "home" / "case" / "data" / "case.json")
+
+
+def test_put_artifacts(tmp_path):
+    geom = tmp_path / "geom"
+    geom.mkdir()
+    paths = {}
+    for name in ["HL-31.yaml", "H1.yaml", "material.json"]:
+        paths[name] = str(geom / name)
+        with open(paths[name], "w") as f:
+            f.write(f"content of {name}")
+    artifacts = [Artifact("geom", name, path=path, hash=checksum(path)) for (name, path) in paths.items()]
+    artifacts[2].kind = "local"
+
+    # material.json is removed after setup, only available from the archive
+    tarfilename = str(tmp_path / "case.tgz")
+    with tarfile.open(tarfilename, "w:gz") as tar:
+        tar.add(paths["material.json"], arcname=paths["material.json"].lstrip('/'))
+    os.unlink(paths["material.json"])
+
+    manifestfile = str(tmp_path / "case-manifest.json")
+    save_manifest(manifestfile, artifacts)
+
+    executor = remote.LocalExecutor(str(tmp_path / "home"))
+    store = "store"
+    # HL-31.yaml already on executor
+    os.makedirs(tmp_path / "home" / store)
+    with open(tmp_path / "home" / store / artifacts[0].hash, "w") as f:
+        f.write("content of HL-31.yaml")
+
+    sent = []
+    put_stream = executor.put_stream
+    def record(stream, cmd):
+        with tarfile.open(fileobj=stream, mode="r:gz") as tar:
+            sent.extend(tar.getnames())
+        stream.seek(0)
+        return put_stream(stream, cmd)
+    executor.put_stream = record
+
+    assert remote.put_artifacts(executor, manifestfile, "case", store=store, tarfilename=tarfilename) == 0
+    assert sorted(sent) == sorted([artifacts[1].hash, artifacts[2].hash])
+    for (name, path) in paths.items():
+        with executor.open(f"case/{path.lstrip('/')}") as f:
+            assert f.read() == f"content of {name}".encode()
+
+    # nothing to send once all artifacts are in store
+    del sent[:]
+    assert remote.put_artifacts(executor, manifestfile, "case2", store=store, tarfilename=tarfilename) == 0
+    assert sent == []
+
+
+def test_run_stages(tmp_path):
+    executor = remote.LocalExecutor(str(tmp_path / "home"))
+    os.makedirs(tmp_path / "home" / "case")
+    group = ["Postprocessing", "Stats", "Save"]
+    cmds = {"Pre": "true", "Run": "touch run"}
+    for stage in group:
+        cmds[stage] = f"touch {stage} && " + wait_all(group)
+
+    # stages of a group only succeed if they run concurrently
+    stages = remote.run_stages(executor, "case", cmds)
+    assert list(stages) == ["Run"] + group
+    assert all(status == 0 for (duration, status) in stages.values())
+
+    cmds["Run"] = "false"
+    stages = remote.run_stages(executor, "case", cmds)
+    assert list(stages) == ["Run"]
+    assert stages["Run"][1] != 0
+
+
+def test_puller(tmp_path):
+    executor = remote.LocalExecutor(str(tmp_path / "home"))
+    workdir = tmp_path / "home" / "case"
+    workdir.mkdir()
+    localdir = str(tmp_path / "local")
+
+    puller = remote.Puller(executor, "case", localdir, interval=0.05)
+    puller.start()
+    (workdir / "values.csv").write_text("a,b\n1,2\n")
+    (workdir / "case.cfg").write_text("directory=case")
+    (workdir / "case_res.zip").write_bytes(b"zip")
+    puller.stop()
+
+    assert sorted(os.listdir(localdir)) == ["case_res.zip", "values.csv"]
+    assert (tmp_path / "local" / "values.csv").read_text() == "a,b\n1,2\n"
+
+    # modified results are pulled again
+    (workdir / "values.csv").write_text("a,b\n1,2\n3,4\n")
+    puller.pull()
+    assert (tmp_path / "local" / "values.csv").read_text() == "a,b\n1,2\n3,4\n"
@@ -0,0 +1,59 @@
+"""Tests for the measures store (python_magnetsetup.results)."""
+
+import os
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+
+from python_magnetsetup import results
+
+
+def create_run(rootdir, current: float = 31000.0, nsteps: int = 3) -> str:
+    """create a feelppdb result directory with a measures file"""
+    resultdir = os.path.join(rootdir, "cfpdes-thelec-Axi-static-linear", "HL-test", "np_2")
+    measuresdir = os.path.join(resultdir, "cfpdes.heat.measures")
+    os.makedirs(measuresdir, exist_ok=True)
+    df = pd.DataFrame({
+        "Intensity_H1": [current] * nsteps,
+        "Power_H1": [1.e+6 * (i+1) for i in range(nsteps)],
+    })
+    df.to_csv(os.path.join(measuresdir, "values.csv"), index=False)
+    return str(rootdir)
+
+
+def test_format_current():
+    assert results.format_current("31000.0") == "31000"
+    assert results.format_current(31000) == "31000"
+    assert results.format_current("31000.5") == "31000.5"
+
+
+def test_roundtrip(tmp_path):
+    feelppdb = create_run(tmp_path / "feelppdb")
+    store = str(tmp_path / "store")
+
+    runs = results.ingest([feelppdb], store, nworkers=1)
+    assert len(runs) == 1
+    assert runs["current"].iloc[0] == "31000"
+
+    for current in ["31000", "31000.0"]:
+        table = results.query(store, magnet="HL-test", current=current)
+        assert len(table) == 1
+        assert table["current"].iloc[0] == "31000"
+        assert table["Power_H1"].iloc[0] == pytest.approx(3.e+6)
+
+    assert results.query(store, current="25000").empty
+
+
+def test_force_ingest(tmp_path):
+    feelppdb = create_run(tmp_path / "feelppdb")
+    store = str(tmp_path / "store")
+
+    results.ingest([feelppdb], store, nworkers=1)
+    assert results.ingest([feelppdb], store, nworkers=1).empty
+
+    results.ingest([feelppdb], store, nworkers=1, force=True)
+    table = results.query(store, last=False)
+    assert len(table) == 3
+    assert len(results.load_index(store)) == 1